@@ -93,6 +93,7 @@ def main():
         response = requests.get(URL + 'login', json = json_object)
 
         if response.status_code == 200:   
+            make_cancel.SESSION_HEADERS["Authorization"] = "Bearer " + response.json()["detail"]["token"]
             menu(staff_id)
 
             conf = input("Do you want to login again? [y/n]: ")
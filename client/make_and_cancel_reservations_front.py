@@ -15,6 +15,9 @@ import main_front
 # Base URL
 URL = 'http://127.0.0.1:8000/v2_0/'
 
+# The Authorization header of the session started at login
+SESSION_HEADERS = {}
+
 
 def resource_name(book):
     '''
@@ -94,7 +97,7 @@ def print_details(json_object):
     '''
     
     # Posting the request
-    response = requests.post(URL + "reservations", json = json_object)
+    response = requests.post(URL + "reservations", json = json_object, headers = SESSION_HEADERS)
     response_info = response.json()
 
     if response.status_code == 201:
@@ -357,7 +360,7 @@ def cancellation(staff_id):
         }
         
         # Deleting the request
-        response = requests.delete(URL + 'reservations', json = json_object)
+        response = requests.delete(URL + 'reservations', json = json_object, headers = SESSION_HEADERS)
         response_info = response.json()
 
         if response.status_code == 200:
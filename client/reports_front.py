@@ -100,74 +100,54 @@ def all_reservations_for_user():
         "customer_id": name 
     }
 
-    response = requests.get(URL + 'reservations', params = json_object)
-    response_info = response.json()
     results_per_page = 10
+    json_object["limit"] = results_per_page
+
+    # Each page is only fetched when the user asks for it
+    response = requests.get(URL + 'reservations', params = json_object, headers = make_cancel.SESSION_HEADERS)
+    response_info = response.json()
     
     if response.status_code == 200 and len(response_info["detail"]["reservations"]) > 0:
         print("\nReport of current reservations for "+ name +":-")
-
-        n = len(response_info["detail"]["reservations"])
         more = True
-        i = 0
-
-        while (more and n > 0):
-            if n < results_per_page:
-                reservation_list = []
-                for j in range(i, i + n):
-                    row = []
-                    reservation = response_info["detail"]["reservations"][j]
-                    row.append(reservation["reservation_id"])
-                    row.append(reservation["customer_id"])
-                    row.append(reservation["resource"])
-                    row.append(reservation["start_date"])
-                    row.append(reservation["end_date"])
-                    row.append(reservation["start_time"])
-                    row.append(reservation["end_time"])
-                    row.append(reservation["total_cost"])
-                    row.append(reservation["down_payment"])
-                    more = False
-                    reservation_list.append(row)
-                
-                reservation_df = pd.DataFrame(reservation_list, columns = ['Reservation ID','Customer ID','Resource','Start date','End date','Start time','End time','Total Cost ($)','Downpayment ($)'])
-                print(reservation_df.to_string(index=False))
 
-            else:
-                reservation_list = []
-                for j in range(i, i + results_per_page):
-                    row = []
-                    reservation = response_info["detail"]["reservations"][j]
-                    row.append(reservation["reservation_id"])
-                    row.append(reservation["customer_id"])
-                    row.append(reservation["resource"])
-                    row.append(reservation["start_date"])
-                    row.append(reservation["end_date"])
-                    row.append(reservation["start_time"])
-                    row.append(reservation["end_time"])
-                    row.append(reservation["total_cost"])
-                    row.append(reservation["down_payment"])
-                    reservation_list.append(row)
-
-                reservation_df = pd.DataFrame(reservation_list, columns = ['Reservation ID','Customer ID','Resource','Start date','End date','Start time','End time','Total Cost ($)','Downpayment ($)'])
-                print(reservation_df.to_string(index=False))
-                
-                i = i + results_per_page
-                n = n - results_per_page
-                        
-                if (n > 0):
-                    conf = input("Do you want to view the next 10 reservations? [y/n]: ")
-                    while conf not in ['Y', 'y', 'N', 'n']:
-                        print("Please enter valid input: y or n")
-                        conf = input("Do you want to view the next 10 reservations? [y/n]: ")
-                    check = make_cancel.confirm(conf)
-
-                    if check == "Yes":
-                        continue
-
-                    else:
-                        more = False
-                else:
+        while more:
+            reservation_list = []
+            for reservation in response_info["detail"]["reservations"]:
+                row = []
+                row.append(reservation["reservation_id"])
+                row.append(reservation["customer_id"])
+                row.append(reservation["resource"])
+                row.append(reservation["start_date"])
+                row.append(reservation["end_date"])
+                row.append(reservation["start_time"])
+                row.append(reservation["end_time"])
+                row.append(reservation["total_cost"])
+                row.append(reservation["down_payment"])
+                reservation_list.append(row)
+
+            reservation_df = pd.DataFrame(reservation_list, columns = ['Reservation ID','Customer ID','Resource','Start date','End date','Start time','End time','Total Cost ($)','Downpayment ($)'])
+            print(reservation_df.to_string(index=False))
+
+            if response_info["detail"]["next_cursor"] is None:
+                more = False
+                continue
+
+            conf = input("Do you want to view the next 10 reservations? [y/n]: ")
+            while conf not in ['Y', 'y', 'N', 'n']:
+                print("Please enter valid input: y or n")
+                conf = input("Do you want to view the next 10 reservations? [y/n]: ")
+            check = make_cancel.confirm(conf)
+
+            if check == "Yes":
+                json_object["cursor"] = response_info["detail"]["next_cursor"]
+                response = requests.get(URL + 'reservations', params = json_object, headers = make_cancel.SESSION_HEADERS)
+                response_info = response.json()
+                if response.status_code != 200:
+                    print(response_info["detail"])
                     more = False
+            else:
+                more = False
         
     elif response.status_code == 200 and len(response_info["detail"]["reservations"]) == 0:
         print("Currently, there aren't any reservations in the system.")
@@ -194,71 +174,53 @@ def financial_transactions():
         "end_date": enddate
     }
 
-    response = requests.get(URL + 'transactions', params = json_object)
-    response_info = response.json()
     results_per_page = 10
+    json_object["limit"] = results_per_page
+
+    # Each page is only fetched when the user asks for it
+    response = requests.get(URL + 'transactions', params = json_object, headers = make_cancel.SESSION_HEADERS)
+    response_info = response.json()
     
     if response.status_code == 200 and len(response_info["detail"]["transactions"]) > 0:
         print("\nReport of all the financial transactions:-")
-        n = len(response_info["detail"]["transactions"])
         more = True
-        i = 0
-
-        while (more and n > 0):
-            if n < results_per_page:
-                transaction_list = []
-                for j in range(i, i + n):
-                    transaction = response_info["detail"]["transactions"][j]
-                    row = []
-                    row.append(transaction["transaction_id"])
-                    row.append(transaction["transaction_type"])
-                    row.append(transaction["transaction_date"])
-                    row.append(transaction["reservation_id"])
-                    row.append(transaction["customer_id"])
-                    row.append(transaction["resource"])
-                    row.append(transaction["total_cost"])
-                    row.append(transaction["transaction_amount"])
-                    transaction_list.append(row)
-                    more = False
 
-                transaction_df = pd.DataFrame(transaction_list, columns = ['Transaction ID','Transaction Type','Transaction date','Reservation ID','Customer ID','Resource','Total Cost ($)','Transaction Amount ($)'])
-                print(transaction_df.to_string(index=False))
-
-            else:
-                transaction_list = []
-                for j in range(i, i + results_per_page):
-                    transaction = response_info["detail"]["transactions"][j]
-                    row = []
-                    row.append(transaction["transaction_id"])
-                    row.append(transaction["transaction_type"])
-                    row.append(transaction["transaction_date"])
-                    row.append(transaction["reservation_id"])
-                    row.append(transaction["customer_id"])
-                    row.append(transaction["resource"])
-                    row.append(transaction["total_cost"])
-                    row.append(transaction["transaction_amount"])
-                    transaction_list.append(row)
-
-                transaction_df = pd.DataFrame(transaction_list, columns = ['Transaction ID','Transaction Type','Transaction date','Reservation ID','Customer ID','Resource','Total Cost ($)','Transaction Amount ($)'])
-                print(transaction_df.to_string(index=False))
-
-                i = i + results_per_page
-                n = n - results_per_page
-                        
-                if (n > 0):
-                    conf = input("Do you want to view the next 10 financial transactions? [y/n]: ")
-                    while conf not in ['Y', 'y', 'N', 'n']:
-                        print("Please enter valid input: y or n")
-                        conf = input("Do you want to view the next 10 financial transactions? [y/n]: ")
-                    check = make_cancel.confirm(conf)
-
-                    if check == "Yes":
-                        continue
-
-                    else:
-                        more = False
-                else:
+        while more:
+            transaction_list = []
+            for transaction in response_info["detail"]["transactions"]:
+                row = []
+                row.append(transaction["transaction_id"])
+                row.append(transaction["transaction_type"])
+                row.append(transaction["transaction_date"])
+                row.append(transaction["reservation_id"])
+                row.append(transaction["customer_id"])
+                row.append(transaction["resource"])
+                row.append(transaction["total_cost"])
+                row.append(transaction["transaction_amount"])
+                transaction_list.append(row)
+
+            transaction_df = pd.DataFrame(transaction_list, columns = ['Transaction ID','Transaction Type','Transaction date','Reservation ID','Customer ID','Resource','Total Cost ($)','Transaction Amount ($)'])
+            print(transaction_df.to_string(index=False))
+
+            if response_info["detail"]["next_cursor"] is None:
+                more = False
+                continue
+
+            conf = input("Do you want to view the next 10 financial transactions? [y/n]: ")
+            while conf not in ['Y', 'y', 'N', 'n']:
+                print("Please enter valid input: y or n")
+                conf = input("Do you want to view the next 10 financial transactions? [y/n]: ")
+            check = make_cancel.confirm(conf)
+
+            if check == "Yes":
+                json_object["cursor"] = response_info["detail"]["next_cursor"]
+                response = requests.get(URL + 'transactions', params = json_object, headers = make_cancel.SESSION_HEADERS)
+                response_info = response.json()
+                if response.status_code != 200:
+                    print(response_info["detail"])
                     more = False
+            else:
+                more = False
                     
     elif response.status_code == 200 and len(response_info["detail"]["transactions"]) == 0:
         print("Currently, there aren't any financial transactions in the system.")
@@ -69,7 +69,7 @@ def add_staff(staff_id):
         }
         
         # Posting the request
-        response = requests.post(URL + 'staffs', json = json_object)
+        response = requests.post(URL + 'staffs', json = json_object, headers = make_cancel.SESSION_HEADERS)
         print(get_response_message(response))
         '''
         if response.status_code == 201:
@@ -117,7 +117,7 @@ def delete_staff(staff_id):
         }
         
         # Deleting the request
-        response = requests.delete(URL + 'staffs', json = json_object)
+        response = requests.delete(URL + 'staffs', json = json_object, headers = make_cancel.SESSION_HEADERS)
         print(get_response_message(response))
         '''
         if response.status_code == 200:
@@ -172,7 +172,7 @@ def modify_staff(staff_id):
         }
         
         # Putting the request
-        response = requests.put(URL + 'staffs', json = json_object)
+        response = requests.put(URL + 'staffs', json = json_object, headers = make_cancel.SESSION_HEADERS)
         print(get_response_message(response))
         '''
         if response.status_code == 200:
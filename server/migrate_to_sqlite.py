@@ -0,0 +1,40 @@
+# File Name: migrate_to_sqlite.py
+# File Description: copy the data file of the reserve system into a SQLite
+# database, to be used with "data_backend": "sqlite" in config.json, and
+# optionally the staff file into a SQLite database, to be used as
+# "staff_data_file" in config.json
+#
+# Usage: python migrate_to_sqlite.py <data/data.txt> <data/data.db> [<data/staff.json> <data/staff.db>]
+
+import sys
+import persist
+import user_management_persist
+
+
+def main():
+    data_file, database_file = sys.argv[1], sys.argv[2]
+    data_manager = persist.DataManager(data_file)
+    database = persist.SQLiteDataManager(database_file)
+    if database.max_reservation_id() or database.max_transaction_id():
+        print(f"{database_file} already contains data")
+    else:
+        database.import_data(data_manager)
+        print(f"Copied {len(data_manager.all_reservations())} reservations and "
+              f"{len(data_manager.all_transactions())} transactions to {database_file}")
+
+    if len(sys.argv) > 4:
+        migrate_staff(sys.argv[3], sys.argv[4])
+
+
+def migrate_staff(staff_file, database_file):
+    staff_data = user_management_persist.UserDataManager(staff_file).load()
+    database = user_management_persist.SQLiteUserDataManager(database_file)
+    if database.load():
+        print(f"{database_file} already contains staff")
+        return
+    database.save(staff_data, changed_by="migrate_to_sqlite")
+    print(f"Copied {len(staff_data)} staff to {database_file}")
+
+
+if __name__ == '__main__':
+    main()
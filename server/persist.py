@@ -3,17 +3,58 @@
 #
 # Date: May 7, 2022
 
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+import bisect, hashlib, os, sqlite3, sys, threading, time
+
 class DataManager:
+    """
+    A process-resident store of all reservations and transactions
+
+    The data file is parsed once and kept in memory. Changes made to the data
+    file by someone else (e.g. tests/reset.py) are detected through its mtime
+    and size, and the file is only rewritten when the data has been modified
+
+    Reports are generated from an immutable Snapshot of the data, which is
+    replaced by a new one each time changes are saved, so they do not need to
+    hold the lock while writers are changing the data
+
+    Attributes:
+        data_file (str): path of the data file
+        lock (Lock): lock to be held while reading or modifying the data, only
+            for a short time when checking a reservation (see locks)
+        locks (LockTable): locks of the parts of the data read to check a
+            reservation, to be held from before it is checked until it is made
+        generation (int): the number of times the data has been loaded
+        version (int): the number of snapshots published
+        snapshot (Snapshot): the data as it was when last loaded or saved
+        dirty (bool): True if in-memory data has not been saved yet
+        file_stat (tuple): (mtime, size) of the data file when last loaded/saved
+    """
     def __init__(self, data_file):
         self.data_file = data_file
-        self.r_manager = ReservationManager()
-        self.t_manager = TransactionManager()
+        self.lock = threading.RLock()
+        self.locks = LockTable()
+        self.generation = 0
+        self.version = 0
         self.load_data()
     
     def load_data(self):
         """
-        Load data from data file to the DataManager
+        Load data from data file to the DataManager, then publish it
+        """
+        self.read_data_file()
+        self.publish()
+
+    def read_data_file(self):
+        """
+        Parse the data file into new reservation and transaction managers,
+        without publishing a snapshot of them
         """
+        self.generation += 1
+        self.r_manager = ReservationManager()
+        self.t_manager = TransactionManager()
         file = open(self.data_file, 'r')
         lines = file.readlines()
         # Read every line from data file, with a hash # seperating the reservations
@@ -21,17 +62,77 @@ class DataManager:
         convert_to_reservation = True
         for line in lines:
             line = line.split()
+            if len(line) == 0:
+                continue
             if line[0] == '#':
                 convert_to_reservation = False
                 continue
             if convert_to_reservation:
                 self.r_manager.add_data(Reservation(line))
             else:
-                self.t_manager.add_data(Transaction(line))
+                transaction = Transaction(line)
+                transaction.share_detail(self.r_manager.select_reservation(transaction.detail.reservation_id))
+                self.t_manager.add_data(transaction)
         file.close()
-    
+        self.dirty = False
+        self.file_stat = self.current_file_stat()
 
-    def close(self):
+    def current_file_stat(self):
+        """
+        Return the modification time and size of the data file
+
+        Returns:
+            (mtime in ns, size in bytes), or None if the file does not exist
+        """
+        try:
+            stat = os.stat(self.data_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def refresh(self):
+        """
+        Reload the data file if it has been changed since it was last loaded
+        or saved by this DataManager
+
+        Returns:
+            True if the data has been reloaded, False otherwise
+        """
+        if self.current_file_stat() == self.file_stat:
+            return False
+        self.load_data()
+        return True
+
+    def begin(self):
+        """
+        Prepare the DataManager for a request that is going to modify data
+        """
+        self.refresh()
+
+    def rollback(self):
+        """
+        Discard the changes that have not been saved yet, by loading the data
+        file again
+        """
+        self.load_data()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager running a request that is going to modify data: the
+        data is saved when the block ends, and the changes are rolled back if
+        the block (or saving them) raises an exception
+        Must be used while holding the lock
+        """
+        self.begin()
+        try:
+            yield self
+            self.close()
+        except BaseException:
+            self.rollback()
+            raise
+
+    def save(self):
         """
         Save data in the DataManager to data file
         """
@@ -41,6 +142,48 @@ class DataManager:
         file.write('#\n')
         self.t_manager.save(file)
         file.close()
+        self.dirty = False
+        self.file_stat = self.current_file_stat()
+
+    def close(self):
+        """
+        Save data in the DataManager to data file if it has been modified,
+        then publish a snapshot of the saved data
+        """
+        if self.dirty:
+            self.save()
+            self.publish()
+
+    def publish(self):
+        """
+        Replace the snapshot read by reports with one of the current data
+        """
+        self.version += 1
+        self.snapshot = Snapshot(self.version, self.r_manager.by_start.snapshot(), self.r_manager.max_span,
+                                 self.t_manager.by_date.snapshot(), self.t_manager.rollups.snapshot())
+
+    def refresh_snapshot(self):
+        """
+        Return the latest snapshot, reloading the data file first if it has
+        been changed externally. The lock is only taken to reload the data
+
+        Returns:
+            A Snapshot object
+        """
+        if self.current_file_stat() != self.file_stat:
+            with self.lock:
+                self.refresh()
+        return self.snapshot
+
+    def data_version(self):
+        """
+        Return the version of the data reports are generated from, which
+        changes every time changes are saved or the data file is reloaded
+
+        Returns:
+            An integer
+        """
+        return self.refresh_snapshot().version
 
     
     def max_reservation_id(self):
@@ -69,6 +212,7 @@ class DataManager:
             reservation (Reservation): reservation to add
         """
         self.r_manager.add_data(reservation)
+        self.dirty = True
     
     def add_transaction(self, transaction):
         """
@@ -77,7 +221,9 @@ class DataManager:
         Args:
             transaction (Transaction): transaction to add
         """
+        transaction.share_detail(self.r_manager.select_reservation(transaction.detail.reservation_id))
         self.t_manager.add_data(transaction)
+        self.dirty = True
     
     def all_reservations(self):
         """
@@ -117,153 +263,1497 @@ class DataManager:
             reservation_id (int)
         """
         self.r_manager.delete_reservation(reservation_id)
+        self.dirty = True
 
+    def reservations_between(self, start_date, end_date, customer_id="", after=None, limit=None):
+        """
+        Return all reservations running on at least one day between two dates,
+        including recurring reservations that started before the first date
 
-class Reservation:
-    """
-    A class representing a single reservation within the system
+        Args:
+            start_date (str): The first date, in mm-dd-yyyy format
+            end_date (str): The last date, in mm-dd-yyyy format
+            customer_id (str): OPTIONAL, only return reservations of this customer
+            after (tuple): OPTIONAL, only return reservations sorted after this
+                (start day, reservation id)
+            limit (int): OPTIONAL, the maximum number of reservations to return
 
-    All dates stored are in the form of a mm-dd-yyyy string
-    Attributes:
-        reservation_id (int): A unique interger for each reservation
-        customer_id (str): The unique string id representing a customer
-        reservation_type (str): The type of reservation made (for workshop,
-            or for a special machine)
-        start_date (str): The starting date of the reservation 
-        end_date (str): The ending date of the reservation
-        date_of_reservation (str): The date on which the reservation is made
-        total (float): A float representing the total cost of this reservation
-        down_payment (float): A float representing the amount required for a down payment
-        reservation_string (str): A string representation of the reservation object
-    """
-    def __init__(self, _reserve):
-        self.reservation_id = int(_reserve[0])
-        self.customer_id = _reserve[1]
-        self.reservation_type = _reserve[2]
-        self.start_date = _reserve[3]
-        self.end_date = _reserve[4]
-        self.start_time = _reserve[5]
-        self.end_time = _reserve[6]
-        self.date_of_reservation = _reserve[7]
-        self.total_cost = float(_reserve[8])
-        self.down_payment = float(_reserve[9])
-        self.data_string = ' '.join(_reserve)
-    
-    def tolist(self):
+        Returns:
+            A list of reservations (List[Reservation]), sorted by start date
+            and reservation id
         """
-        Convert all information in the Reservation object to a list object
+        return self.refresh_snapshot().reservations_between(
+            date_ordinal(start_date), date_ordinal(end_date), customer_id, after, limit)
+
+    def transactions_between(self, start_date, end_date, after=None, limit=None):
+        """
+        Return all transactions made between two dates
+
+        Args:
+            start_date (str): The first date, in mm-dd-yyyy format
+            end_date (str): The last date, in mm-dd-yyyy format
+            after (tuple): OPTIONAL, only return transactions sorted after this
+                (transaction day, transaction id)
+            limit (int): OPTIONAL, the maximum number of transactions to return
 
         Returns:
-            A string that includes all information about the Reservation object
+            A list of transactions (List[Transaction]), sorted by date and
+            transaction id
         """
-        return [str(self.reservation_id), self.customer_id, self.reservation_type,
-                    self.start_date, self.end_date, self.start_time, self.end_time,
-                    self.date_of_reservation, str(self.total_cost), str(self.down_payment)]
+        return self.refresh_snapshot().transactions_between(date_ordinal(start_date), date_ordinal(end_date), after, limit)
 
-    
-class Transaction:
-    """
-    A class representing transactions that have taken place in the system
+    def transactions_summary(self, start_date, end_date, group_by):
+        """
+        Return the totals of the transactions made between two dates
 
-    Attributes:
-        transaction_id (int): A unique interger for each transaction
-        type (str): The type of transaction (CANCELLATION or RESERVATION)
-        transaction_date (str): Date of the transaction in mm-dd-yyyy format
-        detail (Reservation): The Reservation object related to this transaction
-        transaction_string (str): A string representation of the reservation
-            related to this transaction
-    """
-    def __init__(self, transaction):
-        self.transaction_id = int(transaction[0])
-        self.type = transaction[1]
-        self.transaction_date = transaction[2]
-        self.detail = Reservation(transaction[3:13])
-        self.data_string = f'{self.transaction_id} {self.type} {self.transaction_date} {self.detail.data_string} {transaction[-2]} {transaction[-1]}'
+        Args:
+            start_date (str): The first date, in mm-dd-yyyy format
+            end_date (str): The last date, in mm-dd-yyyy format
+            group_by (str): '' for the totals of the whole period, or 'day',
+                'resource' or 'staff' for the totals of each of them
+
+        Returns:
+            A dict mapping each group to its totals, see FinancialRollups
+        """
+        return self.refresh_snapshot().rollups.summary(date_ordinal(start_date), date_ordinal(end_date), group_by)
 
 
-class Manager:
+class JournaledDataManager(DataManager):
     """
+    A DataManager that records every change as a single line appended to a
+    journal file next to the data file, instead of rewriting the whole data
+    file on every change
+
+    The data file is used as a snapshot: the journal starts with a header line
+    holding the SHA-1 checksum of the snapshot it applies to, followed by one
+    record per change:
+        R <reservation>         a reservation has been added
+        D <reservation_id>      a reservation has been deleted
+        T <transaction>         a transaction has been added
+    Once the journal holds compact_every records, all data is written to a new
+    snapshot (in the usual # seperated format) and the journal is emptied.
+    Touching or copying the data file does not invalidate the journal, only a
+    change of its content does (e.g. after the data file has been replaced by
+    tests/reset.py), in which case the journal is ignored with a warning
+
+    Records are fsynced at most every fsync_interval seconds: records appended
+    in between are fsynced by a timer once the interval has passed, so at most
+    fsync_interval seconds of changes can be lost on a power failure
+
     Attributes:
-        data (List): A list that contains data
+        journal_file (str): path of the journal file
+        compact_every (int): number of records after which a snapshot is taken
+        fsync_interval (float): minimum number of seconds between two fsyncs
+            of the journal, 0 to fsync on every commit
+        fsync_timer (Timer): the timer of the deferred fsync, None if there
+            are no unsynced records
     """
-    def __init__(self):
-        self.data = []
-    
-    def add_data(self, data):
+    def __init__(self, data_file, compact_every=1000, fsync_interval=0):
+        self.journal_file = data_file + '.journal'
+        self.compact_every = compact_every
+        self.fsync_interval = fsync_interval
+        self.last_fsync = 0
+        self.fsync_timer = None
+        super().__init__(data_file)
+
+    def load_data(self):
         """
-        Add data
+        Load the snapshot from the data file, then replay the journal on it,
+        and publish the result once
+        """
+        self.read_data_file()
+        self.pending = []
+        self.journal_records = 0
+        self.journal_valid = False
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'r') as file:
+                self.replay(file)
+        self.file_stat = self.current_file_stat()
+        self.publish()
+
+    def replay(self, file):
+        """
+        Apply the records of a journal file to the in-memory data
 
         Args:
-            data: data to add
+            file (file descriptor): the opened journal file
         """
-        self.data.append(data)
-    
-    def save(self, file):
+        header = file.readline().split()
+        if header != ['@', self.snapshot_checksum()]:
+            if file.readline():
+                print(f'Warning: {self.journal_file} does not belong to {self.data_file}, '
+                      'its records are ignored', file=sys.stderr)
+            return
+        self.journal_valid = True
+        for line in file:
+            # A line without a newline was cut off while being written, the
+            # journal is replaced by a snapshot on the next save
+            if not line.endswith('\n'):
+                self.journal_valid = False
+                break
+            record = line.split()
+            if record[0] == 'R':
+                self.r_manager.add_data(Reservation(record[1:]))
+            elif record[0] == 'D':
+                self.r_manager.delete_reservation(int(record[1]))
+            elif record[0] == 'T':
+                transaction = Transaction(record[1:])
+                transaction.share_detail(self.r_manager.select_reservation(transaction.detail.reservation_id))
+                self.t_manager.add_data(transaction)
+            self.journal_records += 1
+
+    def snapshot_checksum(self):
         """
-        Write all data to the designated file descriptor
+        Return the checksum of the content of the data file
+
+        Returns:
+            The SHA-1 checksum of the data file, as a hexadecimal string
+        """
+        checksum = hashlib.sha1()
+        with open(self.data_file, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 16), b''):
+                checksum.update(block)
+        return checksum.hexdigest()
+
+    def snapshot_stat(self):
+        """
+        Return the modification time and size of the data file
+
+        Returns:
+            (mtime in ns, size in bytes), or None if the file does not exist
+        """
+        return super().current_file_stat()
+
+    def current_file_stat(self):
+        """
+        Return the modification times and sizes of the data and journal files
+
+        Returns:
+            A tuple of the stats of both files
+        """
+        try:
+            stat = os.stat(self.journal_file)
+            journal_stat = stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            journal_stat = None
+        return self.snapshot_stat(), journal_stat
+
+    def add_reservation(self, reservation):
+        """
+        Add a reservation and record it in the journal
 
         Args:
-            file (file descriptor)
+            reservation (Reservation): reservation to add
         """
-        for data in self.data:
-            file.write(data.data_string)
-            file.write('\n')
+        super().add_reservation(reservation)
+        self.pending.append(f'R {reservation.data_string}\n')
 
+    def add_transaction(self, transaction):
+        """
+        Add a transaction and record it in the journal
 
-class ReservationManager(Manager):
+        Args:
+            transaction (Transaction): transaction to add
+        """
+        super().add_transaction(transaction)
+        self.pending.append(f'T {transaction.data_string}\n')
+
+    def delete_reservation(self, reservation_id):
+        """
+        Delete a certain reservation and record it in the journal
+
+        Args:
+            reservation_id (int)
+        """
+        super().delete_reservation(reservation_id)
+        self.pending.append(f'D {reservation_id}\n')
+
+    def save(self):
+        """
+        Write all data to a new snapshot and start an empty journal for it
+        """
+        temp_file = self.data_file + '.tmp'
+        with open(temp_file, 'w') as file:
+            self.r_manager.save(file)
+            file.write('#\n')
+            self.t_manager.save(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file, self.data_file)
+        with open(self.journal_file, 'w') as file:
+            file.write(f'@ {self.snapshot_checksum()}\n')
+        self.pending = []
+        self.journal_records = 0
+        self.journal_valid = True
+        self.dirty = False
+        self.file_stat = self.current_file_stat()
+
+    def close(self):
+        """
+        Append the changes made since the last call to the journal, taking a
+        new snapshot once the journal has grown to compact_every records
+        """
+        if not self.dirty:
+            return
+        if not self.journal_valid or self.journal_records + len(self.pending) >= self.compact_every:
+            self.save()
+            self.publish()
+            return
+        with open(self.journal_file, 'a') as file:
+            file.write(''.join(self.pending))
+            file.flush()
+            wait = self.last_fsync + self.fsync_interval - time.monotonic()
+            if wait <= 0:
+                os.fsync(file.fileno())
+                self.last_fsync = time.monotonic()
+            elif self.fsync_timer is None:
+                self.fsync_timer = threading.Timer(wait, self.sync_journal)
+                self.fsync_timer.daemon = True
+                self.fsync_timer.start()
+        self.journal_records += len(self.pending)
+        self.pending = []
+        self.dirty = False
+        self.file_stat = self.current_file_stat()
+        self.publish()
+
+    def sync_journal(self):
+        """
+        Fsync the records appended to the journal since the last fsync, called
+        by fsync_timer
+        """
+        with self.lock:
+            self.fsync_timer = None
+            if os.path.exists(self.journal_file):
+                fd = os.open(self.journal_file, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            self.last_fsync = time.monotonic()
+
+
+class SQLiteDataManager(DataManager):
     """
-    A class to manage all the reservations within the system
+    A DataManager that stores reservations and transactions in a SQLite
+    database instead of a text file
+
+    All data is still kept in memory for checking reservation rules, but every
+    change is written as a single row, and reports are answered by indexed
+    queries on the database. The database runs in WAL mode so that several
+    server processes can share it: a request that modifies data holds a write
+    transaction for its whole duration, and data committed by another process
+    (detected with PRAGMA data_version) is reloaded before it is used
+    Reports are read through a connection of their own in each thread, which
+    only sees committed data, so they do not need to hold the lock either
+
+    Attributes:
+        connection (Connection): the connection to the database
+        readers (local): the connection used for reports by each thread
+    """
+    RESERVATION_COLUMNS = ('reservation_id, customer_id, reservation_type, start_date, end_date, '
+                           'start_time, end_time, date_of_reservation, total_cost, down_payment')
+    TRANSACTION_COLUMNS = f'transaction_id, type, transaction_date, {RESERVATION_COLUMNS}, timestamp, staff_id'
+    SCHEMA = f"""
+        CREATE TABLE IF NOT EXISTS reservations (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            reservation_id INTEGER NOT NULL UNIQUE,
+            customer_id TEXT NOT NULL,
+            reservation_type TEXT NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            date_of_reservation TEXT NOT NULL,
+            total_cost TEXT NOT NULL,
+            down_payment TEXT NOT NULL,
+            start_day INTEGER NOT NULL,
+            end_day INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS reservations_customer ON reservations (customer_id, start_day);
+        CREATE INDEX IF NOT EXISTS reservations_type ON reservations (reservation_type, start_day);
+        DROP INDEX IF EXISTS reservations_start;
+        CREATE INDEX IF NOT EXISTS reservations_start_id ON reservations (start_day, reservation_id);
+        CREATE INDEX IF NOT EXISTS reservations_end ON reservations (end_day);
+        CREATE TABLE IF NOT EXISTS transactions (
+            transaction_id INTEGER PRIMARY KEY,
+            type TEXT NOT NULL,
+            transaction_date TEXT NOT NULL,
+            transaction_day INTEGER NOT NULL,
+            reservation_id INTEGER NOT NULL,
+            customer_id TEXT NOT NULL,
+            reservation_type TEXT NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            date_of_reservation TEXT NOT NULL,
+            total_cost TEXT NOT NULL,
+            down_payment TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            staff_id TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS transactions_day ON transactions (transaction_day);
+        CREATE INDEX IF NOT EXISTS transactions_reservation ON transactions (reservation_id);
+        CREATE INDEX IF NOT EXISTS transactions_customer ON transactions (customer_id);
     """
 
-    def max_id(self):
+    def __init__(self, data_file):
+        self.connection = sqlite3.connect(data_file, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(self.SCHEMA)
+        self.readers = threading.local()
+        super().__init__(data_file)
+
+    def load_data(self):
         """
-        Return the max id
+        Load all rows of the database to the DataManager
+        """
+        self.generation += 1
+        self.r_manager = ReservationManager()
+        self.t_manager = TransactionManager()
+        rows = self.connection.execute(f'SELECT {self.RESERVATION_COLUMNS} FROM reservations ORDER BY seq')
+        for row in rows:
+            self.r_manager.add_data(Reservation([str(value) for value in row]))
+        rows = self.connection.execute(f'SELECT {self.TRANSACTION_COLUMNS} FROM transactions ORDER BY transaction_id')
+        for row in rows:
+            transaction = Transaction([str(value) for value in row])
+            transaction.share_detail(self.r_manager.select_reservation(transaction.detail.reservation_id))
+            self.t_manager.add_data(transaction)
+        self.dirty = False
+        self.file_stat = self.current_file_stat()
+        self.publish()
+
+    def current_file_stat(self):
+        """
+        Return the data version of the database, which changes whenever another
+        connection commits a change
 
         Returns:
-            A Integer
+            An integer
         """
-        if len(self.data) == 0:
-            return 0
-        return self.data[-1].reservation_id
-        
-    def select_reservation(self, reservation_id):
+        return self.connection.execute('PRAGMA data_version').fetchone()[0]
+
+    def begin(self):
         """
-        Return a certain reservation
-        
-        Args:
-            reservation_id (int)
+        Start a write transaction, then reload data committed by others
+        """
+        if self.connection.in_transaction:
+            # A previous request failed before it could commit
+            self.rollback()
+        self.connection.execute('BEGIN IMMEDIATE')
+        self.refresh()
+
+    def rollback(self):
+        """
+        Roll back the write transaction, releasing the write lock of the
+        database, and discard the changes made to the in-memory data
+        """
+        if self.connection.in_transaction:
+            self.connection.execute('ROLLBACK')
+        self.load_data()
+
+    def save(self):
+        """
+        Commit all changes written to the database
+        """
+        if self.connection.in_transaction:
+            self.connection.execute('COMMIT')
+        self.dirty = False
+
+    def close(self):
+        """
+        Commit all changes written to the database
+        """
+        changed = self.dirty
+        self.save()
+        if changed:
+            self.publish()
+
+    def publish(self):
+        """
+        Count a new version of the data, reports read committed data from the database
+        """
+        self.version += 1
+
+    def refresh_snapshot(self):
+        """
+        Committed data is read directly from the database by reports
 
         Returns:
-            A reservation (Reservation) or None if not found
+            None
         """
-        for i in range(len(self.data)):
-            if self.data[i].reservation_id == reservation_id:
-                return self.data[i]
         return None
-    
+
+    def data_version(self):
+        """
+        Return the version of the data reports are generated from, reloading
+        the data first if another connection has committed changes
+
+        Returns:
+            An integer
+        """
+        with self.lock:
+            self.refresh()
+            return self.version
+
+    def reader(self):
+        """
+        Return the connection used for reports by the current thread
+
+        Returns:
+            A Connection object
+        """
+        connection = getattr(self.readers, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.data_file, isolation_level=None, check_same_thread=False)
+            self.readers.connection = connection
+        return connection
+
+    def add_reservation(self, reservation):
+        """
+        Add a reservation
+
+        Args:
+            reservation (Reservation): reservation to add
+        """
+        super().add_reservation(reservation)
+        self.connection.execute(
+            f'INSERT INTO reservations ({self.RESERVATION_COLUMNS}, start_day, end_day) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            reservation.data_string.split() + [reservation.start_day, reservation.end_day])
+
+    def add_transaction(self, transaction):
+        """
+        Add a transaction
+
+        Args:
+            transaction (Transaction): transaction to add
+        """
+        super().add_transaction(transaction)
+        self.connection.execute(
+            f'INSERT INTO transactions ({self.TRANSACTION_COLUMNS}, transaction_day) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            transaction.data_string.split() + [transaction.transaction_day])
+
     def delete_reservation(self, reservation_id):
         """
         Delete a certain reservation
-        
+
         Args:
             reservation_id (int)
         """
-        for i in range(len(self.data)):
-            if self.data[i].reservation_id == reservation_id:
-                del self.data[i]
-                break
+        super().delete_reservation(reservation_id)
+        self.connection.execute('DELETE FROM reservations WHERE reservation_id = ?', (reservation_id,))
 
-
-class TransactionManager(Manager):
-    """
-    A class to manage all the transaction within the system
-    """
-    
-    def max_id(self):
+    def reservations_between(self, start_date, end_date, customer_id="", after=None, limit=None):
         """
-        Return the max id
+        Return all reservations running on at least one day between two dates,
+        including recurring reservations that started before the first date
+
+        Args:
+            start_date (str): The first date, in mm-dd-yyyy format
+            end_date (str): The last date, in mm-dd-yyyy format
+            customer_id (str): OPTIONAL, only return reservations of this customer
+            after (tuple): OPTIONAL, only return reservations sorted after this
+                (start day, reservation id)
+            limit (int): OPTIONAL, the maximum number of reservations to return
+
+        Returns:
+            A list of reservations (List[Reservation]), sorted by start date
+            and reservation id
+        """
+        start_day, end_day = date_ordinal(start_date), date_ordinal(end_date)
+        # No reservation lasts longer than max_span days, which bounds the
+        # range of start days to look at
+        query = (f'SELECT {self.RESERVATION_COLUMNS} FROM reservations '
+                 'WHERE start_day BETWEEN ? AND ? AND end_day >= ?')
+        parameters = [start_day - self.r_manager.max_span, end_day, start_day]
+        if customer_id != "":
+            query += ' AND customer_id = ?'
+            parameters.append(customer_id)
+        if after is not None:
+            query += ' AND (start_day, reservation_id) > (?, ?)'
+            parameters += list(after)
+        query += ' ORDER BY start_day, reservation_id'
+        if limit is not None:
+            query += ' LIMIT ?'
+            parameters.append(limit)
+        rows = self.reader().execute(query, parameters)
+        return [Reservation([str(value) for value in row]) for row in rows]
+
+    def transactions_between(self, start_date, end_date, after=None, limit=None):
+        """
+        Return all transactions made between two dates
+
+        Args:
+            start_date (str): The first date, in mm-dd-yyyy format
+            end_date (str): The last date, in mm-dd-yyyy format
+            after (tuple): OPTIONAL, only return transactions sorted after this
+                (transaction day, transaction id)
+            limit (int): OPTIONAL, the maximum number of transactions to return
+
+        Returns:
+            A list of transactions (List[Transaction]), sorted by date and
+            transaction id
+        """
+        query = f'SELECT {self.TRANSACTION_COLUMNS} FROM transactions WHERE transaction_day BETWEEN ? AND ?'
+        parameters = [date_ordinal(start_date), date_ordinal(end_date)]
+        if after is not None:
+            query += ' AND (transaction_day, transaction_id) > (?, ?)'
+            parameters += list(after)
+        query += ' ORDER BY transaction_day, transaction_id'
+        if limit is not None:
+            query += ' LIMIT ?'
+            parameters.append(limit)
+        rows = self.reader().execute(query, parameters)
+        return [Transaction([str(value) for value in row]) for row in rows]
+
+    def transactions_summary(self, start_date, end_date, group_by):
+        """
+        Return the totals of the transactions made between two dates, from the
+        rollups of the in-memory data
+
+        Args:
+            start_date (str): The first date, in mm-dd-yyyy format
+            end_date (str): The last date, in mm-dd-yyyy format
+            group_by (str): '' for the totals of the whole period, or 'day',
+                'resource' or 'staff' for the totals of each of them
+
+        Returns:
+            A dict mapping each group to its totals, see FinancialRollups
+        """
+        with self.lock:
+            self.refresh()
+            return self.t_manager.rollups.summary(date_ordinal(start_date), date_ordinal(end_date), group_by)
+
+    def import_data(self, data_manager):
+        """
+        Copy all reservations and transactions of another DataManager into
+        the database
+
+        Args:
+            data_manager (DataManager): the DataManager to copy data from
+        """
+        self.begin()
+        for reservation in data_manager.all_reservations():
+            self.add_reservation(reservation)
+        for transaction in data_manager.all_transactions():
+            self.add_transaction(transaction)
+        self.close()
+
+
+class LockTable:
+    """
+    A class holding one lock per key in use, created when a first thread
+    holds or waits for the key and removed when the last one releases it, so
+    that the table only grows with the number of keys in use at once
+
+    The locks of several keys are always acquired in sorted order, so that
+    threads holding overlapping sets of keys cannot deadlock
+
+    Attributes:
+        locks (dict): A dict mapping keys in use to [their lock, the number of
+            threads holding or waiting for it]
+        guard (Lock): lock to be held while creating or removing locks
+    """
+    def __init__(self):
+        self.locks = {}
+        self.guard = threading.Lock()
+
+    @contextmanager
+    def hold(self, keys):
+        """
+        Hold the locks of some keys for the duration of a with block
+
+        Args:
+            keys (List[tuple]): the keys to lock, tuples of comparable values
+        """
+        keys = sorted(set(keys))
+        with self.guard:
+            entries = [self.locks.setdefault(key, [threading.Lock(), 0]) for key in keys]
+            for entry in entries:
+                entry[1] += 1
+        acquired = []
+        try:
+            for lock, _ in entries:
+                lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            with self.guard:
+                for key, entry in zip(keys, entries):
+                    entry[1] -= 1
+                    if entry[1] == 0:
+                        del self.locks[key]
+
+
+def open_data_manager(data_file, backend='text', **options):
+    """
+    Create a DataManager for the given storage backend
+
+    Args:
+        data_file (str): path of the data file
+        backend (str): 'text' to rewrite the data file on every change,
+            'journal' to append changes to a journal file, 'sqlite' to store
+            data in a SQLite database
+        options: additional arguments of the DataManager of the backend
+
+    Returns:
+        A DataManager object
+    """
+    if backend == 'journal':
+        return JournaledDataManager(data_file, **options)
+    if backend == 'sqlite':
+        return SQLiteDataManager(data_file)
+    return DataManager(data_file)
+
+
+@lru_cache(maxsize=4096)
+def date_ordinal(date):
+    """
+    Convert a date to an integer counting days, so that dates can be compared
+
+    Args:
+        date (str): A date in mm-dd-yyyy format
+
+    Returns:
+        An integer
+    """
+    month, day, year = map(int, date.split('-'))
+    return datetime(year, month, day).toordinal()
+
+
+@lru_cache(maxsize=4096)
+def iso_week(day):
+    """
+    Return the ISO week a day belongs to
+
+    Args:
+        day (int): A date ordinal
+
+    Returns:
+        (ISO year, ISO week number)
+    """
+    year, week, _ = datetime.fromordinal(day).isocalendar()
+    return year, week
+
+
+def time_slot(time):
+    """
+    Convert a time to the number of the half hour slot starting at that time,
+    from 0 for 00:00 to 47 for 23:30
+
+    Args:
+        time (str): A time in HH:MM format
+
+    Returns:
+        An integer
+    """
+    hour, minute = map(int, time.split(':'))
+    return hour * 2 + minute // 30
+
+
+class Reservation:
+    """
+    A class representing a single reservation within the system
+
+    All dates stored are in the form of a mm-dd-yyyy string, they are also
+    stored as date ordinals (see date_ordinal) and times as half hour slot
+    numbers (see time_slot) to be compared without parsing them again.
+    Reservations use __slots__ and interned strings for the values repeated
+    across many reservations (customer ids, resources, dates and times), and
+    are only converted back to a line of the data file when it is saved
+    Attributes:
+        reservation_id (int): A unique interger for each reservation
+        customer_id (str): The unique string id representing a customer
+        reservation_type (str): The type of reservation made (for workshop,
+            or for a special machine)
+        start_date (str): The starting date of the reservation 
+        end_date (str): The ending date of the reservation
+        date_of_reservation (str): The date on which the reservation is made
+        total (float): A float representing the total cost of this reservation
+        down_payment (float): A float representing the amount required for a down payment
+        data_string (str): A string representation of the reservation object
+        start_day (int): The ordinal of start_date
+        end_day (int): The ordinal of end_date
+        reservation_day (int): The ordinal of date_of_reservation
+        start_slot (int): The slot of start_time
+        end_slot (int): The slot of end_time
+    """
+    __slots__ = ('reservation_id', 'customer_id', 'reservation_type', 'start_date', 'end_date',
+                 'start_time', 'end_time', 'date_of_reservation', 'total_cost', 'down_payment',
+                 'start_day', 'end_day', 'reservation_day', 'start_slot', 'end_slot')
+
+    def __init__(self, _reserve):
+        self.reservation_id = int(_reserve[0])
+        self.customer_id = sys.intern(_reserve[1])
+        self.reservation_type = sys.intern(_reserve[2])
+        self.start_date = sys.intern(_reserve[3])
+        self.end_date = sys.intern(_reserve[4])
+        self.start_time = sys.intern(_reserve[5])
+        self.end_time = sys.intern(_reserve[6])
+        self.date_of_reservation = sys.intern(_reserve[7])
+        self.total_cost = float(_reserve[8])
+        self.down_payment = float(_reserve[9])
+        self.start_day = date_ordinal(self.start_date)
+        self.end_day = date_ordinal(self.end_date)
+        self.reservation_day = date_ordinal(self.date_of_reservation)
+        self.start_slot = time_slot(self.start_time)
+        self.end_slot = time_slot(self.end_time)
+
+    @property
+    def data_string(self):
+        return ' '.join(self.tolist())
+    
+    def tolist(self):
+        """
+        Convert all information in the Reservation object to a list object
+
+        Returns:
+            A string that includes all information about the Reservation object
+        """
+        return [str(self.reservation_id), self.customer_id, self.reservation_type,
+                    self.start_date, self.end_date, self.start_time, self.end_time,
+                    self.date_of_reservation, str(self.total_cost), str(self.down_payment)]
+
+    
+class Transaction:
+    """
+    A class representing transactions that have taken place in the system
+
+    Attributes:
+        transaction_id (int): A unique interger for each transaction
+        type (str): The type of transaction (CANCELLATION or RESERVATION)
+        transaction_date (str): Date of the transaction in mm-dd-yyyy format
+        detail (Reservation): The Reservation object related to this transaction
+        timestamp (str): The time at which the transaction was made
+        staff_id (str): The id of the staff who made the transaction
+        data_string (str): A string representation of the transaction
+        transaction_day (int): The ordinal of transaction_date
+    """
+    __slots__ = ('transaction_id', 'type', 'transaction_date', 'detail', 'timestamp', 'staff_id',
+                 'transaction_day')
+
+    def __init__(self, transaction):
+        self.transaction_id = int(transaction[0])
+        self.type = sys.intern(transaction[1])
+        self.transaction_date = sys.intern(transaction[2])
+        self.transaction_day = date_ordinal(self.transaction_date)
+        self.detail = Reservation(transaction[3:13])
+        self.timestamp = transaction[-2]
+        self.staff_id = sys.intern(transaction[-1])
+
+    @property
+    def data_string(self):
+        return f'{self.transaction_id} {self.type} {self.transaction_date} {self.detail.data_string} {self.timestamp} {self.staff_id}'
+
+    def share_detail(self, reservation):
+        """
+        Replace the detail of the transaction by an identical reservation, so
+        that both do not have to be kept in memory
+
+        Args:
+            reservation (Reservation): A reservation of the system, or None
+        """
+        if reservation is not None and reservation.tolist() == self.detail.tolist():
+            self.detail = reservation
+
+
+class Manager:
+    """
+    Attributes:
+        data (List): A list that contains data
+    """
+    def __init__(self):
+        self.data = []
+
+    def __iter__(self):
+        return iter(self.data)
+    
+    def add_data(self, data):
+        """
+        Add data
+
+        Args:
+            data: data to add
+        """
+        self.data.append(data)
+    
+    def save(self, file):
+        """
+        Write all data to the designated file descriptor
+
+        Args:
+            file (file descriptor)
+        """
+        for data in self.data:
+            file.write(data.data_string)
+            file.write('\n')
+
+
+class ReservationManager(Manager):
+    """
+    A class to manage all the reservations within the system
+
+    Reservations are kept in a dict indexed by reservation id, which preserves
+    the order in which they were added, so that a reservation can be found or
+    deleted in constant time
+
+    Attributes:
+        index (dict): A dict mapping reservation ids to reservations
+        data (dict_values): All reservations, in the order they were added
+        occupancy (OccupancyGrid): The number of reservations running in every
+            half hour slot of every day
+        customers (dict): A dict mapping customer ids to a dict of the
+            reservations of that customer, indexed by reservation id
+        customer_weeks (dict): A dict mapping customer ids to a dict counting
+            the days reserved by that customer in each ISO week
+        by_start (DateIndex): The reservations indexed by start date
+        intervals (IntervalIndex): The time intervals of the reservations of
+            every resource on every day, used to check the cooldown rules
+        max_span (int): The largest number of days between the start date and
+            the end date of a reservation
+    """
+    def __init__(self):
+        self.index = {}
+        self.occupancy = OccupancyGrid()
+        self.customers = {}
+        self.customer_weeks = {}
+        self.by_start = DateIndex()
+        self.intervals = IntervalIndex()
+        self.max_span = 0
+
+    @property
+    def data(self):
+        return self.index.values()
+
+    def add_data(self, data):
+        """
+        Add data
+
+        Args:
+            data (Reservation): reservation to add
+        """
+        self.index[data.reservation_id] = data
+        self.occupancy.add(data)
+        self.customers.setdefault(data.customer_id, {})[data.reservation_id] = data
+        self.count_weeks(data, 1)
+        self.by_start.add(data.start_day, data.reservation_id, data)
+        self.intervals.add(data)
+        self.max_span = max(self.max_span, data.end_day - data.start_day)
+
+    def max_id(self):
+        """
+        Return the id of the last reservation added
 
         Returns:
             A Integer
         """
-        return len(self.data)
\ No newline at end of file
+        if len(self.index) == 0:
+            return 0
+        return next(reversed(self.index))
+        
+    def select_reservation(self, reservation_id):
+        """
+        Return a certain reservation
+        
+        Args:
+            reservation_id (int)
+
+        Returns:
+            A reservation (Reservation) or None if not found
+        """
+        return self.index.get(reservation_id)
+    
+    def delete_reservation(self, reservation_id):
+        """
+        Delete a certain reservation
+        
+        Args:
+            reservation_id (int)
+        """
+        reservation = self.index.pop(reservation_id, None)
+        if reservation is not None:
+            self.occupancy.remove(reservation)
+            reservations = self.customers[reservation.customer_id]
+            del reservations[reservation_id]
+            if len(reservations) == 0:
+                del self.customers[reservation.customer_id]
+            self.count_weeks(reservation, -1)
+            self.by_start.remove(reservation.start_day, reservation_id)
+            self.intervals.remove(reservation)
+
+    def count_weeks(self, reservation, change):
+        """
+        Add change to the number of days reserved by the customer of a
+        reservation, for every day of that reservation
+
+        Args:
+            reservation (Reservation): the reservation to count
+            change (int): 1 to add the reservation, -1 to remove it
+        """
+        weeks = self.customer_weeks.setdefault(reservation.customer_id, {})
+        for day in range(reservation.start_day, reservation.end_day + 1):
+            week = iso_week(day)
+            weeks[week] = weeks.get(week, 0) + change
+            if weeks[week] == 0:
+                del weeks[week]
+        if len(weeks) == 0:
+            del self.customer_weeks[reservation.customer_id]
+
+    def customer_reservations(self, customer_id):
+        """
+        Return all reservations of a customer
+
+        Args:
+            customer_id (str)
+
+        Returns:
+            The reservations of the customer, in the order they were added
+        """
+        return self.customers.get(customer_id, {}).values()
+
+    def reserved_days(self, customer_id, week):
+        """
+        Return the number of days reserved by a customer in an ISO week, a day
+        is counted once for every reservation on that day
+
+        Args:
+            customer_id (str)
+            week (tuple): the (year, week number) of the ISO week, see iso_week
+
+        Returns:
+            An integer
+        """
+        return self.customer_weeks.get(customer_id, {}).get(week, 0)
+
+    def reservations_between(self, first_day, last_day, customer_id=""):
+        """
+        Return all reservations running on at least one day between two days
+
+        Args:
+            first_day (int): The date ordinal of the first day
+            last_day (int): The date ordinal of the last day
+            customer_id (str): OPTIONAL, only return reservations of this customer
+
+        Returns:
+            A list of reservations (List[Reservation]), sorted by start date
+        """
+        if customer_id != "":
+            candidates = sorted(self.customer_reservations(customer_id),
+                                key=lambda reservation: reservation.start_day)
+        else:
+            # Reservations starting more than max_span days before the first
+            # day have ended before it
+            candidates = self.by_start.between(first_day - self.max_span, last_day)
+        return [reservation for reservation in candidates
+                if reservation.start_day <= last_day and reservation.end_day >= first_day]
+
+
+class TransactionManager(Manager):
+    """
+    A class to manage all the transaction within the system
+
+    Attributes:
+        data (List): All transactions, in the order they were added
+        by_date (DateIndex): The transactions indexed by transaction date
+        rollups (FinancialRollups): The totals of the transactions of every day
+    """
+    def __init__(self):
+        super().__init__()
+        self.by_date = DateIndex()
+        self.rollups = FinancialRollups()
+
+    def add_data(self, data):
+        """
+        Add data
+
+        Args:
+            data (Transaction): transaction to add
+        """
+        super().add_data(data)
+        self.by_date.add(data.transaction_day, data.transaction_id, data)
+        self.rollups.add(data)
+
+    def transactions_between(self, first_day, last_day):
+        """
+        Return all transactions made between two days
+
+        Args:
+            first_day (int): The date ordinal of the first day
+            last_day (int): The date ordinal of the last day
+
+        Returns:
+            A list of transactions (List[Transaction]), sorted by date
+        """
+        return list(self.by_date.between(first_day, last_day))
+    
+    def max_id(self):
+        """
+        Return the max id
+
+        Returns:
+            A Integer
+        """
+        return len(self.data)
+
+
+class OccupancyGrid:
+    """
+    A class counting the reservations running in every half hour slot of every
+    day, updated whenever a reservation is added or deleted, so that the
+    capacity rules can be checked without looking at other reservations
+
+    Attributes:
+        days (dict): A dict mapping date ordinals to DayOccupancy objects
+    """
+    def __init__(self):
+        self.days = {}
+
+    def add(self, reservation, change=1):
+        """
+        Count a reservation in all the slots it is running in
+
+        Args:
+            reservation (Reservation): the reservation to count
+            change (int): 1 to add the reservation, -1 to remove it
+        """
+        start_slot = max(reservation.start_slot, 0)
+        end_slot = min(reservation.end_slot, DayOccupancy.SLOTS)
+        for day in range(reservation.start_day, reservation.end_day + 1):
+            if day not in self.days:
+                self.days[day] = DayOccupancy()
+            self.days[day].add(reservation.reservation_type, start_slot, end_slot, change)
+
+    def remove(self, reservation):
+        """
+        Stop counting a reservation
+
+        Args:
+            reservation (Reservation): the reservation to remove
+        """
+        self.add(reservation, -1)
+
+    def day(self, day):
+        """
+        Return the occupancy of a day
+
+        Args:
+            day (int): the date ordinal of the day
+
+        Returns:
+            A DayOccupancy object
+        """
+        return self.days.get(day) or DayOccupancy()
+
+
+class IntervalIndex:
+    """
+    A class keeping, for every resource and every day, the sorted time intervals
+    of the reservations of that resource running on that day, so that the
+    reservations close to a time window are found with a binary search
+
+    Attributes:
+        intervals (dict): A dict mapping (resource, date ordinal) pairs to a
+            sorted list of (start slot, end slot, reservation id, reservation)
+        longest (int): The largest number of slots of an interval
+    """
+    def __init__(self):
+        self.intervals = {}
+        self.longest = 0
+
+    def add(self, reservation):
+        """
+        Add the intervals of a reservation for all the days it is running on
+
+        Args:
+            reservation (Reservation): the reservation to add
+        """
+        interval = (reservation.start_slot, reservation.end_slot, reservation.reservation_id, reservation)
+        for day in range(reservation.start_day, reservation.end_day + 1):
+            bisect.insort(self.intervals.setdefault((reservation.reservation_type, day), []), interval)
+        self.longest = max(self.longest, reservation.end_slot - reservation.start_slot)
+
+    def remove(self, reservation):
+        """
+        Remove the intervals of a reservation
+
+        Args:
+            reservation (Reservation): the reservation to remove
+        """
+        # A shorter tuple sorts before the interval, so it is found without
+        # comparing reservations
+        key = (reservation.start_slot, reservation.end_slot, reservation.reservation_id)
+        for day in range(reservation.start_day, reservation.end_day + 1):
+            intervals = self.intervals.get((reservation.reservation_type, day))
+            if intervals is None:
+                continue
+            i = bisect.bisect_left(intervals, key)
+            if i < len(intervals) and intervals[i][:3] == key:
+                del intervals[i]
+            if len(intervals) == 0:
+                del self.intervals[(reservation.reservation_type, day)]
+
+    def on_day(self, resource, day):
+        """
+        Return the intervals of the reservations of a resource running on a day
+
+        Args:
+            resource (str): the resource reserved
+            day (int): the date ordinal of the day
+
+        Returns:
+            A list of (start slot, end slot, reservation id, reservation), sorted
+        """
+        return self.intervals.get((resource, day), [])
+
+    def overlapping(self, resource, day, start_slot, end_slot):
+        """
+        Return the reservations of a resource running during a time window of a day
+
+        Args:
+            resource (str): the resource reserved
+            day (int): the date ordinal of the day
+            start_slot (int): the first slot of the window
+            end_slot (int): the slot right after the window
+
+        Returns:
+            A list of reservations (List[Reservation]), sorted by start time
+        """
+        intervals = self.intervals.get((resource, day))
+        if intervals is None:
+            return []
+        # Intervals starting before start_slot - longest have ended before the window
+        low = bisect.bisect_left(intervals, (start_slot - self.longest + 1,))
+        high = bisect.bisect_left(intervals, (end_slot,))
+        return [interval[3] for interval in intervals[low:high] if interval[1] > start_slot]
+
+
+class DayOccupancy:
+    """
+    A class counting the reservations running in every half hour slot of a day
+
+    Attributes:
+        resources (dict): A dict mapping every resource to a list of the number
+            of its reservations running in each slot
+        special (List[int]): The number of special machines (all resources but
+            the workshop) running in each slot
+        harvester (List[int]): The number of harvesters running in each slot
+    """
+    SLOTS = 48
+
+    def __init__(self):
+        self.resources = {}
+        self.special = [0] * self.SLOTS
+        self.harvester = [0] * self.SLOTS
+
+    def add(self, resource, start_slot, end_slot, change):
+        """
+        Add change to the counts of the slots from start_slot to end_slot
+        (excluded) of a resource
+        """
+        if resource not in self.resources:
+            self.resources[resource] = [0] * self.SLOTS
+        counts = self.resources[resource]
+        for slot in range(start_slot, end_slot):
+            counts[slot] += change
+            if resource != 'workshop':
+                self.special[slot] += change
+            if resource == 'harvester':
+                self.harvester[slot] += change
+
+    def count(self, resource, slot):
+        """
+        Return the number of reservations of a resource running in a slot
+        """
+        if resource not in self.resources or not 0 <= slot < self.SLOTS:
+            return 0
+        return self.resources[resource][slot]
+
+    def special_count(self, slot):
+        """
+        Return the number of special machines running in a slot
+        """
+        if not 0 <= slot < self.SLOTS:
+            return 0
+        return self.special[slot]
+
+    def harvester_running(self, slot):
+        """
+        Return True if a harvester is running in a slot
+        """
+        return 0 <= slot < self.SLOTS and self.harvester[slot] > 0
+
+
+class Snapshot:
+    """
+    A class holding an immutable version of the data used by reports
+
+    Attributes:
+        version (int): the version of the data
+        reservations (DateIndex): the reservations indexed by start date
+        max_span (int): The largest number of days between the start date and
+            the end date of a reservation
+        transactions (DateIndex): the transactions indexed by transaction date
+        rollups (FinancialRollups): the totals of the transactions of every day
+    """
+    def __init__(self, version, reservations, max_span, transactions, rollups):
+        self.version = version
+        self.reservations = reservations
+        self.max_span = max_span
+        self.transactions = transactions
+        self.rollups = rollups
+
+    def reservations_between(self, first_day, last_day, customer_id="", after=None, limit=None):
+        """
+        Return all reservations running on at least one day between two days
+
+        Args:
+            first_day (int): The date ordinal of the first day
+            last_day (int): The date ordinal of the last day
+            customer_id (str): OPTIONAL, only return reservations of this customer
+            after (tuple): OPTIONAL, only return reservations sorted after this
+                (start day, reservation id)
+            limit (int): OPTIONAL, the maximum number of reservations to return
+
+        Returns:
+            A list of reservations (List[Reservation]), sorted by start date
+            and reservation id
+        """
+        reservations = []
+        # Reservations starting more than max_span days before the first day
+        # have ended before it
+        for reservation in self.reservations.between(first_day - self.max_span, last_day, after):
+            if limit is not None and len(reservations) == limit:
+                break
+            if reservation.end_day >= first_day and (customer_id == "" or reservation.customer_id == customer_id):
+                reservations.append(reservation)
+        return reservations
+
+    def transactions_between(self, first_day, last_day, after=None, limit=None):
+        """
+        Return all transactions made between two days
+
+        Args:
+            first_day (int): The date ordinal of the first day
+            last_day (int): The date ordinal of the last day
+            after (tuple): OPTIONAL, only return transactions sorted after this
+                (transaction day, transaction id)
+            limit (int): OPTIONAL, the maximum number of transactions to return
+
+        Returns:
+            A list of transactions (List[Transaction]), sorted by date and
+            transaction id
+        """
+        transactions = self.transactions.between(first_day, last_day, after)
+        if limit is None:
+            return list(transactions)
+        return [transaction for _, transaction in zip(range(limit), transactions)]
+
+
+class FinancialRollups:
+    """
+    A class keeping the totals of the transactions of every day, updated
+    whenever a transaction is added, so that a financial summary of a period
+    only looks at the totals of each of its days
+
+    The totals of a day are kept for all its transactions, and for the
+    transactions of each resource and of each staff, as tuples of
+    (reservations, cancellations, revenue, down payments, refunds)
+    Rollups are copied on write when a snapshot has been taken, like DateIndex
+
+    Attributes:
+        days (dict): A dict mapping date ordinals to a dict mapping groups,
+            ('all', ''), ('resource', resource) or ('staff', staff_id), to
+            their totals on that day
+        shared (bool): True if days is shared with a snapshot
+        owned (set): The days whose totals are not shared with any snapshot
+    """
+    FIELDS = ('reservations', 'cancellations', 'revenue', 'down_payments', 'refunds')
+    EMPTY = (0, 0, 0.0, 0.0, 0.0)
+
+    def __init__(self, days=None):
+        self.days = {} if days is None else days
+        self.shared = days is not None
+        self.owned = set()
+
+    def snapshot(self):
+        """
+        Return rollups with the current totals, which are not changed by
+        further changes of these rollups
+
+        Returns:
+            A FinancialRollups object, which must not be changed
+        """
+        self.shared = True
+        return FinancialRollups(self.days)
+
+    def add(self, transaction):
+        """
+        Add a transaction to the totals of its day
+
+        Args:
+            transaction (Transaction): the transaction to add
+        """
+        reservation = transaction.detail
+        transaction_type = transaction.type.split("$")
+        if len(transaction_type) == 2:
+            # A cancellation, with the amount refunded
+            totals = (0, 1, 0.0, 0.0, float(transaction_type[1]))
+        else:
+            totals = (1, 0, reservation.total_cost, reservation.down_payment, 0.0)
+
+        if self.shared:
+            self.days = dict(self.days)
+            self.owned = set()
+            self.shared = False
+        day = transaction.transaction_day
+        if day not in self.owned:
+            self.days[day] = dict(self.days.get(day, {}))
+            self.owned.add(day)
+        day_totals = self.days[day]
+        for group in (('all', ''), ('resource', reservation.reservation_type), ('staff', transaction.staff_id)):
+            day_totals[group] = tuple(a + b for a, b in zip(day_totals.get(group, self.EMPTY), totals))
+
+    def summary(self, first_day, last_day, group_by):
+        """
+        Return the totals of the transactions made between two days
+
+        Args:
+            first_day (int): The date ordinal of the first day
+            last_day (int): The date ordinal of the last day
+            group_by (str): '' for the totals of the whole period, or 'day',
+                'resource' or 'staff' for the totals of each of them
+
+        Returns:
+            A dict mapping each group (the date ordinal, resource or staff id,
+            or '' for the whole period) to its totals
+        """
+        kind = 'all' if group_by in ('', 'day') else group_by
+        summary = {}
+        for day in range(first_day, last_day + 1):
+            day_totals = self.days.get(day)
+            if day_totals is None:
+                continue
+            for (group_kind, group), totals in day_totals.items():
+                if group_kind != kind:
+                    continue
+                if group_by == 'day':
+                    group = day
+                summary[group] = tuple(a + b for a, b in zip(summary.get(group, self.EMPTY), totals))
+        return summary
+
+
+class DateIndex:
+    """
+    A class indexing records by day, so that the records of a range of days
+    can be found without looking at the records of other days
+
+    A snapshot of the index shares its data with the index, which is copied
+    on write: the first change made after a snapshot has been taken copies
+    the dict of buckets and the list of days, and the first change of each
+    day copies the bucket of that day, so that snapshots are never modified
+
+    Attributes:
+        buckets (dict): A dict mapping date ordinals to a dict of the records
+            of that day, indexed by their id
+        days (List[int]): The sorted date ordinals of all days with records
+        shared (bool): True if buckets and days are shared with a snapshot
+        owned (set): The days whose bucket is not shared with any snapshot
+    """
+    def __init__(self, buckets=None, days=None):
+        self.buckets = {} if buckets is None else buckets
+        self.days = [] if days is None else days
+        self.shared = buckets is not None
+        self.owned = set()
+
+    def snapshot(self):
+        """
+        Return an index with the records currently in this index, which is not
+        changed by further changes of this index
+
+        Returns:
+            A DateIndex object, which must not be changed
+        """
+        self.shared = True
+        return DateIndex(self.buckets, self.days)
+
+    def writable_bucket(self, day):
+        """
+        Return the bucket of a day, copying the data shared with snapshots first
+
+        Args:
+            day (int): The date ordinal of the day
+
+        Returns:
+            The dict of the records of that day
+        """
+        if self.shared:
+            self.buckets = dict(self.buckets)
+            self.days = list(self.days)
+            self.owned = set()
+            self.shared = False
+        if day not in self.owned:
+            if day in self.buckets:
+                self.buckets[day] = dict(self.buckets[day])
+            else:
+                self.buckets[day] = {}
+                bisect.insort(self.days, day)
+            self.owned.add(day)
+        return self.buckets[day]
+
+    def add(self, day, key, record):
+        """
+        Add a record to the index
+
+        Args:
+            day (int): The date ordinal to index the record by
+            key (int): The id of the record
+            record: The record to add
+        """
+        self.writable_bucket(day)[key] = record
+
+    def remove(self, day, key):
+        """
+        Remove a record from the index
+
+        Args:
+            day (int): The date ordinal the record is indexed by
+            key (int): The id of the record
+        """
+        bucket = self.buckets.get(day)
+        if bucket is None or key not in bucket:
+            return
+        bucket = self.writable_bucket(day)
+        del bucket[key]
+        if len(bucket) == 0:
+            del self.buckets[day]
+            del self.days[bisect.bisect_left(self.days, day)]
+            self.owned.discard(day)
+
+    def between(self, first_day, last_day, after=None):
+        """
+        Iterate over the records of all days between two days, in order of day
+        and then of id, as records are added in order of id
+
+        Args:
+            first_day (int): The date ordinal of the first day
+            last_day (int): The date ordinal of the last day
+            after (tuple): OPTIONAL, only iterate over the records after this
+                (day, id), which is found with a binary search
+
+        Returns:
+            An iterator of records
+        """
+        if after is not None:
+            first_day = max(first_day, after[0])
+        start = bisect.bisect_left(self.days, first_day)
+        stop = bisect.bisect_right(self.days, last_day)
+        for i in range(start, stop):
+            day = self.days[i]
+            if after is not None and day == after[0]:
+                yield from (record for key, record in self.buckets[day].items() if key > after[1])
+            else:
+                yield from self.buckets[day].values()
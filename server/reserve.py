@@ -4,7 +4,25 @@
 # Date: May 7, 2022
 
 from datetime import datetime, timedelta
-import persist, json, time
+import base64, csv, io, persist, json, settings, time
+
+# The number of each resource owned by the workshop
+CAPACITY = {'workshop': 15, 'microvac': 2, 'irradiator': 2, 'extruder': 3, 'hvc': 1, 'harvester': 1}
+
+# The cooldown period needed between two uses of a machine, in the integer
+# representation of split_time (10 per hour)
+COOLDOWNS = {'hvc': 60, 'irradiator': 10}
+
+# The number of transactions read at once by export_transactions
+EXPORT_PAGE_SIZE = 500
+
+# The number of days in which reservations can be made, which is also the
+# longest date range of an availability report
+BOOKING_WINDOW_DAYS = 30
+
+# The fields of each transaction in a transactions report, in order
+TRANSACTION_FIELDS = ['transaction_id', 'transaction_type', 'transaction_date', 'reservation_id',
+                      'customer_id', 'resource', 'total_cost', 'transaction_amount']
 
 def workshop_is_closed(start_time, end_time, date):
     """
@@ -51,18 +69,8 @@ def is_available(reservation_type, count):
     Returns:
         (bool) True if the workshop/equipment is still available, False otherwise
     """
-    if reservation_type == 'workshop':
-        return count <= 15
-    elif reservation_type == 'microvac':
-        return count <= 2
-    elif reservation_type == 'irradiator':
-        return count <= 2
-    elif reservation_type == 'extruder':
-        return count <= 3
-    elif reservation_type == 'hvc':
-        return count <= 1
-    elif reservation_type == 'harvester':
-        return count <= 1
+    if reservation_type in CAPACITY:
+        return count <= CAPACITY[reservation_type]
     print(f"Unsupported resource: {reservation_type}.")
     return False
 
@@ -80,10 +88,20 @@ def between(date, start, end):
     Returns:
         True if it is between the start and end date, False otherwise
     """
-    start_date = datetime.strptime(start, "%m-%d-%Y")
-    end_date = datetime.strptime(end, "%m-%d-%Y")
-    ddate = datetime.strptime(date, "%m-%d-%Y")
-    return (ddate - start_date).days >= 0 and (end_date - ddate).days >=0
+    return persist.date_ordinal(start) <= persist.date_ordinal(date) <= persist.date_ordinal(end)
+
+def reservation_times(reservation):
+    """
+    Return the start and end time of a stored reservation in the integer
+    representation of split_time, computed from its pre-parsed slots
+
+    Args:
+        reservation (Reservation): A reservation of the system
+
+    Returns:
+        Integer representation of the start time and end time
+    """
+    return reservation.start_slot * 5, reservation.end_slot * 5
 
 def reservation_is_not_in_date_range(reservation_datetime, start_datetime, end_datetime):
     """
@@ -159,15 +177,16 @@ def check_only_one_special_machine(all_reservations, days_to_reserve, reservatio
     reservation_type = reservation.reservation_type
     start_time, end_time = split_time(reservation.start_time, reservation.end_time)
 
+    if reservation_type == 'workshop':
+        return True, None
+    # Only the reservations of this customer need to be checked
+    customer_reservations = all_reservations.customer_reservations(customer_id)
     for day in days_to_reserve:
-        for reservation in all_reservations:
-            if reservation.customer_id != customer_id:
-                continue
-            if reservation_type == 'workshop':
+        day = day.toordinal()
+        for reservation in customer_reservations:
+            if not reservation.start_day <= day <= reservation.end_day:
                 continue
-            if not between(f'{day.month}-{day.day}-{day.year}', reservation.start_date, reservation.end_date):
-                continue
-            reservation_start, reservation_end = split_time(reservation.start_time, reservation.end_time)
+            reservation_start, reservation_end = reservation_times(reservation)
             if not (reservation_end <= start_time or end_time <= reservation_start):
                 # "They can only reserve one special machine at a time"
                 print('Reservation Failed: a client can only reserve one special machine at a time')
@@ -179,6 +198,8 @@ def over_three_reservations(all_reservations, days_to_reserve, customer_id):
     Check if a customer is going to go over the limit of three reservations for
     a single week, given that they are trying to make reservations given by
     days_to_reserve
+    The days already reserved by the customer in each ISO week are counted by
+    the reservation manager
 
     Args:
         all_reservations (ResevationManager): the reservation manager of the system
@@ -190,33 +211,17 @@ def over_three_reservations(all_reservations, days_to_reserve, customer_id):
         restriction, (True, error response) if they are going to go over the restriction
     """
     weekr = {}
-    # Count up the number of reservations that this customer has already made
-    for reservation in all_reservations:
-        if reservation.customer_id != customer_id:
-            continue
-        reservation_start_datetime = datetime.strptime(reservation.start_date, "%m-%d-%Y")
-        reservation_end_datetime = datetime.strptime(reservation.end_date, "%m-%d-%Y")
-        rdays = []
-        rcur = reservation_start_datetime
-        while (reservation_end_datetime - rcur).days >= 0:
-            rdays.append(rcur)
-            rcur += timedelta(days=1)
-        for day in rdays:
-            key = f'{day.year}-{day.isocalendar()[1]}'
-            if key not in weekr:
-                weekr[key] = 1
-            else:
-                weekr[key] += 1
     # Add the days that are going to be reserved now
     for day in days_to_reserve:
-        key = f'{day.year}-{day.isocalendar()[1]}'
+        key = persist.iso_week(day.toordinal())
         if key not in weekr:
             weekr[key] = 1
         else:
             weekr[key] += 1
-    # Check if it is going to go over three
+    # Check if it is going to go over three, counting up the number of days
+    # that this customer has already reserved in the same week
     for k in weekr:
-        if weekr[k] > 3:
+        if weekr[k] + all_reservations.reserved_days(customer_id, k) > 3:
             print(f'Reservation Failed: A client can only make reservations for 3 different days in a given week.')
             return True, error_response(400, "Reservation", "A client can only make reservations for 3 different days in a given week")
             
@@ -228,6 +233,8 @@ def check_non_cooldown_requirements(all_reservations, day, reservation_type, sta
     the non-cooldown related rules that must be applied to the reservation, if the rules
     correctly applies without error, return True, return False if there exists some error
     and the reservation cannot be made
+    The number of reservations running in each slot is read from the occupancy grid
+    of the reservation manager
 
     Args:
         all_reservations (ReservationManager): The reservation manager of the system
@@ -239,24 +246,13 @@ def check_non_cooldown_requirements(all_reservations, day, reservation_type, sta
     Returns:
         (False, error response) if the reservation violates some requirement, (True, None) otherwise
     """
+    occupancy = all_reservations.occupancy.day(day.toordinal())
     for t in range(start_time, end_time, 5):
-        count = 0
-        s_cnt = 0
-        h_run = False
-        for reservation in all_reservations:
-            reservation_start, reservation_end = split_time(reservation.start_time, reservation.end_time)
-            if not (t >= reservation_start and t < reservation_end):
-                continue
-            if not between(f'{day.month}-{day.day}-{day.year}', reservation.start_date, reservation.end_date):
-                continue
-            if reservation.reservation_type == 'harvester':
-                h_run = True
-            if reservation.reservation_type != 'workshop':
-                # increament special_count by 1
-                s_cnt += 1
-            if reservation.reservation_type == reservation_type:
-                # increament count by 1
-                count += 1
+        # Number of the half hour slot starting at t
+        slot = t // 5
+        count = occupancy.count(reservation_type, slot)
+        s_cnt = occupancy.special_count(slot)
+        h_run = occupancy.harvester_running(slot)
         if not is_available(reservation_type, count+1):
             print(f'Reservation Failed: not enough available {reservation_type}, {count} already reserved.')
             return False, error_response(400, "Reservation", f'Not enough available {reservation_type}, {count} already reserved')
@@ -273,6 +269,26 @@ def check_non_cooldown_requirements(all_reservations, day, reservation_type, sta
             
     return True, None
 
+def cooldown_conflicts(all_reservations, day, reservation_type, start_time, end_time):
+    """
+    Given a start time and an end time, find the reservations of a resource
+    running on a given day too close to that time to leave the cooldown
+    period of the resource between uses
+
+    Args:
+        all_reservations (ReservationManager): The reservation manager of the system
+        day (datetime): the datetime object of the day that is being checked
+        reservation_type (str): the machine to make reservation for
+        start_time (int): the start time of this reservation
+        end_time (int): the finish time of this reservation
+
+    Returns:
+        A list of reservations (List[Reservation]), sorted by start time
+    """
+    cooldown = COOLDOWNS[reservation_type]
+    return all_reservations.intervals.overlapping(reservation_type, day.toordinal(),
+        (start_time - cooldown) // 5, (end_time + cooldown) // 5)
+
 def check_hvc_requirements(all_reservations, day, start_time, end_time):
     """
     Given a start time and an end time, check that on a given day, the hvc machine
@@ -287,16 +303,11 @@ def check_hvc_requirements(all_reservations, day, start_time, end_time):
     Returns:
         (True, None) if the hvc is being operated within requirements, (False, error response) otherwise
     """
-    hvc_start = start_time - 60
-    hvc_end = end_time + 60
-    for reservation in all_reservations:
-        if reservation.reservation_type == 'hvc':
-            if not between(f'{day.month}-{day.day}-{day.year}', reservation.start_date, reservation.end_date):
-                continue
-            reservation_start, reservation_end = split_time(reservation.start_time, reservation.end_time)
-            if not (hvc_end <= reservation_start or reservation_end <= hvc_start):
-                print(f'Reservation Failed: high velocity crusher needs to cool down for 6 hours between uses, hvc currently reserved for {reservation.start_time}-{reservation.end_time}.')
-                return False, error_response(400, "Reservation", f'High velocity crusher needs to cool down for 6 hours between uses, hvc currently reserved for {reservation.start_time}-{reservation.end_time}.')
+    conflicts = cooldown_conflicts(all_reservations, day, 'hvc', start_time, end_time)
+    if len(conflicts) > 0:
+        reservation = conflicts[0]
+        print(f'Reservation Failed: high velocity crusher needs to cool down for 6 hours between uses, hvc currently reserved for {reservation.start_time}-{reservation.end_time}.')
+        return False, error_response(400, "Reservation", f'High velocity crusher needs to cool down for 6 hours between uses, hvc currently reserved for {reservation.start_time}-{reservation.end_time}.')
     return True, None
 
 def check_irradiator_requirements(all_reservations, day, start_time, end_time):
@@ -313,21 +324,39 @@ def check_irradiator_requirements(all_reservations, day, start_time, end_time):
     Returns:
         (True, None) if the irradiator is being operated within requirements, (False, error response) otherwise
     """
-    irradiator_start = start_time - 10
-    irradiator_end = end_time + 10
-    count = 0
-    for reservation in all_reservations:
-        if reservation.reservation_type == 'irradiator':
-            if not between(f'{day.month}-{day.day}-{day.year}', reservation.start_date, reservation.end_date):
-                continue
-            reservation_start, reservation_end = split_time(reservation.start_time, reservation.end_time)
-            if not (irradiator_end <= reservation_start or reservation_end <= irradiator_start):
-                count += 1
-    if count == 2:
+    if len(cooldown_conflicts(all_reservations, day, 'irradiator', start_time, end_time)) >= 2:
         print(f'Reservation Failed: irradiators need to cool down for 1 hour between uses.')
         return False, error_response(400, "Reservation","Irradiators need to cool down for 1 hour between uses")
     return True, None
 
+def check_cooldown_requirements(all_reservations, day, reservation_type, start_time, end_time):
+    """
+    Given a start time and an end time, check that on a given day, a machine
+    with a cooldown period is used in accordance with the cooldown rules
+    The machine is available if the reservations running during the reservation
+    or its cooldown period leave room for one more of that machine
+
+    Args:
+        all_reservations (ReservationManager): The reservation manager of the system
+        day (datetime): the datetime object of the day that is being checked
+        reservation_type (str): the machine to make reservation for
+        start_time (str): the start time of this reservation
+        end_time (str): the finish time of this reservation
+
+    Returns:
+        (True, None) if the machine is being operated within requirements, (False, error response) otherwise
+    """
+    if reservation_type == 'hvc':
+        return check_hvc_requirements(all_reservations, day, start_time, end_time)
+    if reservation_type == 'irradiator':
+        return check_irradiator_requirements(all_reservations, day, start_time, end_time)
+    count = len(cooldown_conflicts(all_reservations, day, reservation_type, start_time, end_time))
+    if not is_available(reservation_type, count + 1):
+        minutes = COOLDOWNS[reservation_type] * 6
+        print(f'Reservation Failed: {reservation_type} needs to cool down for {minutes} minutes between uses.')
+        return False, error_response(400, "Reservation", f'{reservation_type} needs to cool down for {minutes} minutes between uses')
+    return True, None
+
 def handle_reservation(all_reservations, reservation):
     """
     Given a reservation, check all conditions to see if it is a valid reservation
@@ -400,15 +429,10 @@ def handle_reservation(all_reservations, reservation):
         if not succeeded:
             return False, error
         
-        # check that the high velocity crusher has 6 hours cooldown between uses
-        if reservation_type == 'hvc':
-            succeeded, error = check_hvc_requirements(all_reservations, day, start_time, end_time)
-            if not succeeded:
-                return False, error
-    
-        # check that irradiators have a 60 minutes cooldown period after use
-        if reservation_type == 'irradiator':
-            succeeded, error = check_irradiator_requirements(all_reservations, day, start_time, end_time)
+        # check that machines with a cooldown period, such as the 6 hours of the
+        # high velocity crusher and the 1 hour of the irradiators, have cooled down
+        if reservation_type in COOLDOWNS:
+            succeeded, error = check_cooldown_requirements(all_reservations, day, reservation_type, start_time, end_time)
             if not succeeded:
                 return False, error
     
@@ -420,7 +444,7 @@ def handle_reservation(all_reservations, reservation):
     return True, None
 
 
-def handle_request(request):
+def handle_request(request, data_manager=None, config=None):
     """
     Main function of this reservation program, the format of commands are as follows:
     reserve.py reserve <customer_id> <resource> <start_date> <end_date> <start_time> <end_time> <reserve_date>
@@ -432,20 +456,177 @@ def handle_request(request):
     Any date is of the form mm-dd-yyyy
     Any time is of the form hh:mm in 24 hour format
 
-    Handle the above requests by loading the data from data.txt, performing request
-    and then saving updated data back into data.txt
+    Handle the above requests against the in-memory data of a DataManager, which
+    is reloaded if data.txt has been changed externally, and save updated data
+    back into data.txt only if the request modified it
+    Requests may be handled by several threads at once, see handle_reserve_request
+
+    Args:
+        request (list): A list of comand and arugments
+        data_manager (DataManager): OPTIONAL, a process-resident DataManager to
+            reuse, a new one is loaded from the data file if not given
+        config (Settings): OPTIONAL, the settings giving the data file, the
+            process-wide settings by default
+
+    Returns:
+        (True, response) if success, (False, error) otherwise
+    """
+    if data_manager is None:
+        data_manager = open_data_manager(config)
+
+    if request[0] == 'reserve':
+        return handle_reserve_request(data_manager, request)
+    if request[0] == 'cancel':
+        return handle_cancel_request(data_manager, request)
+    if request[0] in ('reservations', 'financial', 'summary'):
+        # Reports are generated from the latest snapshot of the data, without
+        # waiting for the requests that are changing it
+        return dispatch_request(data_manager, request)
+    with data_manager.lock:
+        data_manager.refresh()
+        try:
+            success, response = dispatch_request(data_manager, request)
+        except BaseException:
+            data_manager.rollback()
+            raise
+        data_manager.close()
+    return success, response
+
+
+def reservation_lock_keys(customer_id, reservation_type, start_day, end_day):
+    """
+    Return the keys of the locks to hold while checking and making or
+    cancelling a reservation, which cover all data read to check it:
+    the reservations of the customer, and the reservations of the workshop
+    or of the special machines (which are counted together by the harvester
+    rule) on each day of the reservation
+
+    Args:
+        customer_id (str): the customer of the reservation
+        reservation_type (str): the machine/workshop reserved
+        start_day (int): the date ordinal of the first day of the reservation
+        end_day (int): the date ordinal of the last day of the reservation
+
+    Returns:
+        A list of keys (List[tuple])
+    """
+    group = 'workshop' if reservation_type == 'workshop' else 'special'
+    # A reservation of more than 30 days is rejected anyway
+    end_day = min(end_day, start_day + 31)
+    return [('customer', customer_id)] + [(group, day) for day in range(start_day, end_day + 1)]
+
+
+def handle_reserve_request(data_manager, request):
+    """
+    Handle a reserve request, checking the reservation while only holding the
+    locks of its customer, resource and days, so that reservations of other
+    resources, days and customers can be checked at the same time by other
+    threads. The reservation is then made holding the lock of the DataManager
+    for a short time
 
     Args:
+        data_manager (DataManager): the DataManager holding all data
         request (list): A list of comand and arugments
 
     Returns:
         (True, response) if success, (False, error) otherwise
     """
+    reserve_request = ReserveRequest(request[1:])
+    keys = reservation_lock_keys(reserve_request.customer_id, reserve_request.reservation_type,
+                                 persist.date_ordinal(reserve_request.start_date),
+                                 persist.date_ordinal(reserve_request.end_date))
+    with data_manager.locks.hold(keys):
+        with data_manager.lock:
+            data_manager.refresh()
+            generation = data_manager.generation
+        success, error = handle_reservation(data_manager.r_manager, reserve_request)
+        if not success:
+            return False, error
+        with data_manager.lock, data_manager.transaction():
+            if data_manager.generation != generation:
+                # The data has been reloaded while checking the reservation
+                success, response = dispatch_request(data_manager, request)
+            else:
+                success, response = True, make_reservation(data_manager, request, reserve_request)
+    return success, response
+
+
+def handle_cancel_request(data_manager, request):
+    """
+    Handle a cancel request, holding the locks of the reservation to cancel so
+    that it does not change the data read by a reservation being checked
+
+    Args:
+        data_manager (DataManager): the DataManager holding all data
+        request (list): A list of comand and arugments
 
-    # Initialize DataManager
-    data_file = parse_data_file()
-    data_manager = persist.DataManager(data_file)
+    Returns:
+        (True, response) if success, (False, error) otherwise
+    """
+    with data_manager.lock:
+        data_manager.refresh()
+        reservation = data_manager.select_reservation(int(request[1]))
+    keys = []
+    if reservation:
+        keys = reservation_lock_keys(reservation.customer_id, reservation.reservation_type,
+                                     reservation.start_day, reservation.end_day)
+    with data_manager.locks.hold(keys):
+        with data_manager.lock, data_manager.transaction():
+            success, response = dispatch_request(data_manager, request)
+    return success, response
+
+
+def handle_batch(requests, data_manager=None, config=None):
+    """
+    Handle several reserve requests at once: all reservations are checked
+    against the same in-memory data, each one taking the reservations made by
+    the earlier requests of the batch into account, and the data is saved
+    only once for the whole batch
+    A request that fails does not prevent the other ones from being made
 
+    Args:
+        requests (List[list]): A list of reserve commands and their arguments,
+            in the format of handle_request
+        data_manager (DataManager): OPTIONAL, a process-resident DataManager to
+            reuse, a new one is loaded from the data file if not given
+        config (Settings): OPTIONAL, the settings giving the data file, the
+            process-wide settings by default
+
+    Returns:
+        A list of (True, response) or (False, error), one for each request,
+        as returned by handle_request
+    """
+    if data_manager is None:
+        data_manager = open_data_manager(config)
+
+    keys = []
+    for request in requests:
+        if request[0] == 'reserve':
+            keys += reservation_lock_keys(request[1], request[2], persist.date_ordinal(request[3]),
+                                          persist.date_ordinal(request[4]))
+    results = []
+    # An exception rolls back the requests of the batch made before it
+    with data_manager.locks.hold(keys), data_manager.lock, data_manager.transaction():
+        for request in requests:
+            if request[0] != 'reserve':
+                results.append((False, error_response(400, "Reservation", f"Invalid request: {request[0]}")))
+                continue
+            results.append(dispatch_request(data_manager, request))
+    return results
+
+
+def dispatch_request(data_manager, request):
+    """
+    Perform a request of handle_request on the data of a DataManager, without
+    saving the data
+
+    Args:
+        data_manager (DataManager): the DataManager holding all data
+        request (list): A list of comand and arugments
+
+    Returns:
+        (True, response) if success, (False, error) otherwise
+    """
     response = None
 
     # Handle request
@@ -454,26 +635,10 @@ def handle_request(request):
         # Get all the required arguments from the command line
         reserve_request = ReserveRequest(request[1:])
         # Check if the reservation is possible
-        all_reservations = data_manager.all_reservations()
-        success, error = handle_reservation(all_reservations, reserve_request)
+        success, error = handle_reservation(data_manager.r_manager, reserve_request)
         if not success:
-            data_manager.close()
             return False, error
-        # Make the reservation
-        reservation_id = get_new_reservation_id(data_manager)
-        reservation_info, discount = generate_reservation_details(reservation_id, reserve_request)
-        new_reservation = persist.Reservation(reservation_info)
-        data_manager.add_reservation(new_reservation)
-        # Add a transaction for this reservation
-        staff_id = request[8]
-        transaction_id = get_new_transaction_id(data_manager)
-        transaction_date = new_reservation.date_of_reservation
-        transaction_info = generate_transaction_details(transaction_id, 'RESERVATION', transaction_date, reservation_info, str(int(time.time())), staff_id)
-        new_transaction = persist.Transaction(transaction_info)
-        data_manager.add_transaction(new_transaction)
-        # Print reservation successful message (including total cost and down payment)
-        print(f"Reservation succeeded! Reservation id: {new_reservation.reservation_id}, Total cost: ${new_reservation.total_cost}, down payment: ${new_reservation.down_payment}.")
-        response = reservation_response_detail(new_reservation, discount)
+        response = make_reservation(data_manager, request, reserve_request)
     
     elif command == 'cancel':
         reservation_id = int(request[1])
@@ -482,7 +647,6 @@ def handle_request(request):
         reservation = data_manager.select_reservation(reservation_id)
         
         if not reservation:
-            data_manager.close()
             return False, error_response(400, "Cancellation", f"Invalid reservation id: {reservation_id}")
         
         # Delete the reservation from the database
@@ -505,26 +669,125 @@ def handle_request(request):
     elif command == 'reservations':
         start_date = request[1]
         end_date = request[2]
-        customer_id = request[3] if len(request) == 4 else ""
-        all_reservations = data_manager.all_reservations()
-        response = generate_reservations_report(all_reservations, start_date, end_date, customer_id)
+        customer_id = request[3] if len(request) > 3 else ""
+        limit, cursor = request[4:6] if len(request) > 4 else (None, None)
+        after = decode_cursor(cursor)
+        if after is False:
+            return False, error_response(400, "Get Reservations", "invalid cursor")
+        # One more reservation is read to know if there is a next page
+        reservations = data_manager.reservations_between(start_date, end_date, customer_id, after,
+                                                         None if limit is None else limit + 1)
+        response = generate_reservations_report(reservations[:limit], start_date, end_date, customer_id)
+        if limit is not None:
+            last = reservations[limit - 1] if len(reservations) > limit else None
+            response["next_cursor"] = last and encode_cursor(last.start_day, last.reservation_id)
     
+    elif command == 'availability':
+        resource = request[1]
+        if resource not in CAPACITY:
+            return False, error_response(400, "Get Availability", f"Unsupported resource: {resource}")
+        start_day, end_day = persist.date_ordinal(request[2]), persist.date_ordinal(request[3])
+        if end_day < start_day:
+            return False, error_response(400, "Get Availability", "end_date is before start_date")
+        if end_day - start_day > BOOKING_WINDOW_DAYS:
+            return False, error_response(400, "Get Availability", f"the date range is longer than {BOOKING_WINDOW_DAYS} days")
+        response = generate_availability_report(data_manager.r_manager, resource, request[2], request[3])
+
+    elif command == 'suggest':
+        customer_id, resource, duration, reservation_date, count = request[1:]
+        if resource not in CAPACITY:
+            return False, error_response(400, "Suggest Reservations", f"Unsupported resource: {resource}")
+        response = generate_suggestions_report(data_manager.r_manager, customer_id, resource, duration, reservation_date, count)
+
+    elif command == 'summary':
+        start_date, end_date, group_by = request[1:]
+        summary = data_manager.transactions_summary(start_date, end_date, group_by)
+        response = generate_summary_report(summary, start_date, end_date, group_by)
+
     elif command == 'financial':
         # List transactions between the two dates
         start_date = request[1]
         end_date = request[2]
-        all_transactions = data_manager.all_transactions()
-        response = generate_transactions_report(all_transactions, start_date, end_date)
+        limit, cursor = request[3:5] if len(request) > 3 else (None, None)
+        after = decode_cursor(cursor)
+        if after is False:
+            return False, error_response(400, "Get Transactions", "invalid cursor")
+        # One more transaction is read to know if there is a next page
+        transactions = data_manager.transactions_between(start_date, end_date, after,
+                                                         None if limit is None else limit + 1)
+        response = generate_transactions_report(transactions[:limit], start_date, end_date)
+        if limit is not None:
+            last = transactions[limit - 1] if len(transactions) > limit else None
+            response["next_cursor"] = last and encode_cursor(last.transaction_day, last.transaction_id)
     
     else:
         print(f"Unsupported command: {command}")
-        data_manager.close()
         return False, error_response(400, "Cancellation", f"Invalid request: {command}")
     
-    data_manager.close()
     return True, response
 
 
+def make_reservation(data_manager, request, reserve_request):
+    """
+    Make a reservation that has been checked, and add its transaction
+
+    Args:
+        data_manager (DataManager): the DataManager holding all data
+        request (list): the reserve command and its arguments
+        reserve_request (ReserveRequest): the reservation to make
+
+    Returns:
+        A dict object containing detail information of the reservation
+    """
+    reservation_id = get_new_reservation_id(data_manager)
+    reservation_info, discount = generate_reservation_details(reservation_id, reserve_request)
+    new_reservation = persist.Reservation(reservation_info)
+    data_manager.add_reservation(new_reservation)
+    # Add a transaction for this reservation
+    staff_id = request[8]
+    transaction_id = get_new_transaction_id(data_manager)
+    transaction_date = new_reservation.date_of_reservation
+    transaction_info = generate_transaction_details(transaction_id, 'RESERVATION', transaction_date, reservation_info, str(int(time.time())), staff_id)
+    new_transaction = persist.Transaction(transaction_info)
+    data_manager.add_transaction(new_transaction)
+    # Print reservation successful message (including total cost and down payment)
+    print(f"Reservation succeeded! Reservation id: {new_reservation.reservation_id}, Total cost: ${new_reservation.total_cost}, down payment: ${new_reservation.down_payment}.")
+    return reservation_response_detail(new_reservation, discount)
+
+
+def encode_cursor(day, record_id):
+    """
+    Construct the cursor of the page of a report following a record
+
+    Args:
+        day (int): the date ordinal the report is sorted by
+        record_id (int): the id of the record
+
+    Returns:
+        An opaque string
+    """
+    return base64.urlsafe_b64encode(f"{day}.{record_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Return the day and id of the record a cursor of encode_cursor follows
+
+    Args:
+        cursor (str): a cursor, or None
+
+    Returns:
+        (day, id), None if cursor is None, or False if the cursor is invalid
+    """
+    if cursor is None:
+        return None
+    try:
+        day, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(".")
+        return int(day), int(record_id)
+    except ValueError:
+        return False
+
+
 def error_response(code, operation_name, detail):
     """
     Construct a error response
@@ -743,10 +1006,8 @@ def calculate_refund(cancelled_reservation, cancel_date):
         refund
     """
     # print refund
-    start_date = datetime.strptime(cancelled_reservation.start_date, "%m-%d-%Y")
-    cancel_datetime = datetime.strptime(cancel_date, "%m-%d-%Y")
     refund = 0
-    days_before_reservation = (start_date - cancel_datetime).days
+    days_before_reservation = cancelled_reservation.start_day - persist.date_ordinal(cancel_date)
 
     percent_returned = 0
     # calculate the amount of refund based on how many days ahead
@@ -764,6 +1025,8 @@ def generate_reservations_report(all_reservations, start_date, end_date, custome
     """
     Generate a JSON report of all reservations in the system based
     Formatted according to the API design dcoument
+    A reservation is reported if it is running on any day between the start
+    date and the end date, even if it started before the start date
 
     Args:
         all_reservations(List[Reservation]): a list of reservations
@@ -776,11 +1039,12 @@ def generate_reservations_report(all_reservations, start_date, end_date, custome
         the 'GET reservations' API endpoint
     """
     list_reservation_data = []
+    start_day, end_day = persist.date_ordinal(start_date), persist.date_ordinal(end_date)
     for reservation in all_reservations:
         # If customer id matches or not specified
         if (customer_id == "" or reservation.customer_id == customer_id):
-            # Print all reservations between this date
-            if between(reservation.start_date, start_date, end_date):
+            # Print all reservations running between these dates
+            if reservation.start_day <= end_day and reservation.end_day >= start_day:
                 list_reservation_data.append({
                     "reservation_id":reservation.reservation_id,
                     "customer_id": reservation.customer_id,
@@ -795,6 +1059,167 @@ def generate_reservations_report(all_reservations, start_date, end_date, custome
     return {"reservations": list_reservation_data}
 
 
+def slot_availability(all_reservations, day, resource):
+    """
+    Compute how many more reservations of a resource can start in each half
+    hour slot of a day, for a reservation of 30 minutes, by applying the opening
+    hours, capacity, harvester and cooldown rules in one pass over the slots
+    The rules depending on the customer are not applied
+
+    Args:
+        all_reservations (ReservationManager): The reservation manager of the system
+        day (datetime): the datetime object of the day
+        resource (str): the resource to reserve
+
+    Returns:
+        A list of the number of available resources in each slot of the day
+    """
+    slots = persist.DayOccupancy.SLOTS
+    occupancy = all_reservations.occupancy.day(day.toordinal())
+
+    # Count the reservations a reservation starting in each slot would be too
+    # close to, by adding each interval widened by the cooldown to a
+    # difference array
+    conflicts = [0] * (slots + 1)
+    if resource in COOLDOWNS:
+        cooldown = COOLDOWNS[resource] // 5
+        for start_slot, end_slot, _, _ in all_reservations.intervals.on_day(resource, day.toordinal()):
+            conflicts[max(start_slot - cooldown, 0)] += 1
+            conflicts[min(end_slot + cooldown, slots)] -= 1
+
+    available = []
+    running_conflicts = 0
+    for slot in range(slots):
+        running_conflicts += conflicts[slot]
+        if workshop_is_closed(slot * 5, slot * 5 + 5, day):
+            available.append(0)
+            continue
+        count = occupancy.count(resource, slot)
+        remaining = CAPACITY[resource] - count
+        if resource == 'irradiator':
+            # Only 1 irradiator can be used at a time
+            remaining = min(remaining, 1 - count)
+        if occupancy.harvester_running(slot):
+            # Only the special machines count, but no reservation can be made
+            # once too many of them are running with the harvester
+            special_count = occupancy.special_count(slot)
+            if resource != 'workshop':
+                remaining = min(remaining, 4 - special_count)
+            elif special_count > 4:
+                remaining = 0
+        remaining = min(remaining, CAPACITY[resource] - running_conflicts)
+        available.append(max(remaining, 0))
+    return available
+
+def generate_availability_report(all_reservations, resource, start_date, end_date):
+    """
+    Generate a JSON report of the availability of a resource in every half hour
+    slot of every day between two dates, only including the slots in which
+    the workshop can be open
+
+    Args:
+        all_reservations (ReservationManager): The reservation manager of the system
+        resource (str): the resource to reserve
+        start_date (str): the first day of the report, in mm-dd-yyyy format
+        end_date (str): the last day of the report, in mm-dd-yyyy format
+
+    Returns:
+        A dict containing the number of available resources in every slot of every day
+    """
+    days = []
+    day = datetime.strptime(start_date, "%m-%d-%Y")
+    end_datetime = datetime.strptime(end_date, "%m-%d-%Y")
+    while day <= end_datetime:
+        available = slot_availability(all_reservations, day, resource)
+        # The workshop is open from 9:00 to 18:00 at most
+        days.append({
+            "date": day.strftime("%m-%d-%Y"),
+            "slots": {f"{slot // 2:02d}:{slot % 2 * 30:02d}": available[slot] for slot in range(18, 36)}
+        })
+        day += timedelta(days=1)
+    return {"resource": resource, "availability": days}
+
+def suggest_reservations(all_reservations, customer_id, resource, duration, reservation_date, count):
+    """
+    Find the earliest times at which a customer can reserve a resource, within
+    the 30 days in which reservations can be made, applying all the rules of
+    handle_reservation
+    Days on which the workshop is closed or the customer has reached the limit
+    of reservations of the week are skipped, and the other days are searched
+    using the availability of the resource in each slot
+
+    Args:
+        all_reservations (ReservationManager): The reservation manager of the system
+        customer_id (str): the customer who wants to make the reservation
+        resource (str): the resource to reserve
+        duration (int): the duration of the reservation in minutes, a multiple of 30
+        reservation_date (str): the date on which the reservation is made, in mm-dd-yyyy format
+        count (int): the maximum number of start times to return
+
+    Returns:
+        A list of (day, start slot) of the earliest possible reservations,
+        where day is a datetime object
+    """
+    length = duration // 30
+    first_day = datetime.strptime(reservation_date, "%m-%d-%Y")
+    suggestions = []
+    for offset in range(31):
+        day = first_day + timedelta(days=offset)
+        # The workshop is closed on sundays
+        if day.weekday() == 6:
+            continue
+        # Over three reservations in this week
+        if all_reservations.reserved_days(customer_id, persist.iso_week(day.toordinal())) >= 3:
+            continue
+        available = slot_availability(all_reservations, day, resource)
+        # Only one special machine can be reserved by a customer at a time
+        if resource != 'workshop':
+            for reservation in all_reservations.customer_reservations(customer_id):
+                if reservation.start_day <= day.toordinal() <= reservation.end_day:
+                    for slot in range(max(reservation.start_slot, 0), min(reservation.end_slot, len(available))):
+                        available[slot] = 0
+        run = 0
+        for slot in range(len(available)):
+            run = run + 1 if available[slot] > 0 else 0
+            if run < length:
+                continue
+            start_slot = slot - length + 1
+            # The cooldown rules apply to the whole reservation, not each slot
+            if resource in COOLDOWNS:
+                conflicts = cooldown_conflicts(all_reservations, day, resource, start_slot * 5, (slot + 1) * 5)
+                if not is_available(resource, len(conflicts) + 1):
+                    continue
+            suggestions.append((day, start_slot))
+            if len(suggestions) == count:
+                return suggestions
+    return suggestions
+
+def generate_suggestions_report(all_reservations, customer_id, resource, duration, reservation_date, count):
+    """
+    Generate a JSON report of the earliest times at which a customer can
+    reserve a resource, see suggest_reservations
+
+    Args:
+        all_reservations (ReservationManager): The reservation manager of the system
+        customer_id (str): the customer who wants to make the reservation
+        resource (str): the resource to reserve
+        duration (int): the duration of the reservation in minutes, a multiple of 30
+        reservation_date (str): the date on which the reservation is made, in mm-dd-yyyy format
+        count (int): the maximum number of start times to return
+
+    Returns:
+        A dict containing the start date, start time and end time of each suggestion
+    """
+    suggestions = []
+    for day, start_slot in suggest_reservations(all_reservations, customer_id, resource, duration, reservation_date, count):
+        end_slot = start_slot + duration // 30
+        suggestions.append({
+            "start_date": day.strftime("%m-%d-%Y"),
+            "start_time": f"{start_slot // 2:02d}:{start_slot % 2 * 30:02d}",
+            "end_time": f"{end_slot // 2:02d}:{end_slot % 2 * 30:02d}"
+        })
+    return {"customer_id": customer_id, "resource": resource, "suggestions": suggestions}
+
 def generate_transactions_report(all_transactions, start_date, end_date):
     """
     Generate a JSON report of all transactions in the system based
@@ -810,36 +1235,185 @@ def generate_transactions_report(all_transactions, start_date, end_date):
         the 'GET transactions' API endpoint
     """
     list_transaction_data = []
+    start_day, end_day = persist.date_ordinal(start_date), persist.date_ordinal(end_date)
     for transaction in all_transactions:
-        if between(transaction.transaction_date, start_date, end_date):
-            reservation = transaction.detail
-            transaction_type = transaction.type.split("$")
-            transaction_amount = reservation.down_payment
-            if len(transaction_type) == 2:
-                transaction_amount = transaction_type[1]
-            transaction_type = transaction_type[0]
-
-            list_transaction_data.append({
-                "transaction_id": transaction.transaction_id,
-                "transaction_type": transaction_type,
-                "transaction_date": transaction.transaction_date,
-                "reservation_id": reservation.reservation_id,
-                "customer_id": reservation.customer_id,
-                "resource": reservation.reservation_type,
-                "total_cost": reservation.total_cost,
-                "transaction_amount": transaction_amount
-            })
+        if start_day <= transaction.transaction_day <= end_day:
+            list_transaction_data.append(transaction_report_data(transaction))
     return {"transactions": list_transaction_data}
 
 
-def parse_data_file():
+def transaction_report_data(transaction):
     """
-    Parse the config file to get data file
+    Construct the data of a transaction in a transactions report
+
+    Args:
+        transaction (Transaction): the transaction to report on
+
+    Returns:
+        A dict of the TRANSACTION_FIELDS of the transaction
+    """
+    reservation = transaction.detail
+    transaction_type = transaction.type.split("$")
+    transaction_amount = reservation.down_payment
+    if len(transaction_type) == 2:
+        transaction_amount = transaction_type[1]
+    transaction_type = transaction_type[0]
+
+    return {
+        "transaction_id": transaction.transaction_id,
+        "transaction_type": transaction_type,
+        "transaction_date": transaction.transaction_date,
+        "reservation_id": reservation.reservation_id,
+        "customer_id": reservation.customer_id,
+        "resource": reservation.reservation_type,
+        "total_cost": reservation.total_cost,
+        "transaction_amount": transaction_amount
+    }
+
+
+def export_transactions(start_date, end_date, export_format, data_manager=None, config=None):
+    """
+    Generate the lines of an export of all transactions made between two dates,
+    with the same fields as the 'GET transactions' report
+    Transactions are read EXPORT_PAGE_SIZE at a time, each page following the
+    last transaction of the previous one in the date index, so the memory used
+    does not depend on the number of transactions exported
+
+    Args:
+        start_date (str): The starting date of transactions to export
+        end_date (str): The ending date of transactions to export
+        export_format (str): 'ndjson' for one JSON object per line, or 'csv'
+            for a header line followed by one line per transaction
+        data_manager (DataManager): OPTIONAL, a process-resident DataManager to
+            reuse, a new one is loaded from the data file if not given
+        config (Settings): OPTIONAL, the settings giving the data file, the
+            process-wide settings by default
+
+    Returns:
+        An iterator of lines (str), each ending with a newline
+    """
+    if data_manager is None:
+        data_manager = open_data_manager(config)
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, TRANSACTION_FIELDS, lineterminator="\n")
+
+    def csv_line(row):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        return buffer.getvalue()
+
+    if export_format == 'csv':
+        yield csv_line(dict(zip(TRANSACTION_FIELDS, TRANSACTION_FIELDS)))
+
+    after = None
+    while True:
+        transactions = data_manager.transactions_between(start_date, end_date, after, EXPORT_PAGE_SIZE)
+        for transaction in transactions:
+            data = transaction_report_data(transaction)
+            yield csv_line(data) if export_format == 'csv' else json.dumps(data) + "\n"
+        if len(transactions) < EXPORT_PAGE_SIZE:
+            return
+        after = (transactions[-1].transaction_day, transactions[-1].transaction_id)
+
+
+def generate_summary_report(summary, start_date, end_date, group_by):
+    """
+    Generate a JSON report of the totals of the transactions made between two
+    dates, for the whole period or for each day, resource or staff
+
+    Args:
+        summary (dict): the totals of each group, see DataManager.transactions_summary
+        start_date (str): The starting date of transaction to report on 
+        end_date (str): The ending date of transactions to report on
+        group_by (str): '', 'day', 'resource' or 'staff'
+
+    Returns:
+        A JSON formatted report in accordance with API design document for
+        the 'GET transactions/summary' API endpoint
+    """
+    def totals_detail(totals):
+        detail = dict(zip(persist.FinancialRollups.FIELDS, totals))
+        for field in ('revenue', 'down_payments', 'refunds'):
+            detail[field] = round(detail[field], 2)
+        return detail
+
+    groups = []
+    total = persist.FinancialRollups.EMPTY
+    for group in sorted(summary):
+        totals = summary[group]
+        total = tuple(a + b for a, b in zip(total, totals))
+        if group_by == '':
+            continue
+        if group_by == 'day':
+            group = datetime.fromordinal(group).strftime("%m-%d-%Y")
+        groups.append({group_by: group, **totals_detail(totals)})
+    report = {"start_date": start_date, "end_date": end_date, "total": totals_detail(total)}
+    if group_by != '':
+        report["group_by"] = group_by
+        report["groups"] = groups
+    return report
+
+
+def open_data_manager(config=None):
+    """
+    Load a DataManager from the data file given in the config file, using the
+    storage backend given by "data_backend" (text, journal or sqlite, text by
+    default)
+
+    Args:
+        config (Settings): OPTIONAL, the settings to use, the process-wide
+            settings by default
+
+    Returns:
+        A DataManager object
+    """
+    data_file, backend, options = data_manager_options(config)
+    return persist.open_data_manager(data_file, backend, **options)
+
+
+def data_manager_options(config=None):
+    """
+    Return the config entries a DataManager is opened with
+
+    Args:
+        config (Settings): OPTIONAL, the settings to use, the process-wide
+            settings by default
+
+    Returns:
+        (data file, backend, options of the backend)
+    """
+    config = parse_config(config)
+    backend = config.get("data_backend", "text")
+    options = config.get("journal", {}) if backend == "journal" else {}
+    return config["data_file"], backend, options
+
+
+def parse_config(config=None):
+    """
+    Return the config entries, which are only parsed again from the config
+    file when it changes, see settings.Settings
+
+    Args:
+        config (Settings): OPTIONAL, the settings to use, the process-wide
+            settings by default
+
+    Returns:
+        A dict object of all config entries
+    """
+    return (config or settings.get_settings()).current()
+
+
+def parse_data_file(config=None):
+    """
+    Return the data file given in the config file
+
+    Args:
+        config (Settings): OPTIONAL, the settings to use, the process-wide
+            settings by default
 
     Returns:
         data file path
     """
-    config_file = "config.json"
-    with open(config_file, "r") as cf:
-        config = json.load(cf)
-        return config["data_file"]
\ No newline at end of file
+    return parse_config(config)["data_file"]
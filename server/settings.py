@@ -0,0 +1,185 @@
+# File Name: settings.py
+# File Description: configuration of the reserve system, read from config.json
+# once and kept in memory
+#
+# Date: May 7, 2022
+
+import json, os, signal, threading
+
+# The config file: RESERVE_CONFIG, relative to the current directory when it
+# is not absolute, or config.json next to this module
+CONFIG_FILE = os.environ.get("RESERVE_CONFIG",
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json"))
+
+# The prefix of the environment variables overriding config entries, e.g.
+# RESERVE_DATA_FILE overrides "data_file"
+ENV_PREFIX = "RESERVE_"
+
+# The config entries holding a path, as (entry, key in the entry or None)
+PATH_KEYS = [("data_file", None), ("staff_data_file", None), ("session", "secret_file")]
+
+# The config entries holding a JSON object
+OBJECT_KEYS = ["journal", "session"]
+
+class Settings:
+    """
+    The configuration of the reserve system
+
+    The config file is parsed once and kept in memory. It is parsed again
+    when its mtime or size changes, or after a SIGHUP (see install_reload_signal).
+    Every entry can be overridden by an environment variable named ENV_PREFIX
+    followed by the entry in upper case, whose value is parsed as JSON if it
+    is valid JSON and kept as a string otherwise. Relative paths are resolved
+    from the directory of the config file, or from the current directory for
+    the paths given by environment variables
+
+    Attributes:
+        config_file (str): absolute path of the config file
+        environ (dict): the environment variables
+        lock (Lock): lock to be held while parsing the config file
+        values (dict): the config entries
+        file_stat (tuple): (mtime, size) of the config file when last parsed
+        stale (bool): True if the config file must be parsed again
+    """
+    def __init__(self, config_file=CONFIG_FILE, environ=os.environ):
+        self.config_file = os.path.abspath(config_file)
+        self.environ = environ
+        self.lock = threading.Lock()
+        self.values = None
+        self.file_stat = None
+        self.stale = True
+
+    def current_file_stat(self):
+        """
+        Return the modification time and size of the config file
+
+        Returns:
+            (mtime in ns, size in bytes), or None if the file does not exist
+        """
+        try:
+            stat = os.stat(self.config_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def current(self):
+        """
+        Return the config entries, parsing the config file again only if it
+        has changed or a reload was requested
+
+        Returns:
+            A dict object of all config entries
+        """
+        file_stat = self.current_file_stat()
+        if self.stale or file_stat != self.file_stat:
+            with self.lock:
+                self.values = self.load()
+                self.file_stat = file_stat
+                self.stale = False
+        return self.values
+
+    def load(self):
+        """
+        Parse the config file and apply the environment overrides
+
+        Raises:
+            ValueError: if an entry of OBJECT_KEYS is not a JSON object
+
+        Returns:
+            A dict object of all config entries
+        """
+        with open(self.config_file, "r") as cf:
+            values = resolve_paths(json.load(cf), os.path.dirname(self.config_file))
+        overrides = {}
+        for name, value in self.environ.items():
+            if name.startswith(ENV_PREFIX) and name != ENV_PREFIX + "CONFIG":
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+                overrides[name[len(ENV_PREFIX):].lower()] = value
+        values.update(resolve_paths(overrides, os.getcwd()))
+        for entry in OBJECT_KEYS:
+            if not isinstance(values.get(entry, {}), dict):
+                raise ValueError(f"The {entry} entry of the config must be a JSON object")
+        return values
+
+    def request_reload(self, signum=None, frame=None):
+        """
+        Parse the config file again the next time it is used, can be used as
+        a signal handler
+        """
+        self.stale = True
+
+    def __getitem__(self, key):
+        return self.current()[key]
+
+    def get(self, key, default=None):
+        """
+        Return a config entry
+
+        Args:
+            key (str): the name of the entry
+            default: OPTIONAL, the value returned if there is no such entry
+
+        Returns:
+            The value of the entry, or default
+        """
+        return self.current().get(key, default)
+
+
+def resolve_paths(values, base):
+    """
+    Resolve the relative paths of PATH_KEYS in config entries
+
+    Args:
+        values (dict): the config entries
+        base (str): the directory the paths are relative to
+
+    Returns:
+        The config entries, with absolute paths
+    """
+    for entry, key in PATH_KEYS:
+        if key is None and isinstance(values.get(entry), str):
+            values[entry] = os.path.join(base, values[entry])
+        elif key is not None and isinstance(values.get(entry), dict) and isinstance(values[entry].get(key), str):
+            values[entry] = dict(values[entry], **{key: os.path.join(base, values[entry][key])})
+    return values
+
+
+# The process-wide Settings, created the first time they are used
+SETTINGS = None
+SETTINGS_LOCK = threading.Lock()
+
+def get_settings():
+    """
+    Return the process-wide Settings of CONFIG_FILE
+
+    Returns:
+        A Settings object
+    """
+    global SETTINGS
+    with SETTINGS_LOCK:
+        if SETTINGS is None:
+            SETTINGS = Settings()
+        return SETTINGS
+
+
+def install_reload_signal(settings):
+    """
+    Parse the config file again after the process receives a SIGHUP, if the
+    platform has SIGHUP and this is the main thread
+
+    Args:
+        settings (Settings): the settings to reload
+
+    Returns:
+        True if the signal handler has been installed, False otherwise
+    """
+    if not hasattr(signal, "SIGHUP"):
+        return False
+    try:
+        signal.signal(signal.SIGHUP, settings.request_reload)
+    except ValueError:
+        return False
+    return True
@@ -0,0 +1,53 @@
+# File Name: benchmark_cancel.py
+# File Description: Measures how the latency of cancelling a reservation grows
+# with the number of reservations in the system
+#
+# Usage: python tests/benchmark_cancel.py [sizes...]
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import persist
+
+CANCELLATIONS = 1000
+
+
+def build_data_manager(size):
+    """
+    Build a DataManager holding size reservations, without a data file
+    """
+    data_manager = persist.DataManager.__new__(persist.DataManager)
+    data_manager.r_manager = persist.ReservationManager()
+    data_manager.t_manager = persist.TransactionManager()
+    for i in range(1, size + 1):
+        data_manager.add_reservation(persist.Reservation([str(i), f"customer{i % 500}", "workshop",
+            "05-10-2022", "05-10-2022", "10:00", "10:30", "5-7-2022", "49.5", "0.0"]))
+    return data_manager
+
+
+def measure(size):
+    """
+    Return the mean latency in microseconds of selecting and deleting a
+    random reservation, as done by a cancellation
+    """
+    data_manager = build_data_manager(size)
+    reservation_ids = random.sample(range(1, size + 1), min(CANCELLATIONS, size))
+    start = time.perf_counter()
+    for reservation_id in reservation_ids:
+        data_manager.select_reservation(reservation_id)
+        data_manager.delete_reservation(reservation_id)
+    return (time.perf_counter() - start) / len(reservation_ids) * 1e6
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [1000, 10000, 100000, 1000000]
+    print(f"{'reservations':>12} | cancel latency (us)")
+    for size in sizes:
+        print(f"{size:>12} | {measure(size):.2f}")
+
+
+if __name__ == '__main__':
+    main()
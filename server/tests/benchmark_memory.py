@@ -0,0 +1,47 @@
+# File Name: benchmark_memory.py
+# File Description: Measures the memory used by reservations and transactions
+# loaded into a DataManager
+#
+# Usage: python tests/benchmark_memory.py [number of records]
+
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import persist
+
+RESOURCES = ['workshop', 'microvac', 'irradiator', 'extruder', 'hvc', 'harvester']
+
+
+def write_data_file(file, records):
+    """
+    Write a data file with the given number of reservations, each with a
+    RESERVATION transaction
+    """
+    lines = []
+    for i in range(1, records + 1):
+        date = f"{i % 12 + 1:02d}-{i % 28 + 1:02d}-2022"
+        lines.append(f"{i} customer{i % 2000} {RESOURCES[i % 6]} {date} {date} 10:00 10:30 "
+                     f"{i % 12 + 1}-1-2022 600.0 300.0")
+    file.write('\n'.join(lines) + '\n#\n')
+    for i, line in enumerate(lines, 1):
+        file.write(f"{i} RESERVATION {i % 12 + 1}-1-2022 {line} 1651951881 staff{i % 20}\n")
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as file:
+        write_data_file(file, records)
+    tracemalloc.start()
+    data_manager = persist.DataManager(file.name)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    os.unlink(file.name)
+    print(f"{records} reservations + {records} transactions: {size / 2 ** 20:.1f} MiB "
+          f"({size / records:.0f} bytes per reservation and transaction)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# File Name: test_concurrency.py
+# File Description: Stress tests of requests handled by many threads at once
+#
+# Date: May 7, 2022
+
+import os
+import shutil
+import threading
+import persist
+import reserve
+
+TESTING_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testingdata.txt")
+CLIENTS = 32
+
+def run_clients(target):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class TestConcurrentReservations:
+    '''
+    Test that reservations made by 32 concurrent clients are all kept
+    '''
+    def create_data_manager(self, tmp_path):
+        data_file = str(tmp_path / "data.txt")
+        shutil.copyfile(TESTING_DATA, data_file)
+        return persist.DataManager(data_file)
+
+    def test_no_lost_updates(self, tmp_path):
+        data_manager = self.create_data_manager(tmp_path)
+        resources = ['workshop', 'microvac', 'extruder']
+        results = [[] for _ in range(CLIENTS)]
+
+        def client(i):
+            # Every client reserves 3 weekdays, which are shared with other clients
+            for day in range(3):
+                date = f"05-{9 + (i + day) % 5:02d}-2022"
+                request = ["reserve", f"customer{i}", resources[i % 3], date, date,
+                           f"{9 + i % 8}:00", f"{9 + i % 8}:30", "05-02-2022", "yusen"]
+                results[i].append(reserve.handle_request(request, data_manager))
+        run_clients(client)
+
+        made = [response["reservation_id"] for result in results for success, response in result if success]
+        assert len(made) > 0
+        assert len(set(made)) == len(made)
+        reloaded = persist.DataManager(data_manager.data_file)
+        assert reloaded.max_reservation_id() == 2 + len(made)
+        assert reloaded.max_transaction_id() == 3 + len(made)
+        assert sorted(str(r.reservation_id) for r in reloaded.all_reservations()) == sorted(made + ['2'])
+        # Every failure is a capacity rule, checked against all reservations made before it
+        for result in results:
+            for success, response in result:
+                assert success or response["detail"].startswith("Not enough available")
+
+    def test_same_slot_is_reserved_once(self, tmp_path):
+        data_manager = self.create_data_manager(tmp_path)
+        results = [None] * CLIENTS
+
+        def client(i):
+            request = ["reserve", f"customer{i}", "hvc", "05-10-2022", "05-10-2022",
+                       "11:00", "11:30", "05-02-2022", "yusen"]
+            results[i] = reserve.handle_request(request, data_manager)
+        run_clients(client)
+
+        assert sum(success for success, _ in results) == 1
+        assert persist.DataManager(data_manager.data_file).max_reservation_id() == 3
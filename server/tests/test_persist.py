@@ -0,0 +1,478 @@
+# File Name: test_persist.py
+# File Description: Contains the tests for the persist layer of the reserve system
+#
+# Date: May 7, 2022
+
+import os
+import pytest
+import shutil
+import threading
+import persist
+import reserve
+
+TESTING_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testingdata.txt")
+
+def copy_testing_data(tmp_path):
+    data_file = str(tmp_path / "data.txt")
+    shutil.copyfile(TESTING_DATA, data_file)
+    return data_file
+
+
+class TestResidentDataManager:
+    '''
+    Test that a DataManager kept in memory between requests stays in sync
+    with its data file
+    '''
+    def test_report_does_not_rewrite_file(self, tmp_path):
+        data_file = copy_testing_data(tmp_path)
+        data_manager = persist.DataManager(data_file)
+        stat = os.stat(data_file)
+
+        success, _ = reserve.handle_request(["financial", "4-30-2022", "5-7-2022"], data_manager)
+        assert success
+        assert os.stat(data_file).st_mtime_ns == stat.st_mtime_ns
+
+    def test_cancellation_is_saved(self, tmp_path):
+        data_file = copy_testing_data(tmp_path)
+        data_manager = persist.DataManager(data_file)
+
+        success, _ = reserve.handle_request(["cancel", "2", "4-30-2022", "yusen"], data_manager)
+        assert success
+        reloaded = persist.DataManager(data_file)
+        assert reloaded.select_reservation(2) is None
+        assert reloaded.max_transaction_id() == 4
+
+    def test_external_change_is_reloaded(self, tmp_path):
+        data_file = copy_testing_data(tmp_path)
+        data_manager = persist.DataManager(data_file)
+        assert data_manager.select_reservation(2) is not None
+
+        with open(data_file, "w") as file:
+            file.write("#\n")
+        success, error = reserve.handle_request(["cancel", "2", "4-30-2022", "yusen"], data_manager)
+        assert not success
+        assert error["detail"] == "Invalid reservation id: 2"
+
+
+class TestJournaledDataManager:
+    '''
+    Test that changes are appended to the journal and replayed on load
+    '''
+    def test_changes_are_appended_to_journal(self, tmp_path):
+        data_file = copy_testing_data(tmp_path)
+        data_manager = persist.JournaledDataManager(data_file)
+        # The first save starts the journal
+        reserve.handle_request(["cancel", "2", "4-30-2022", "yusen"], data_manager)
+        snapshot = open(data_file).read()
+
+        data_manager.add_transaction(persist.Transaction(
+            "5 RESERVATION 5-1-2022 3 hayder workshop 05-02-2022 05-02-2022 10:00 10:30 5-1-2022 49.5 0.0 1651951881 yusen".split()))
+        data_manager.close()
+
+        assert open(data_file).read() == snapshot
+        assert open(data_file + ".journal").read().splitlines()[-1].startswith("T 5 RESERVATION")
+        reloaded = persist.JournaledDataManager(data_file)
+        assert reloaded.max_transaction_id() == 5
+        assert reloaded.select_reservation(2) is None
+
+    def test_load_publishes_once(self, tmp_path):
+        data_file = copy_testing_data(tmp_path)
+        data_manager = persist.JournaledDataManager(data_file)
+        reserve.handle_request(["cancel", "2", "4-30-2022", "yusen"], data_manager)
+        reloaded = persist.JournaledDataManager(data_file)
+        # The snapshot of the data file alone is never published
+        assert reloaded.data_version() == 1
+        assert reloaded.snapshot.version == 1
+
+    def test_journal_is_compacted(self, tmp_path):
+        data_file = copy_testing_data(tmp_path)
+        data_manager = persist.JournaledDataManager(data_file, compact_every=2)
+        data_manager.save()
+        data_manager.delete_reservation(2)
+        data_manager.close()
+        assert data_manager.journal_records == 1
+
+        data_manager.add_transaction(persist.Transaction(
+            "4 CANCELLATION$0 5-1-2022 2 hayder2 hvc 04-30-2022 04-30-2022 12:00 12:30 4-30-2022 10000 5000.0 1651951881 yusen".split()))
+        data_manager.close()
+        assert data_manager.journal_records == 0
+        assert persist.DataManager(data_file).select_reservation(2) is None
+
+    def test_journal_of_replaced_data_file_is_ignored(self, tmp_path):
+        data_file = copy_testing_data(tmp_path)
+        data_manager = persist.JournaledDataManager(data_file)
+        data_manager.save()
+        data_manager.delete_reservation(2)
+        data_manager.close()
+
+        with open(data_file, "a") as file:
+            file.write("\n")
+        assert persist.JournaledDataManager(data_file).select_reservation(2) is not None
+
+    def test_journal_of_touched_data_file_is_replayed(self, tmp_path):
+        data_file = copy_testing_data(tmp_path)
+        data_manager = persist.JournaledDataManager(data_file)
+        data_manager.save()
+        data_manager.delete_reservation(2)
+        data_manager.close()
+
+        os.utime(data_file)
+        assert persist.JournaledDataManager(data_file).select_reservation(2) is None
+
+    def test_skipped_fsync_is_deferred(self, tmp_path):
+        data_file = copy_testing_data(tmp_path)
+        data_manager = persist.JournaledDataManager(data_file, fsync_interval=0.05)
+        data_manager.save()
+        data_manager.delete_reservation(1)
+        data_manager.close()
+        data_manager.delete_reservation(2)
+        data_manager.close()
+        timer = data_manager.fsync_timer
+        assert timer is not None
+        timer.join()
+        assert data_manager.fsync_timer is None
+
+
+class TestSQLiteDataManager:
+    '''
+    Test that the SQLite backend behaves like the text data file
+    '''
+    def create_database(self, tmp_path):
+        database_file = str(tmp_path / "data.db")
+        persist.SQLiteDataManager(database_file).import_data(
+            persist.DataManager(copy_testing_data(tmp_path)))
+        return database_file
+
+    def test_import_and_reports(self, tmp_path):
+        database = persist.SQLiteDataManager(self.create_database(tmp_path))
+        assert database.max_reservation_id() == 2
+        assert database.max_transaction_id() == 3
+
+        success, response = reserve.handle_request(["reservations", "4-25-2022", "5-2-2022"], database)
+        assert success
+        assert [r["reservation_id"] for r in response["reservations"]] == [2]
+        success, response = reserve.handle_request(["financial", "4-30-2022", "4-30-2022"], database)
+        assert [t["transaction_id"] for t in response["transactions"]] == [1, 2, 3]
+
+    def test_changes_of_other_connections_are_reloaded(self, tmp_path):
+        database_file = self.create_database(tmp_path)
+        first = persist.SQLiteDataManager(database_file)
+        second = persist.SQLiteDataManager(database_file)
+
+        success, _ = reserve.handle_request(["cancel", "2", "4-30-2022", "yusen"], first)
+        assert success
+        success, error = reserve.handle_request(["cancel", "2", "4-30-2022", "yusen"], second)
+        assert not success
+        assert second.max_transaction_id() == 4
+
+
+class TestOccupancyGrid:
+    '''
+    Test that the occupancy grid follows reservations being added and deleted
+    '''
+    def test_add_and_delete(self):
+        r_manager = persist.ReservationManager()
+        r_manager.add_data(persist.Reservation(
+            "1 hayder harvester 05-10-2022 05-11-2022 11:00 12:00 5-7-2022 8800.0 4400.0".split()))
+        r_manager.add_data(persist.Reservation(
+            "2 hayder2 workshop 05-11-2022 05-11-2022 11:30 12:00 5-7-2022 49.5 0.0".split()))
+        day = r_manager.occupancy.day(persist.date_ordinal("05-11-2022"))
+        assert [day.count("harvester", slot) for slot in range(21, 25)] == [0, 1, 1, 0]
+        assert [day.special_count(slot) for slot in range(21, 25)] == [0, 1, 1, 0]
+        assert day.count("workshop", 23) == 1
+        assert day.harvester_running(22)
+
+        r_manager.delete_reservation(1)
+        assert not day.harvester_running(22)
+        assert day.special_count(22) == 0
+        assert r_manager.occupancy.day(persist.date_ordinal("05-12-2022")).count("harvester", 22) == 0
+
+
+class TestCustomerIndex:
+    '''
+    Test that the reservations and reserved days of each customer are indexed
+    '''
+    def test_add_and_delete(self):
+        r_manager = persist.ReservationManager()
+        r_manager.add_data(persist.Reservation(
+            "1 hayder microvac 05-08-2022 05-10-2022 11:00 12:00 5-7-2022 4000.0 2000.0".split()))
+        r_manager.add_data(persist.Reservation(
+            "2 hayder2 workshop 05-10-2022 05-10-2022 11:30 12:00 5-7-2022 49.5 0.0".split()))
+        r_manager.add_data(persist.Reservation(
+            "3 hayder extruder 05-10-2022 05-10-2022 14:00 14:30 5-7-2022 300.0 150.0".split()))
+        assert [r.reservation_id for r in r_manager.customer_reservations("hayder")] == [1, 3]
+        # 05-08-2022 is a Sunday, the end of ISO week 18
+        assert r_manager.reserved_days("hayder", (2022, 18)) == 1
+        assert r_manager.reserved_days("hayder", (2022, 19)) == 3
+
+        r_manager.delete_reservation(1)
+        assert [r.reservation_id for r in r_manager.customer_reservations("hayder")] == [3]
+        assert r_manager.reserved_days("hayder", (2022, 18)) == 0
+        assert r_manager.reserved_days("hayder", (2022, 19)) == 1
+        assert list(r_manager.customer_reservations("nobody")) == []
+
+
+class TestDateIndex:
+    '''
+    Test that reports find reservations running in a date range through the date index
+    '''
+    def test_reservations_between(self):
+        r_manager = persist.ReservationManager()
+        r_manager.add_data(persist.Reservation(
+            "1 hayder microvac 05-08-2022 05-12-2022 11:00 12:00 5-7-2022 4000.0 2000.0".split()))
+        r_manager.add_data(persist.Reservation(
+            "2 hayder2 workshop 05-10-2022 05-10-2022 11:30 12:00 5-7-2022 49.5 0.0".split()))
+        r_manager.add_data(persist.Reservation(
+            "3 hayder extruder 05-13-2022 05-13-2022 14:00 14:30 5-7-2022 300.0 150.0".split()))
+        between = lambda start, end, customer_id="": [r.reservation_id for r in
+            r_manager.reservations_between(persist.date_ordinal(start), persist.date_ordinal(end), customer_id)]
+        # Reservation 1 started before the range but is still running
+        assert between("05-11-2022", "05-13-2022") == [1, 3]
+        assert between("05-11-2022", "05-13-2022", "hayder2") == []
+        assert between("05-01-2022", "05-07-2022") == []
+
+        r_manager.delete_reservation(1)
+        assert between("05-08-2022", "05-13-2022") == [2, 3]
+        assert r_manager.by_start.days == [persist.date_ordinal("05-10-2022"), persist.date_ordinal("05-13-2022")]
+
+
+class TestIntervalIndex:
+    '''
+    Test that the reservations close to a time window are found in the interval index
+    '''
+    def test_overlapping(self):
+        r_manager = persist.ReservationManager()
+        r_manager.add_data(persist.Reservation(
+            "1 hayder irradiator 05-09-2022 05-10-2022 09:00 12:00 5-7-2022 2000.0 1000.0".split()))
+        r_manager.add_data(persist.Reservation(
+            "2 hayder2 irradiator 05-10-2022 05-10-2022 13:00 13:30 5-7-2022 2000.0 1000.0".split()))
+        r_manager.add_data(persist.Reservation(
+            "3 hayder hvc 05-10-2022 05-10-2022 13:00 13:30 5-7-2022 10000.0 5000.0".split()))
+        overlapping = lambda start_slot, end_slot: [r.reservation_id for r in
+            r_manager.intervals.overlapping("irradiator", persist.date_ordinal("05-10-2022"), start_slot, end_slot)]
+        assert overlapping(20, 27) == [1, 2]
+        assert overlapping(24, 26) == []
+        assert overlapping(23, 24) == [1]
+
+        r_manager.delete_reservation(1)
+        assert overlapping(20, 27) == [2]
+        assert (("irradiator", persist.date_ordinal("05-09-2022"))) not in r_manager.intervals.intervals
+
+
+class TestBatch:
+    '''
+    Test that a batch of reservations is checked against its own earlier reservations
+    '''
+    def test_handle_batch(self, tmp_path):
+        data_manager = persist.DataManager(copy_testing_data(tmp_path))
+        requests = [["reserve", "hayder3", "hvc", "05-10-2022", "05-10-2022", "11:00", "11:30", "05-02-2022", "yusen"],
+                    ["reserve", "hayder4", "hvc", "05-10-2022", "05-10-2022", "13:00", "13:30", "05-02-2022", "yusen"],
+                    ["reserve", "hayder4", "workshop", "05-10-2022", "05-10-2022", "13:00", "13:30", "05-02-2022", "yusen"]]
+        results = reserve.handle_batch(requests, data_manager)
+        assert [success for success, _ in results] == [True, False, True]
+        assert results[0][1]["reservation_id"] == "3"
+        assert results[1][1]["detail"] == ('High velocity crusher needs to cool down for 6 hours between uses, '
+                                           'hvc currently reserved for 11:00-11:30.')
+        assert results[2][1]["reservation_id"] == "4"
+
+        reloaded = persist.DataManager(data_manager.data_file)
+        assert reloaded.max_reservation_id() == 4
+        assert reloaded.max_transaction_id() == 5
+
+
+class TestRollback:
+    '''
+    Test that a request raising an exception after it has changed the data
+    leaves neither its changes nor the write lock of the database behind
+    '''
+    def open_data_manager(self, tmp_path, backend):
+        data_file = copy_testing_data(tmp_path)
+        if backend == "sqlite":
+            database_file = str(tmp_path / "data.db")
+            persist.SQLiteDataManager(database_file).import_data(persist.DataManager(data_file))
+            data_file = database_file
+        return persist.open_data_manager(data_file, backend)
+
+    @pytest.mark.parametrize("backend", ["text", "journal", "sqlite"])
+    def test_failed_cancel_is_rolled_back(self, tmp_path, monkeypatch, backend):
+        data_manager = self.open_data_manager(tmp_path, backend)
+        def fail(*args):
+            raise RuntimeError("refund failed")
+        monkeypatch.setattr(reserve, "calculate_refund", fail)
+        with pytest.raises(RuntimeError):
+            reserve.handle_request(["cancel", "2", "4-30-2022", "yusen"], data_manager)
+        monkeypatch.undo()
+
+        assert data_manager.select_reservation(2) is not None
+        assert not data_manager.dirty
+        if backend == "sqlite":
+            assert not data_manager.connection.in_transaction
+        success, _ = reserve.handle_request(["cancel", "2", "4-30-2022", "yusen"], data_manager)
+        assert success
+        reloaded = persist.open_data_manager(data_manager.data_file, backend)
+        assert reloaded.select_reservation(2) is None
+        assert reloaded.max_transaction_id() == 4
+
+    def test_failed_batch_is_rolled_back(self, tmp_path, monkeypatch):
+        data_manager = self.open_data_manager(tmp_path, "text")
+        make_reservation = reserve.make_reservation
+        def fail_second(data_manager, request, reserve_request):
+            if request[1] == "hayder4":
+                raise RuntimeError("reservation failed")
+            return make_reservation(data_manager, request, reserve_request)
+        monkeypatch.setattr(reserve, "make_reservation", fail_second)
+        requests = [["reserve", "hayder3", "hvc", "05-10-2022", "05-10-2022", "11:00", "11:30", "05-02-2022", "yusen"],
+                    ["reserve", "hayder4", "workshop", "05-10-2022", "05-10-2022", "13:00", "13:30", "05-02-2022", "yusen"]]
+        with pytest.raises(RuntimeError):
+            reserve.handle_batch(requests, data_manager)
+        assert data_manager.max_reservation_id() == 2
+        assert not data_manager.dirty
+
+
+class TestSuggest:
+    '''
+    Test that suggested reservations follow the reservation rules
+    '''
+    def test_suggest_reservations(self):
+        r_manager = persist.ReservationManager()
+        # hayder has reserved 3 days of the week of Monday 05-09-2022
+        r_manager.add_data(persist.Reservation(
+            "1 hayder workshop 05-09-2022 05-11-2022 09:00 09:30 5-7-2022 297.0 0.0".split()))
+        r_manager.add_data(persist.Reservation(
+            "2 hayder2 hvc 05-16-2022 05-16-2022 12:00 12:30 5-7-2022 10000.0 5000.0".split()))
+        suggestions = reserve.suggest_reservations(r_manager, "hayder", "hvc", 60, "05-09-2022", 3)
+        # The hvc reserved at noon on 05-16-2022 is cooling down all day
+        assert [(day.strftime("%m-%d-%Y"), slot) for day, slot in suggestions] == \
+            [("05-17-2022", 18), ("05-17-2022", 19), ("05-17-2022", 20)]
+        for day, slot in suggestions:
+            request = reserve.ReserveRequest(["hayder", "hvc", day.strftime("%m-%d-%Y"), day.strftime("%m-%d-%Y"),
+                f"{slot // 2}:{slot % 2 * 30:02d}", f"{(slot + 2) // 2}:{slot % 2 * 30:02d}", "05-09-2022"])
+            assert reserve.handle_reservation(r_manager, request) == (True, None)
+
+
+class TestSnapshot:
+    '''
+    Test that reports read a snapshot of the data, without waiting for writers
+    '''
+    def test_snapshot_is_not_changed(self, tmp_path):
+        data_manager = persist.DataManager(copy_testing_data(tmp_path))
+        snapshot = data_manager.snapshot
+        reserve.handle_request(["reserve", "hayder3", "workshop", "05-10-2022", "05-10-2022",
+                                "11:00", "11:30", "05-02-2022", "yusen"], data_manager)
+        reserve.handle_request(["cancel", "2", "04-30-2022", "yusen"], data_manager)
+        assert data_manager.version == snapshot.version + 2
+        day = persist.date_ordinal("05-10-2022")
+        assert snapshot.reservations_between(day, day) == []
+        assert [r.reservation_id for r in data_manager.snapshot.reservations_between(day, day)] == [3]
+        day = persist.date_ordinal("04-30-2022")
+        assert [r.reservation_id for r in snapshot.reservations_between(day, day)] == [2]
+        assert data_manager.snapshot.reservations_between(day, day) == []
+
+    def test_report_does_not_wait_for_writers(self, tmp_path):
+        data_manager = persist.DataManager(copy_testing_data(tmp_path))
+        results = []
+        with data_manager.lock:
+            thread = threading.Thread(target=lambda: results.append(
+                reserve.handle_request(["financial", "4-30-2022", "4-30-2022"], data_manager)))
+            thread.start()
+            thread.join(5)
+            assert not thread.is_alive()
+        success, response = results[0]
+        assert [t["transaction_id"] for t in response["transactions"]] == [1, 2, 3]
+
+
+class TestFinancialRollups:
+    '''
+    Test that the daily totals of transactions match the transactions
+    '''
+    def test_summary(self, tmp_path):
+        data_manager = persist.DataManager(copy_testing_data(tmp_path))
+        snapshot = data_manager.snapshot
+        success, response = reserve.handle_request(["cancel", "2", "04-20-2022", "anna"], data_manager)
+        refund = float(response["refund"])
+        assert refund > 0
+        summary = data_manager.transactions_summary("04-20-2022", "04-30-2022", "staff")
+        assert summary == {"yusen": (2, 1, 10300.0, 5150.0, 0.0), "anna": (0, 1, 0.0, 0.0, refund)}
+        summary = data_manager.transactions_summary("04-20-2022", "04-30-2022", "day")
+        assert list(summary) == [persist.date_ordinal("04-20-2022"), persist.date_ordinal("04-30-2022")]
+        # The rollups of a snapshot are not changed by later transactions
+        day = persist.date_ordinal("04-20-2022")
+        assert snapshot.rollups.summary(day, day, "") == {}
+
+
+class TestPagination:
+    '''
+    Test that pages of reports follow each other without gaps or repetitions
+    '''
+    def test_reservation_pages(self, tmp_path):
+        data_manager = persist.DataManager(copy_testing_data(tmp_path))
+        for day in range(9, 14):
+            for customer in ["hayder3", "hayder4"]:
+                reserve.handle_request(["reserve", customer, "workshop", f"05-{day:02d}-2022", f"05-{day:02d}-2022",
+                                        "11:00", "11:30", "05-02-2022", "yusen"], data_manager)
+        pages, cursor = [], None
+        while True:
+            success, response = reserve.handle_request(["reservations", "05-01-2022", "05-31-2022", "", 3, cursor], data_manager)
+            pages.append([r["reservation_id"] for r in response["reservations"]])
+            cursor = response["next_cursor"]
+            if cursor is None:
+                break
+        # Only 3 days a week can be reserved by each customer
+        assert pages == [[3, 4, 5], [6, 7, 8]]
+
+
+class TestExport:
+    '''
+    Test that exports read transactions page by page without gaps or repetitions
+    '''
+    def test_export_pages(self, tmp_path, monkeypatch):
+        data_manager = persist.DataManager(copy_testing_data(tmp_path))
+        monkeypatch.setattr(reserve, "EXPORT_PAGE_SIZE", 2)
+        lines = list(reserve.export_transactions("04-30-2022", "05-07-2022", "csv", data_manager))
+        assert lines[0] == ",".join(reserve.TRANSACTION_FIELDS) + "\n"
+        assert [line.split(",")[0] for line in lines[1:]] == ["1", "2", "3"]
+
+
+class TestReportCache:
+    '''
+    Test that the data version the report cache is keyed on changes with
+    every saved change
+    '''
+    def test_data_version(self, tmp_path):
+        data_manager = persist.DataManager(copy_testing_data(tmp_path))
+        version = data_manager.data_version()
+        reserve.handle_request(["financial", "4-30-2022", "5-7-2022"], data_manager)
+        assert data_manager.data_version() == version
+        reserve.handle_request(["reserve", "hayder3", "workshop", "05-10-2022", "05-10-2022",
+                                "11:00", "11:30", "05-02-2022", "yusen"], data_manager)
+        assert data_manager.data_version() != version
+
+
+class TestLockTable:
+    '''
+    Test that the lock table only holds the locks of keys in use
+    '''
+    def test_locks_removed_after_release(self):
+        table = persist.LockTable()
+        with table.hold([("workshop", 1), ("microvac", 2)]):
+            with table.hold([("microvac", 3)]):
+                assert len(table.locks) == 3
+            assert len(table.locks) == 2
+        assert table.locks == {}
+
+    def test_waiting_thread_keeps_lock(self):
+        table = persist.LockTable()
+        held = threading.Event()
+
+        def hold():
+            with table.hold([("workshop", 1)]):
+                held.set()
+
+        with table.hold([("workshop", 1)]):
+            thread = threading.Thread(target=hold)
+            thread.start()
+            assert not held.wait(0.1)
+            assert table.locks[("workshop", 1)][1] == 2
+        thread.join()
+        assert held.is_set()
+        assert table.locks == {}
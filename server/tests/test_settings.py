@@ -0,0 +1,61 @@
+# File Name: test_settings.py
+# File Description: Contains the tests for the settings of the reserve system
+#
+# Date: May 7, 2022
+
+import json
+import pytest
+import settings
+
+
+class TestSettings:
+    '''
+    Test that config.json is parsed once, overridden by the environment and
+    parsed again when it changes
+    '''
+    def write_config(self, tmp_path, **values):
+        tmp_path.mkdir(exist_ok=True)
+        config_file = tmp_path / "config.json"
+        config = {"data_file": "data/data.txt", "staff_data_file": "data/staff.json",
+                  "session": {"secret_file": "data/session_secret"}}
+        config.update(values)
+        config_file.write_text(json.dumps(config))
+        return str(config_file)
+
+    def test_paths_are_resolved(self, tmp_path):
+        config = settings.Settings(self.write_config(tmp_path), environ={})
+        assert config["data_file"] == str(tmp_path / "data" / "data.txt")
+        assert config["session"]["secret_file"] == str(tmp_path / "data" / "session_secret")
+        assert config.current() is config.current()
+
+    def test_environment_overrides(self, tmp_path):
+        environ = {"RESERVE_DATA_BACKEND": "journal", "RESERVE_JOURNAL": '{"compact_every": 5}',
+                   "RESERVE_DATA_FILE": "/srv/data.txt"}
+        config = settings.Settings(self.write_config(tmp_path), environ=environ)
+        assert config["data_backend"] == "journal"
+        assert config["journal"] == {"compact_every": 5}
+        assert config["data_file"] == "/srv/data.txt"
+
+    def test_environment_paths_are_resolved_from_current_directory(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        environ = {"RESERVE_STAFF_DATA_FILE": "staff.db", "RESERVE_SESSION": '{"secret_file": "secret"}'}
+        config = settings.Settings(self.write_config(tmp_path / "config"), environ=environ)
+        assert config["staff_data_file"] == str(tmp_path / "staff.db")
+        assert config["session"]["secret_file"] == str(tmp_path / "secret")
+        assert config["data_file"] == str(tmp_path / "config" / "data" / "data.txt")
+
+    def test_object_entry_must_be_object(self, tmp_path):
+        config = settings.Settings(self.write_config(tmp_path), environ={"RESERVE_SESSION": "secret"})
+        with pytest.raises(ValueError):
+            config.current()
+
+    def test_changed_file_is_parsed_again(self, tmp_path):
+        config_file = self.write_config(tmp_path)
+        config = settings.Settings(config_file, environ={})
+        assert "data_backend" not in config.current()
+        self.write_config(tmp_path, data_backend="sqlite", data_file="data/data.db")
+        assert config["data_backend"] == "sqlite"
+        assert config["data_file"] == str(tmp_path / "data" / "data.db")
+        values = config.current()
+        config.request_reload()
+        assert config.current() is not values
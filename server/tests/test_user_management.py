@@ -9,19 +9,20 @@ import pytest
 import json
 import shutil
 import os
+import user_management_persist
 import web
 
 def current_env():
-    return os.path.abspath(__file__)
+    return os.path.dirname(os.path.abspath(__file__))
 
-DATA_FILE = current_env() + "/../data/test_user_data.json"
-BACKUP_FILE = current_env() + '/../data/test_user_data_backup.json'
+DATA_FILE = os.path.join(current_env(), "data", "test_user_data.json")
+BACKUP_FILE = os.path.join(current_env(), "data", "test_user_data_backup.json")
 
 def reset_data_file():
     shutil.copyfile(BACKUP_FILE, DATA_FILE)
 
 def update_staff_config(new_config_file):
-    config_file = os.path.abspath(__file__) + "/../../config.json"
+    config_file = os.path.join(current_env(), "..", "config.json")
     with open(config_file, "r") as cf:
         config = json.load(cf)
     
@@ -88,7 +89,7 @@ class TestUserManagementAPI:
         Test various PUT API calls to the /staff endpoint and check their
         response
         """
-        response = self.client.delete("/v2_0/staffs", json = {
+        response = self.client.request("DELETE", "/v2_0/staffs", json = {
                     "staff_to_delete_id": delete_staff, "staff_id": staff_id})
         assert response.status_code == response_code
 
@@ -103,9 +104,46 @@ class TestUserManagementAPI:
         Test various PUT API calls to the /staff endpoint and check their
         response
         """
-        response = self.client.get("/v2_0/login", json = {"staff_id": staff_id})
+        response = self.client.request("GET", "/v2_0/login", json = {"staff_id": staff_id})
         assert response.status_code == response_code
 
+    def test_api_session(self):
+        """
+        Test that the token returned by /login authenticates its staff only
+        """
+        response = self.client.request("GET", "/v2_0/login", json = {"staff_id": "hanzeh"})
+        headers = {"Authorization": "Bearer " + response.json()["detail"]["token"]}
+        response = self.client.post("/v2_0/staffs", headers = headers, json = {
+            "new_staff_id": "staffx", "staff_id": "yusen", "staff_role": "REGULAR"})
+        assert response.status_code == 403
+        response = self.client.post("/v2_0/staffs", headers = {"Authorization": "Bearer abc.def"}, json = {
+            "new_staff_id": "staffx", "staff_id": "hanzeh", "staff_role": "REGULAR"})
+        assert response.status_code == 401
+
+    def test_api_session_demoted(self):
+        """
+        Test that a valid token is authorized by the current role of its staff,
+        and is rejected once its staff is deleted
+        """
+        response = self.client.post("/v2_0/staffs", json = {
+            "new_staff_id": "admin2", "staff_id": "hanzeh", "staff_role": "ADMIN"})
+        assert response.status_code == 201
+        response = self.client.request("GET", "/v2_0/login", json = {"staff_id": "admin2"})
+        headers = {"Authorization": "Bearer " + response.json()["detail"]["token"]}
+
+        response = self.client.put("/v2_0/staffs", json = {"staff_to_update_id":
+                    "admin2", "staff_id": "hanzeh", "staff_role": "REGULAR"})
+        assert response.status_code == 200
+        response = self.client.post("/v2_0/staffs", headers = headers, json = {
+            "new_staff_id": "staffx", "staff_id": "admin2", "staff_role": "REGULAR"})
+        assert response.status_code == 403
+
+        response = self.client.request("DELETE", "/v2_0/staffs", json = {
+                    "staff_to_delete_id": "admin2", "staff_id": "hanzeh"})
+        assert response.status_code == 200
+        response = self.client.get("/v2_0/staffs?staff_id=admin2", headers = headers)
+        assert response.status_code == 403
+
     def test_revert_config(self):
         assert update_staff_config(self.temp_config) == "tests/data/test_user_data.json"
 
@@ -239,7 +277,7 @@ class TestLoginUser:
         
         request = StaffRequest(staff_id=user_id)
         actual = handle_user_management_request("LOGIN", request,
-                    current_env() + "/../data/test_user_data.json")
+                    os.path.join(current_env(), "data", "test_user_data.json"))
 
         assert expected["status_code"] == actual["status_code"]
         assert expected["detail"] == actual["detail"]
@@ -404,4 +442,235 @@ class TestDeleteUser:
         actual = handle_delete_user(request, staff_data)
         
         assert expected["status_code"] == actual["status_code"]
-        assert expected["detail"] == actual["detail"]
\ No newline at end of file
+        assert expected["detail"] == actual["detail"]
+
+
+class TestUserDataManager:
+    """
+    Test that the staff file is only read when it changes and only written
+    when a request changes the staff data
+    """
+    def create_data_file(self, tmp_path):
+        data_file = str(tmp_path / "staff.json")
+        shutil.copyfile(BACKUP_FILE, data_file)
+        return data_file
+
+    def test_login_does_not_rewrite_file(self, tmp_path):
+        data_file = self.create_data_file(tmp_path)
+        stat = os.stat(data_file)
+
+        actual = handle_user_management_request("LOGIN", StaffRequest(staff_id="hanzeh"), data_file)
+        assert actual["status_code"] == 200
+        actual = handle_user_management_request("POST", PostStaffsRequest(
+            new_staff_id="staff1", staff_id="yusen"), data_file)
+        assert actual["status_code"] == 403
+        assert os.stat(data_file).st_mtime_ns == stat.st_mtime_ns
+
+    def test_post_saves_file(self, tmp_path):
+        data_file = self.create_data_file(tmp_path)
+        actual = handle_user_management_request("POST", PostStaffsRequest(
+            new_staff_id="staff1", staff_id="hanzeh"), data_file)
+        assert actual["status_code"] == 201
+        with open(data_file) as df:
+            assert json.load(df)["staff1"] == "REGULAR"
+        assert os.listdir(tmp_path) == ["staff.json"]
+
+    def test_same_role_put_does_not_rewrite_file(self, tmp_path):
+        data_file = self.create_data_file(tmp_path)
+        stat = os.stat(data_file)
+
+        actual = handle_user_management_request("PUT", PutStaffsRequest(
+            staff_to_update_id="yusen", staff_id="hanzeh", staff_role="REGULAR"), data_file)
+        assert actual["status_code"] == 200
+        assert os.stat(data_file).st_mtime_ns == stat.st_mtime_ns
+
+    def test_external_change_is_reloaded(self, tmp_path):
+        data_file = self.create_data_file(tmp_path)
+        request = StaffRequest(staff_id="staff1")
+        assert handle_user_management_request("LOGIN", request, data_file)["status_code"] == 404
+        with open(data_file, "w") as df:
+            json.dump({"hanzeh": "ADMIN", "staff1": "REGULAR"}, df)
+        assert handle_user_management_request("LOGIN", request, data_file)["status_code"] == 200
+
+
+class TestSessionToken:
+    """
+    Test that session tokens are only valid with their signature and before
+    they expire
+    """
+    def session(self, tmp_path, lifetime=60):
+        return {"secret_file": str(tmp_path / "secret"), "lifetime": lifetime, "required": False}
+
+    def test_valid_token(self, tmp_path):
+        token, _ = issue_session_token("hanzeh", self.session(tmp_path))
+        assert verify_session_token(token, self.session(tmp_path)) == "hanzeh"
+
+    def test_tampered_token(self, tmp_path):
+        token, _ = issue_session_token("yusen", self.session(tmp_path))
+        signature = token.split(".")[1]
+        forged, _ = issue_session_token("hanzeh", self.session(tmp_path))
+        assert verify_session_token(forged.split(".")[0] + "." + signature, self.session(tmp_path)) is None
+
+    def test_expired_token(self, tmp_path):
+        token, _ = issue_session_token("hanzeh", self.session(tmp_path, lifetime=-1))
+        assert verify_session_token(token, self.session(tmp_path)) is None
+
+    def test_session_role(self, tmp_path):
+        token, _ = issue_session_token("yusen", self.session(tmp_path), "ADMIN")
+        assert read_session_token(token, self.session(tmp_path))["role"] == "ADMIN"
+
+        data_file = str(tmp_path / "staff.json")
+        shutil.copyfile(BACKUP_FILE, data_file)
+        request = PostStaffsRequest(new_staff_id="staff1", staff_id="yusen")
+        assert handle_user_management_request("POST", request, data_file, session_role="ADMIN")["status_code"] == 201
+        request = PostStaffsRequest(new_staff_id="staff2", staff_id="hanzeh")
+        assert handle_user_management_request("POST", request, data_file, session_role="REGULAR")["status_code"] == 403
+
+    def test_short_secret_is_rejected(self, tmp_path):
+        session = self.session(tmp_path)
+        with open(session["secret_file"], "w") as sf:
+            sf.write("")
+        with pytest.raises(ValueError):
+            issue_session_token("hanzeh", session)
+        with open(session["secret_file"], "w") as sf:
+            sf.write(os.urandom(32).hex())
+        token, _ = issue_session_token("hanzeh", session)
+        assert verify_session_token(token, session) == "hanzeh"
+        assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+class TestGetUsers:
+    """
+    Test Functionality for listing users from the role index
+    Test the following cases:
+        - Listing all users or the users of a role
+        - The role index follows the users being updated and deleted
+        - Failure to list users due to an invalid role
+    """
+    def create_staff_data(self):
+        return user_management_persist.StaffDirectory(
+            {"hanzeh": "ADMIN", "yusen": "REGULAR", "hayder": "REGULAR"})
+
+    def test_get_users(self):
+        staff_data = self.create_staff_data()
+
+        actual = handle_get_users(GetStaffsRequest(staff_id="hanzeh"), staff_data)
+        assert [staff["staff_id"] for staff in actual["detail"]["staffs"]] == ["hanzeh", "hayder", "yusen"]
+
+        actual = handle_get_users(GetStaffsRequest(staff_id="hanzeh", staff_role="REGULAR"), staff_data)
+        assert actual["detail"] == {"staffs": [{"staff_id": "hayder", "staff_role": "REGULAR"},
+                                               {"staff_id": "yusen", "staff_role": "REGULAR"}]}
+
+    def test_role_index(self):
+        staff_data = self.create_staff_data()
+        assert only_one_admin(staff_data)
+
+        handle_put_user(PutStaffsRequest(staff_to_update_id="yusen", staff_id="hanzeh", staff_role="ADMIN"), staff_data)
+        handle_delete_user(DeleteStaffsRequest(staff_to_delete_id="hayder", staff_id="hanzeh"), staff_data)
+        assert staff_data.staff_with_role("ADMIN") == {"hanzeh", "yusen"}
+        assert staff_data.staff_with_role("REGULAR") == set()
+        assert not only_one_admin(staff_data)
+
+    def test_role_index_follows_dict_methods(self):
+        staff_data = self.create_staff_data()
+        staff_data.update({"peter": "ADMIN"}, yusen="ADMIN")
+        assert staff_data.pop("hanzeh") == "ADMIN"
+        assert staff_data.setdefault("mary", "REGULAR") == "REGULAR"
+        assert staff_data.staff_with_role("ADMIN") == {"peter", "yusen"}
+        assert staff_data.staff_with_role("REGULAR") == {"hayder", "mary"}
+        assert ("hanzeh", "ADMIN", None) in staff_data.pending
+
+        staff_data.clear()
+        assert staff_data.staff_with_role("ADMIN") == set()
+        assert len(staff_data.pending) == 8
+
+    def test_get_users_error_invalid_role(self):
+        actual = handle_get_users(GetStaffsRequest(staff_id="hanzeh", staff_role="SUPERADMIN"), self.create_staff_data())
+        assert actual == generate_response(400, "SUPERADMIN is not a valid user role")
+
+
+class TestBulkUsers:
+    """
+    Test Functionality for syncing users with a roster
+    Test the following cases:
+        - Partial roster, which only creates and updates users
+        - Full roster, which also deletes the users missing from it
+        - Failure to sync due to no admin remaining
+    """
+    def create_staff_data(self):
+        return user_management_persist.StaffDirectory(
+            {"hanzeh": "ADMIN", "yusen": "REGULAR", "hayder": "REGULAR"})
+
+    def test_bulk_users_partial(self):
+        staff_data = self.create_staff_data()
+        request = BulkStaffsRequest(staff_id="hanzeh", roster={"yusen": "ADMIN", "peter": "REGULAR", "spencer": "X"})
+
+        actual = handle_bulk_users(request, staff_data)
+        assert actual["status_code"] == 200
+        assert actual["detail"]["results"] == {"yusen": {"outcome": "updated"}, "peter": {"outcome": "created"},
+                                               "spencer": {"outcome": "invalid", "detail": "X is not a valid user role"}}
+        assert actual["detail"]["invalid"] == 1
+        assert staff_data == {"hanzeh": "ADMIN", "yusen": "ADMIN", "hayder": "REGULAR", "peter": "REGULAR"}
+
+    def test_bulk_users_full(self):
+        staff_data = self.create_staff_data()
+        request = BulkStaffsRequest(staff_id="hanzeh", roster={"hanzeh": "ADMIN", "peter": "REGULAR"}, full=True)
+
+        actual = handle_bulk_users(request, staff_data)
+        assert actual["detail"]["deleted"] == 2
+        assert staff_data == {"hanzeh": "ADMIN", "peter": "REGULAR"}
+        assert staff_data.staff_with_role("REGULAR") == {"peter"}
+
+    def test_bulk_users_error_no_admin(self):
+        staff_data = self.create_staff_data()
+        request = BulkStaffsRequest(staff_id="hanzeh", roster={"yusen": "REGULAR"}, full=True)
+
+        actual = handle_bulk_users(request, staff_data)
+        assert actual == generate_response(403, "The roster would leave no Admin in the system")
+        assert staff_data == self.create_staff_data()
+
+
+class TestSQLiteUserDataManager:
+    """
+    Test that the SQLite staff store behaves like the JSON staff file, and
+    records every role change in its audit table
+    """
+    def create_database(self, tmp_path):
+        database_file = str(tmp_path / "staff.db")
+        with open(BACKUP_FILE) as bf:
+            user_management_persist.SQLiteUserDataManager(database_file).save(json.load(bf), changed_by="test")
+        return database_file
+
+    def test_requests_and_audit(self, tmp_path):
+        database_file = self.create_database(tmp_path)
+        request = PutStaffsRequest(staff_to_update_id="yusen", staff_id="hanzeh", staff_role="ADMIN")
+        assert handle_user_management_request("PUT", request, database_file)["status_code"] == 200
+        request = DeleteStaffsRequest(staff_to_delete_id="hayder", staff_id="yusen")
+        assert handle_user_management_request("DELETE", request, database_file)["status_code"] == 200
+
+        database = user_management_persist.SQLiteUserDataManager(database_file)
+        assert database.load() == {"hanzeh": "ADMIN", "yusen": "ADMIN"}
+        assert [change[:4] for change in database.audit("yusen")] == [
+            ("yusen", None, "REGULAR", "test"), ("yusen", "REGULAR", "ADMIN", "hanzeh")]
+        assert database.audit("hayder")[-1][:4] == ("hayder", "REGULAR", None, "yusen")
+
+    def test_changes_of_other_connections(self, tmp_path):
+        database_file = self.create_database(tmp_path)
+        request = StaffRequest(staff_id="peter")
+        assert handle_user_management_request("LOGIN", request, database_file)["status_code"] == 404
+
+        user_management_persist.SQLiteUserDataManager(database_file).upsert("peter", "REGULAR", "hr")
+        assert handle_user_management_request("LOGIN", request, database_file)["status_code"] == 200
+        assert staff_role("peter", database_file) == "REGULAR"
+
+    def test_add_and_delete_in_one_transaction(self, tmp_path):
+        database = user_management_persist.SQLiteUserDataManager(self.create_database(tmp_path))
+        database.begin()
+        staff_data = database.load()
+        staff_data["staff1"] = "REGULAR"
+        del staff_data["staff1"]
+        database.close("hanzeh")
+
+        assert "staff1" not in user_management_persist.SQLiteUserDataManager(database.user_file).load()
+        assert [change[1:4] for change in database.audit("staff1")] == [
+            (None, "REGULAR", "hanzeh"), ("REGULAR", None, "hanzeh")]
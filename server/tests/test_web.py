@@ -1,11 +1,26 @@
 from fastapi.testclient import TestClient
 import web
 import datetime
+import json
+import os
+import pytest
+import settings
+import shutil
 from datetime import timedelta
 from datetime import date
 
 client = TestClient(web.app)
 
+STAFF_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "test_web_staff.json")
+
+@pytest.fixture(autouse=True, scope="module")
+def staff_settings():
+    # The reservations are made by the staff of a staff file of their own
+    saved = getattr(web.app.state, "settings", None)
+    web.app.state.settings = settings.Settings(environ={**os.environ, "RESERVE_STAFF_DATA_FILE": STAFF_FILE})
+    yield
+    web.app.state.settings = saved
+
 class TestGetReservationsAll:
     '''
     Test both valid and invalid cases for GET /reservations/
@@ -43,6 +58,31 @@ class TestGetTransactionsAll:
                                     {'transaction_id': 2, 'transaction_type': 'RESERVATION', 'transaction_date': '4-30-2022', 'reservation_id': 2, 'customer_id': 'hayder2', 'resource': 'hvc', 'total_cost': 10000.0, 'transaction_amount': 5000.0}, \
                                         {'transaction_id': 3, 'transaction_type': 'CANCELLATION', 'transaction_date': '4-30-2022', 'reservation_id': 1, 'customer_id': 'hayder', 'resource': 'extruder', 'total_cost': 300.0, 'transaction_amount': '0'}]}}
     
+    def test_get_transactions_pages(self):
+        #Valid GET transactions requests, 2 transactions per page.
+        response = client.get("v2_0/transactions?start_date=4-30-2022&limit=2")
+        assert response.status_code == 200
+        detail = response.json()['detail']
+        assert [t['transaction_id'] for t in detail['transactions']] == [1, 2]
+        response = client.get("v2_0/transactions", params={"start_date": "4-30-2022", "limit": 2, "cursor": detail['next_cursor']})
+        detail = response.json()['detail']
+        assert [t['transaction_id'] for t in detail['transactions']] == [3]
+        assert detail['next_cursor'] is None
+
+    def test_get_transactions_not_modified(self):
+        #Valid GET transactions request with the ETag of the last response.
+        response = client.get("/v2_0/transactions?start_date=4-30-2022")
+        etag = response.headers['etag']
+        response = client.get("/v2_0/transactions?start_date=4-30-2022", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b''
+
+    def test_get_transactions_invalid_cursor(self):
+        #Invalid GET transactions request due to invalid cursor.
+        response = client.get("/v2_0/transactions?start_date=4-30-2022&limit=2&cursor=abc")
+        assert response.status_code == 400
+        assert response.json() == {'detail': 'Get Transactions failed: invalid cursor'}
+
     def test_get_transactions_invalid_start_date(self):
         #Invalid GET transactions request due to invalid start date.
         response = client.get("/v2_0/transactions?start_date=19-19-2022")
@@ -56,6 +96,108 @@ class TestGetTransactionsAll:
         assert response.json() == {'detail': 'Get Transactions failed: date format incorrect'}
 
 
+class TestReportCache:
+    '''
+    Test that the report cache drops the least recently used reports
+    '''
+    def test_lru_cache(self):
+        cache = web.LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        cache.put("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+class TestExportTransactions:
+    '''
+    Test both valid and invalid cases for GET /transactions/export/
+    '''
+    def test_export_transactions_ndjson(self):
+        #Valid GET transactions export request, one JSON object per line.
+        response = client.get("/v2_0/transactions/export?start_date=4-30-2022")
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('application/x-ndjson')
+        lines = response.text.splitlines()
+        assert len(lines) == 3
+        assert lines[0] == '{"transaction_id": 1, "transaction_type": "RESERVATION", "transaction_date": "4-30-2022", "reservation_id": 1, "customer_id": "hayder", "resource": "extruder", "total_cost": 300.0, "transaction_amount": 150.0}'
+
+    def test_export_transactions_csv(self):
+        #Valid GET transactions export request, as CSV.
+        response = client.get("/v2_0/transactions/export?start_date=4-30-2022&format=csv")
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/csv')
+        assert response.text.splitlines() == [
+            'transaction_id,transaction_type,transaction_date,reservation_id,customer_id,resource,total_cost,transaction_amount',
+            '1,RESERVATION,4-30-2022,1,hayder,extruder,300.0,150.0',
+            '2,RESERVATION,4-30-2022,2,hayder2,hvc,10000.0,5000.0',
+            '3,CANCELLATION,4-30-2022,1,hayder,extruder,300.0,0']
+
+    def test_export_transactions_invalid_format(self):
+        #Invalid GET transactions export request due to unknown format.
+        response = client.get("/v2_0/transactions/export?start_date=4-30-2022&format=xml")
+        assert response.status_code == 400
+        assert response.json() == {'detail': 'Export Transactions failed: format must be ndjson or csv'}
+
+
+class TestGetTransactionsSummary:
+    '''
+    Test both valid and invalid cases for GET /transactions/summary/
+    '''
+    def test_get_transactions_summary(self):
+        #Valid GET transactions summary request, grouped by resource.
+        response = client.get("/v2_0/transactions/summary?start_date=4-30-2022&group_by=resource")
+        assert response.status_code == 200
+        assert response.json() == {'status_code': 200, 'detail': {'start_date': '4-30-2022', 'end_date': '05-07-2022', \
+            'total': {'reservations': 2, 'cancellations': 1, 'revenue': 10300.0, 'down_payments': 5150.0, 'refunds': 0.0}, \
+            'group_by': 'resource', 'groups': [ \
+                {'resource': 'extruder', 'reservations': 1, 'cancellations': 1, 'revenue': 300.0, 'down_payments': 150.0, 'refunds': 0.0}, \
+                {'resource': 'hvc', 'reservations': 1, 'cancellations': 0, 'revenue': 10000.0, 'down_payments': 5000.0, 'refunds': 0.0}]}}
+
+    def test_get_transactions_summary_invalid_group_by(self):
+        #Invalid GET transactions summary request due to unknown group_by.
+        response = client.get("/v2_0/transactions/summary?group_by=customer")
+        assert response.status_code == 400
+        assert response.json() == {'detail': 'Get Transactions Summary failed: group_by must be day, resource or staff'}
+
+
+class TestGetAvailability:
+    '''
+    Test both valid and invalid cases for GET /availability/
+    '''
+    def test_get_availability(self):
+        #Valid GET availability request on a saturday, when the workshop opens from 10:00 to 16:00.
+        response = client.get("/v2_0/availability?resource=microvac&start_date=04-30-2022&end_date=04-30-2022")
+        assert response.status_code == 200
+        slots = response.json()['detail']['availability'][0]['slots']
+        assert [slots[t] for t in ['09:30', '10:00', '15:30', '16:00']] == [0, 2, 2, 0]
+        #The hvc reserved from 12:00 to 12:30 needs to cool down for 6 hours.
+        response = client.get("/v2_0/availability?resource=hvc&start_date=04-30-2022&end_date=04-30-2022")
+        assert set(response.json()['detail']['availability'][0]['slots'].values()) == {0}
+
+    def test_get_availability_invalid_resource(self):
+        #Invalid GET availability request due to unknown resource.
+        response = client.get("/v2_0/availability?resource=toaster")
+        assert response.status_code == 400
+        assert response.json() == {'detail': 'Get Availability failed: Unsupported resource: toaster'}
+
+    def test_get_availability_invalid_date_range(self):
+        #Invalid GET availability request due to an end date before the start date, or too far from it.
+        response = client.get("/v2_0/availability?resource=hvc&start_date=05-10-2022&end_date=05-09-2022")
+        assert response.status_code == 400
+        assert response.json() == {'detail': 'Get Availability failed: end_date is before start_date'}
+        response = client.get("/v2_0/availability?resource=hvc&start_date=01-01-2000&end_date=12-31-9999")
+        assert response.status_code == 400
+        assert response.json() == {'detail': 'Get Availability failed: the date range is longer than 30 days'}
+
+    def test_get_availability_invalid_start_date(self):
+        #Invalid GET availability request due to invalid start date.
+        response = client.get("/v2_0/availability?resource=hvc&start_date=19-19-2022")
+        assert response.status_code == 400
+        assert response.json() == {'detail': 'Get Availability failed: date format incorrect'}
+
+
 class TestPostReservationsPasses:
     '''
     Test for passing/valid POST /reservations/ requests
@@ -116,6 +258,19 @@ class TestPostReservationsFails:
         assert response.status_code == 400
         assert response.json() == {'detail': 'Reservation failed: A client can only make reservations for 3 different days in a given week'}
 
+    def test_post_reservations_unknown_staff(self):
+        #Invalid POST reservations request without a session token, by a staff who is not in the system.
+        response = client.post("/v2_0/reservations",json = {"customer_id":"hayder","resource":"workshop","start_date":self.dt_date,"start_time":"11:00","staff_id":"nobody"})
+        assert response.status_code == 403
+        assert response.json() == {'detail': 'Reservation failed: nobody is not in the system'}
+
+    def test_post_reservations_other_staff_of_session(self):
+        #Invalid POST reservations request whose staff is not the staff of its session token.
+        token, _ = web.issue_session_token("superlongggggggggggggggg", web.parse_session_config(web.get_settings()), "REGULAR")
+        response = client.post("/v2_0/reservations",headers = {"Authorization":"Bearer " + token},json = {"customer_id":"hayder","resource":"workshop","start_date":self.dt_date,"start_time":"11:00","staff_id":"nobody"})
+        assert response.status_code == 403
+        assert response.json() == {'detail': 'Reservation failed: nobody is not the staff of the session'}
+
     def test_post_single_reservations_incorrect_resource(self):
         #Invalid POST reservations request due to invalid resource.
         response = client.post("/v2_0/reservations",json = {"customer_id":"hayder","resource":"fakemachine","start_date":self.dt_date,"start_time":"11:00","staff_id":"superlongggggggggggggggg"})
@@ -222,3 +377,24 @@ class TestDeleteReservations:
         assert response.status_code == 400
         assert response.json() == {'detail': 'Cancellation failed: Invalid reservation id: 100'}
 
+
+class TestSettingsReload:
+    '''
+    Test that the reservation data is read from the new data file once the
+    settings have been reloaded
+    '''
+    def test_data_file_is_reopened(self, tmp_path):
+        shutil.copyfile(os.path.join(os.path.dirname(os.path.abspath(__file__)), "testingdata.txt"), tmp_path / "a.txt")
+        (tmp_path / "empty.txt").write_text("#\n")
+        config_file = tmp_path / "config.json"
+        config_file.write_text(json.dumps({"data_file": "a.txt", "staff_data_file": STAFF_FILE}))
+        saved = web.app.state.settings
+        web.app.state.settings = settings.Settings(str(config_file), environ={})
+        try:
+            response = client.get("/v2_0/reservations?start_date=4-25-2022&end_date=5-25-2022")
+            assert len(response.json()['detail']['reservations']) == 1
+            config_file.write_text(json.dumps({"data_file": "empty.txt", "staff_data_file": STAFF_FILE}))
+            response = client.get("/v2_0/reservations?start_date=4-25-2022&end_date=5-25-2022")
+            assert response.json()['detail']['reservations'] == []
+        finally:
+            web.app.state.settings = saved
@@ -4,58 +4,246 @@
 #
 # Date: May 5, 2022
 
-import json, user_management_persist
+from functools import lru_cache
+import base64, hashlib, hmac, json, os, secrets, settings, time, user_management_persist
 from user_management_models import *
 
+# The request types that may modify the staff data
+MODIFYING_REQUESTS = ("POST", "PUT", "DELETE", "BULK")
+
 ## --------------------- CONFIG FUNCTIONS --------------------- ##
 
-def parse_data_file():
+def parse_data_file(config=None):
     """
     Returns the data file path for staffs based on the config.json file
 
+    Args:
+        config (Settings): OPTIONAL, the settings to use, the process-wide
+            settings by default
+
     Returns:
         File path for the json file containing staff data
     """
-    config_file = "config.json"
-    with open(config_file, "r") as cf:
-        config = json.load(cf)
-        return config["staff_data_file"]
+    return (config or settings.get_settings())["staff_data_file"]
+
+def parse_session_config(config=None):
+    """
+    Returns the session settings based on the "session" entry of the
+    config.json file
+
+    Args:
+        config (Settings): OPTIONAL, the settings to use, the process-wide
+            settings by default
+
+    Returns:
+        A dict with secret_file (path of the secret signing the session
+        tokens), lifetime (seconds a token is valid) and required (True if
+        requests without a session token are rejected)
+    """
+    config = config or settings.get_settings()
+    session = {"secret_file": os.path.join(os.path.dirname(config.config_file), "data", "session_secret"),
+               "lifetime": 8 * 3600, "required": False}
+    session.update(config.get("session", {}))
+    return session
+
+## --------------------- SESSION FUNCTIONS --------------------- ##
+
+# The minimum length of the secret signing the session tokens, in bytes
+SESSION_SECRET_BYTES = 32
+
+@lru_cache(maxsize=None)
+def load_session_secret(secret_file):
+    """
+    Returns the secret signing the session tokens, creating the secret file
+    with a new random secret if it does not exist yet
+
+    The new secret is written and synced to a temporary file which is then
+    linked to secret_file, so other workers never see a partially written
+    secret file. A secret file that is too short is rejected, and never cached
+
+    Args:
+        secret_file (str): path of the secret file
+
+    Returns:
+        The secret (bytes)
+
+    Raises:
+        ValueError: if the secret file holds less than SESSION_SECRET_BYTES bytes
+    """
+    if not os.path.exists(secret_file):
+        secret = secrets.token_bytes(SESSION_SECRET_BYTES)
+        temp_file = f"{secret_file}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+        fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            with os.fdopen(fd, "w") as sf:
+                sf.write(secret.hex())
+                sf.flush()
+                os.fsync(sf.fileno())
+            try:
+                os.link(temp_file, secret_file)
+            except FileExistsError:
+                pass
+        finally:
+            os.remove(temp_file)
+    with open(secret_file, "r") as sf:
+        try:
+            secret = bytes.fromhex(sf.read().strip())
+        except ValueError:
+            secret = b""
+    if len(secret) < SESSION_SECRET_BYTES:
+        raise ValueError(f"The session secret in {secret_file} is shorter than {SESSION_SECRET_BYTES} bytes")
+    return secret
+
+
+def sign_session(payload, secret):
+    """
+    Returns the HMAC-SHA256 signature of a session token payload
+
+    Args:
+        payload (str): the encoded payload of the token
+        secret (bytes): the secret signing the session tokens
+
+    Returns:
+        The signature, encoded as url-safe base64 (str)
+    """
+    digest = hmac.new(secret, payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode()
+
+
+def issue_session_token(staff_id, session=None, role=None):
+    """
+    Construct a signed session token for a staff, valid for the lifetime given
+    in the session settings. The token holds the role the staff had when
+    logging in for information only: requests are authorized by the current
+    role of the staff, see check_session_staff in web.py
+
+    Args:
+        staff_id (str): the id of the staff who logged in
+        session (dict): OPTIONAL, the session settings, see parse_session_config
+        role (str): OPTIONAL, the role of the staff when logging in
+
+    Returns:
+        (token, expiry time in seconds since the epoch)
+    """
+    session = session or parse_session_config()
+    expires_at = int(time.time()) + session["lifetime"]
+    payload = json.dumps({"staff_id": staff_id, "role": role, "expires_at": expires_at})
+    payload = base64.urlsafe_b64encode(payload.encode()).decode()
+    return f"{payload}.{sign_session(payload, load_session_secret(session['secret_file']))}", expires_at
+
+
+def read_session_token(token, session=None):
+    """
+    Check the signature and expiry time of a session token, and return what
+    it holds
+
+    Args:
+        token (str): a token of issue_session_token
+        session (dict): OPTIONAL, the session settings, see parse_session_config
+
+    Returns:
+        A dict with the staff_id, role and expires_at of the token, or None if
+        the token is not valid
+    """
+    session = session or parse_session_config()
+    payload, _, signature = token.partition(".")
+    expected = sign_session(payload, load_session_secret(session["secret_file"]))
+    if not hmac.compare_digest(signature.encode(), expected.encode()):
+        return None
+    claims = json.loads(base64.urlsafe_b64decode(payload.encode()))
+    if claims["expires_at"] <= time.time():
+        return None
+    return claims
+
+
+def verify_session_token(token, session=None):
+    """
+    Check the signature and expiry time of a session token
+
+    Args:
+        token (str): a token of issue_session_token
+        session (dict): OPTIONAL, the session settings, see parse_session_config
+
+    Returns:
+        The id of the staff of the token, or None if the token is not valid
+    """
+    claims = read_session_token(token, session)
+    return claims and claims["staff_id"]
+
+
+def staff_role(staff_id, datafile=None, config=None):
+    """
+    Returns the role of a staff from the in-memory staff data, which is only
+    read again from the staff file when it changes, or from its row of a
+    SQLite staff store
+
+    Args:
+        staff_id (str): the id of the staff
+        datafile (str): OPTIONAL, the staff file, the one of the settings by default
+        config (Settings): OPTIONAL, the settings to use, the process-wide
+            settings by default
+
+    Returns:
+        "ADMIN" or "REGULAR", or None if the staff is not in the system
+    """
+    if not datafile:
+        datafile = parse_data_file(config)
+
+    return user_management_persist.open_user_data_manager(datafile).get_role(staff_id)
 
 ## --------------------- HANDLER FUNCTIONS --------------------- ##
 
-def handle_user_management_request(request_type, request_model: StaffRequest, datafile=None):
+def handle_user_management_request(request_type, request_model: StaffRequest, datafile=None, config=None,
+                                   session_role=None):
     """
     Main handler function for the user management requests, refer to
     user_management_models.py for details.
-    Loads data from a given datafile and then save it after changes are made
+    Reads the staff data from a process-resident cache of the given datafile,
+    and only saves it if the request changed it. With a SQLite staff store the
+    handlers read and write single rows instead, see SQLiteStaffDirectory
 
     Args:
-        request_type (str): The request method (POST, PUT, DELETE)
+        request_type (str): The request method (LOGIN, GET, POST, PUT, DELETE, BULK)
         request_model (BaseModel): The parsed model of input data
+        datafile (str): OPTIONAL, the staff file, the one of the settings by default
+        config (Settings): OPTIONAL, the settings to use, the process-wide
+            settings by default
+        session_role (str): OPTIONAL, the current role of the requesting staff
+            of a verified session token, which is then used to check the
+            request is authorized without looking up the staff again
 
     Returns:
         response (dict): A JSON formatted dictionary API response
     """
     if not datafile:
-        datafile = parse_data_file()
+        datafile = parse_data_file(config)
 
-    user_data_manager = user_management_persist.UserDataManager(datafile)
-    staff_data = user_data_manager.load()
-    
-    if request_type != "LOGIN" and not check_request_auth(request_model.staff_id, staff_data):
-        return generate_response(403, f"{request_model.staff_id} does not have permission to manage staffs")
+    user_data_manager = user_management_persist.open_user_data_manager(datafile)
+    with user_data_manager.lock:
+        if request_type in MODIFYING_REQUESTS:
+            user_data_manager.begin()
+        staff_data = user_data_manager.load()
     
-    if request_type == "LOGIN":
-        response = handle_login_user(request_model, staff_data)
-    elif request_type == "POST":
-        response = handle_post_user(request_model, staff_data)
-    elif request_type == "PUT":
-        response = handle_put_user(request_model, staff_data)
-    elif request_type == "DELETE":
-        response = handle_delete_user(request_model, staff_data)
-    else:
-        response = generate_response(400, f"{request_type} is not a valid request type")
-    user_data_manager.save(staff_data)
+        if request_type == "LOGIN":
+            response = handle_login_user(request_model, staff_data)
+        elif not (session_role == "ADMIN" if session_role is not None
+                  else check_request_auth(request_model.staff_id, staff_data)):
+            response = generate_response(403, f"{request_model.staff_id} does not have permission to manage staffs")
+        elif request_type == "POST":
+            response = handle_post_user(request_model, staff_data)
+        elif request_type == "PUT":
+            response = handle_put_user(request_model, staff_data)
+        elif request_type == "DELETE":
+            response = handle_delete_user(request_model, staff_data)
+        elif request_type == "GET":
+            response = handle_get_users(request_model, staff_data)
+        elif request_type == "BULK":
+            response = handle_bulk_users(request_model, staff_data)
+        else:
+            response = generate_response(400, f"{request_type} is not a valid request type")
+
+        # Only the staff changed by the request are saved, if any
+        user_data_manager.close(request_model.staff_id)
     return response
 
 
@@ -129,6 +317,84 @@ def handle_put_user(request: PutStaffsRequest, staff_data):
 
     return generate_response(200, f"{update_staff}'s role has been updated to {new_role}")
 
+def handle_get_users(request: GetStaffsRequest, staff_data):
+    """
+    Handler function for get requests, responsible for listing users, served
+    from the role index of the staff data
+
+    Args:
+        request (GetStaffsRequest): The model that contains all data for 
+            a get request
+        staff_data (StaffDirectory): The staff_data preloaded from staff.json
+
+    Returns:
+        response (dict): A JSON formatted dictionary API response
+    """
+    role = request.staff_role
+
+    if role is None:
+        staffs = sorted(staff_data.items())
+    elif role not in ["ADMIN", "REGULAR"]:
+        return generate_response(400, f"{role} is not a valid user role")
+    else:
+        staffs = [(staff_id, role) for staff_id in sorted(staff_data.staff_with_role(role))]
+
+    staffs = [{"staff_id": staff_id, "staff_role": staff_role} for staff_id, staff_role in staffs]
+    return generate_response(200, {"staffs": staffs})
+
+def handle_bulk_users(request: BulkStaffsRequest, staff_data):
+    """
+    Handler function for bulk put requests, responsible for syncing users with
+    a roster. The changes are computed in one pass over the roster, and are
+    only made if at least one admin remains afterwards
+
+    Args:
+        request (BulkStaffsRequest): The model that contains all data for 
+            a bulk put request
+        staff_data (StaffDirectory): The staff_data preloaded from staff.json
+
+    Returns:
+        response (dict): A JSON formatted dictionary API response
+    """
+    results = {}
+    changes = {}
+    # The roles of all staff are read at once, rather than one row at a time
+    current_roles = dict(staff_data.items())
+    admins = len(staff_data.staff_with_role("ADMIN"))
+
+    for staff_id, role in request.roster.items():
+        if role not in ["ADMIN", "REGULAR"]:
+            results[staff_id] = {"outcome": "invalid", "detail": f"{role} is not a valid user role"}
+            continue
+        current_role = current_roles.get(staff_id)
+        if current_role == role:
+            results[staff_id] = {"outcome": "unchanged"}
+            continue
+        results[staff_id] = {"outcome": "created" if current_role is None else "updated"}
+        changes[staff_id] = role
+        admins += (role == "ADMIN") - (current_role == "ADMIN")
+
+    if request.full:
+        for staff_id, role in current_roles.items():
+            if staff_id not in request.roster:
+                results[staff_id] = {"outcome": "deleted"}
+                changes[staff_id] = None
+                admins -= role == "ADMIN"
+
+    if admins == 0:
+        return generate_response(403, "The roster would leave no Admin in the system")
+
+    for staff_id, role in changes.items():
+        if role is None:
+            del staff_data[staff_id]
+        else:
+            staff_data[staff_id] = role
+
+    counts = {outcome: 0 for outcome in ["created", "updated", "deleted", "unchanged", "invalid"]}
+    for result in results.values():
+        counts[result["outcome"]] += 1
+    return generate_response(200, {**counts, "results": results})
+
 def handle_delete_user(request: DeleteStaffsRequest, staff_data):
     """
     Handler function for post requests, responsible for deleting users
@@ -191,7 +457,8 @@ def check_request_auth(requesting_staff: str, staff_data):
 
 def only_one_admin(staff_data):
     """
-    Checks if there is only one admin remaining on the system
+    Checks if there is only one admin remaining on the system, using the role
+    index of a StaffDirectory instead of counting the admins
 
     Args:
         staff_data (dict): the dict object containing all staff data
@@ -199,13 +466,9 @@ def only_one_admin(staff_data):
     Returns:
         (bool): True if there is only one admin on the system, False o/w
     """
-    total = 0
-    for i in staff_data.values():
-        if i == "ADMIN":
-            total += 1
-    if total == 1:
-        return True
-    return False
+    if isinstance(staff_data, user_management_persist.StaffDirectory):
+        return len(staff_data.staff_with_role("ADMIN")) == 1
+    return list(staff_data.values()).count("ADMIN") == 1
 
 def success_response(status_code, detail):
     """
@@ -3,7 +3,7 @@
 #
 # Date: May 5, 2022
 
-from typing import Optional
+from typing import Dict, Optional
 from pydantic import BaseModel
 
 class StaffRequest(BaseModel):
@@ -49,4 +49,27 @@ class DeleteStaffsRequest(StaffRequest):
         staff_id (str)(Inherited): The ID of the staff making the request
     """
     staff_to_delete_id: str
-    staff_id: str
\ No newline at end of file
+    staff_id: str
+
+class GetStaffsRequest(StaffRequest):
+    """
+    A class GET request to the Staffs API endpoint
+
+    Attributes:
+        staff_role (str): OPTIONAL, only list the staff having this role
+        staff_id (str)(Inherited): The ID of the staff making the request
+    """
+    staff_role: Optional[str] = None
+
+class BulkStaffsRequest(StaffRequest):
+    """
+    A class PUT request to the Staffs Bulk API endpoint
+
+    Attributes:
+        roster (Dict[str, str]): The role of each staff to create or update
+        full (bool): OPTIONAL, True if the roster lists all staff, the staff
+            missing from it are then deleted, False by default
+        staff_id (str)(Inherited): The ID of the staff making the request
+    """
+    roster: Dict[str, str]
+    full: Optional[bool] = False
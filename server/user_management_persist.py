@@ -1,14 +1,524 @@
-import json
+# File Name: user_management_persist.py
+# File Description: persist layer of the staff data of the reserve system
+#
+# Date: May 5, 2022
+
+from collections.abc import MutableMapping
+import json, os, sqlite3, tempfile, threading, time
+
+class StaffDirectory(MutableMapping):
+    """
+    A mapping of staff ids to their role, which also indexes the staff of
+    each role as they are added, updated and deleted
+
+    The staff are held in a dict of their own, so every change, including
+    update, pop, setdefault, popitem and clear, goes through __setitem__ or
+    __delitem__, which keep the index and the pending changes up to date
+
+    Attributes:
+        staff (dict): A dict mapping staff ids to their role
+        roles (dict): A dict mapping each role to the set of its staff ids
+        pending (list): the changes not saved yet, as (staff_id, old role,
+            new role), the old role being None for a new staff and the new
+            role None for a deleted staff
+    """
+    def __init__(self, staff_data=()):
+        self.staff = dict(staff_data)
+        self.roles = {}
+        self.pending = []
+        for staff_id, role in self.staff.items():
+            self.roles.setdefault(role, set()).add(staff_id)
+
+    def __getitem__(self, staff_id):
+        return self.staff[staff_id]
+
+    def __setitem__(self, staff_id, role):
+        old_role = self.staff.get(staff_id)
+        if old_role == role:
+            return
+        if old_role is not None:
+            self.roles[old_role].discard(staff_id)
+        self.staff[staff_id] = role
+        self.roles.setdefault(role, set()).add(staff_id)
+        self.pending.append((staff_id, old_role, role))
+
+    def __delitem__(self, staff_id):
+        old_role = self.staff.pop(staff_id)
+        self.roles[old_role].discard(staff_id)
+        self.pending.append((staff_id, old_role, None))
+
+    def __iter__(self):
+        return iter(self.staff)
+
+    def __len__(self):
+        return len(self.staff)
+
+    def __contains__(self, staff_id):
+        return staff_id in self.staff
+
+    def __repr__(self):
+        return f"StaffDirectory({self.staff!r})"
+
+    def staff_with_role(self, role):
+        """
+        Return the ids of the staff having a role
+
+        Args:
+            role (str): "ADMIN" or "REGULAR"
+
+        Returns:
+            A set of staff ids, not to be modified
+        """
+        return self.roles.get(role, set())
+
 
 class UserDataManager:
+    """
+    A process-resident store of the staff data
+
+    The staff file is parsed once and kept in memory. Changes made to the
+    staff file by someone else are detected through its mtime and size, and
+    the file is only rewritten when the staff data has been modified. The file
+    is replaced at once, so readers never see a partly written file
+
+    Attributes:
+        user_file (str): path of the staff file
+        lock (Lock): lock to be held while reading or modifying the staff data
+        staff_data (StaffDirectory): A dict mapping staff ids to their role
+        dirty (bool): True if in-memory staff data has not been saved yet
+        file_stat (tuple): (mtime, size) of the staff file when last loaded/saved
+    """
     def __init__(self, user_file):
         self.user_file = user_file
+        self.lock = threading.RLock()
+        self.staff_data = None
+        self.dirty = False
+        self.file_stat = None
+
+    def current_file_stat(self):
+        """
+        Return the modification time and size of the staff file
+
+        Returns:
+            (mtime in ns, size in bytes), or None if the file does not exist
+        """
+        try:
+            stat = os.stat(self.user_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def begin(self):
+        """
+        Prepare the UserDataManager for a request that may modify staff data
+        """
+        self.load()
 
     def load(self):
-        with open(self.user_file) as uf:
-            staff_data = json.load(uf)
-        return staff_data
+        """
+        Return the staff data, reading the staff file only if it has been
+        changed since it was last loaded or saved by this UserDataManager
+
+        Returns:
+            A StaffDirectory object
+        """
+        file_stat = self.current_file_stat()
+        if self.staff_data is None or file_stat != self.file_stat:
+            with open(self.user_file) as uf:
+                self.staff_data = StaffDirectory(json.load(uf))
+            self.dirty = False
+            self.file_stat = file_stat
+        return self.staff_data
+
+    def save(self, staff_data=None):
+        """
+        Write the staff data to a temporary file next to the staff file, flush
+        it to disk, then replace the staff file with it
+
+        Args:
+            staff_data (dict): OPTIONAL, the staff data to save instead of the
+                loaded one
+        """
+        if staff_data is not None:
+            self.staff_data = StaffDirectory(staff_data)
+        fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.user_file)))
+        try:
+            with os.fdopen(fd, "w") as uf:
+                json.dump(self.staff_data.staff, uf)
+                uf.flush()
+                os.fsync(uf.fileno())
+            os.replace(temp_file, self.user_file)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+        self.staff_data.pending = []
+        self.dirty = False
+        self.file_stat = self.current_file_stat()
+
+    def close(self, changed_by=None):
+        """
+        Save the staff data to the staff file if it has been modified
+
+        Args:
+            changed_by (str): OPTIONAL, the staff who made the changes
+        """
+        if self.dirty or (self.staff_data is not None and self.staff_data.pending):
+            self.save()
+
+    def get_role(self, staff_id):
+        """
+        Return the role of a staff
+
+        Args:
+            staff_id (str): the id of the staff
+
+        Returns:
+            "ADMIN" or "REGULAR", or None if the staff is not in the system
+        """
+        return self.load().get(staff_id)
+
+    def upsert(self, staff_id, role, changed_by=None):
+        """
+        Create a staff, or update the role of an existing staff, and save it
+
+        Args:
+            staff_id (str): the id of the staff
+            role (str): "ADMIN" or "REGULAR"
+            changed_by (str): OPTIONAL, the staff who made the change
+
+        Returns:
+            The role of the staff before the change, None if it did not exist
+        """
+        with self.lock:
+            self.begin()
+            staff_data = self.load()
+            old_role = staff_data.get(staff_id)
+            staff_data[staff_id] = role
+            self.close(changed_by)
+        return old_role
+
+    def delete(self, staff_id, changed_by=None):
+        """
+        Delete a staff, if it exists, and save it
+
+        Args:
+            staff_id (str): the id of the staff
+            changed_by (str): OPTIONAL, the staff who made the change
+
+        Returns:
+            The role of the deleted staff, None if it did not exist
+        """
+        with self.lock:
+            self.begin()
+            staff_data = self.load()
+            old_role = staff_data.get(staff_id)
+            if old_role is not None:
+                del staff_data[staff_id]
+            self.close(changed_by)
+        return old_role
+
+
+class SQLiteStaffDirectory(StaffDirectory):
+    """
+    A StaffDirectory reading and writing the rows of a SQLite staff store,
+    instead of a copy of all staff kept in memory
+
+    Looking up a staff reads its row, and adding, updating or deleting a staff
+    writes its row through SQLiteUserDataManager.upsert and delete, so the
+    handlers of user_management.py change the staff one row at a time
+
+    Attributes:
+        manager (SQLiteUserDataManager): the staff store
+    """
+    def __init__(self, manager):
+        self.manager = manager
+
+    def __getitem__(self, staff_id):
+        role = self.manager.get_role(staff_id)
+        if role is None:
+            raise KeyError(staff_id)
+        return role
+
+    def __setitem__(self, staff_id, role):
+        self.manager.upsert(staff_id, role)
+
+    def __delitem__(self, staff_id):
+        if self.manager.delete(staff_id) is None:
+            raise KeyError(staff_id)
+
+    def __iter__(self):
+        return iter(self.manager.query('SELECT staff_id FROM staff ORDER BY staff_id'))
+
+    def __len__(self):
+        return self.manager.query('SELECT COUNT(*) FROM staff')[0]
+
+    def __contains__(self, staff_id):
+        return self.manager.get_role(staff_id) is not None
+
+    def __repr__(self):
+        return f"SQLiteStaffDirectory({self.manager.user_file!r})"
+
+    def items(self):
+        """
+        Return the staff ids and roles of all staff, read at once
+
+        Returns:
+            A view of (staff_id, role) pairs
+        """
+        with self.manager.lock:
+            return dict(self.manager.connection.execute('SELECT staff_id, staff_role FROM staff')).items()
+
+    def staff_with_role(self, role):
+        """
+        Return the ids of the staff having a role
+
+        Args:
+            role (str): "ADMIN" or "REGULAR"
+
+        Returns:
+            A set of staff ids
+        """
+        return set(self.manager.query('SELECT staff_id FROM staff WHERE staff_role = ?', (role,)))
+
+
+class SQLiteUserDataManager(UserDataManager):
+    """
+    A UserDataManager that stores the staff in a SQLite database instead of
+    a JSON file
+
+    The staff are not kept in memory: load returns a SQLiteStaffDirectory,
+    whose lookups read single rows and whose changes are written as single
+    rows by upsert and delete, each recorded in the append-only staff_audit
+    table with who changed the role of which staff and when.
+    The database runs in WAL mode so that several server processes can share
+    it: a request that may modify staff data holds a write transaction for its
+    whole duration, and always reads the rows committed by other processes
+
+    Attributes:
+        connection (Connection): the connection to the database
+        pending (list): the changes of the current write transaction, as
+            (staff_id, old role, new role), recorded in staff_audit on close
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS staff (
+            staff_id TEXT PRIMARY KEY,
+            staff_role TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS staff_by_role ON staff (staff_role, staff_id);
+        CREATE TABLE IF NOT EXISTS staff_audit (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            staff_id TEXT NOT NULL,
+            old_role TEXT,
+            new_role TEXT,
+            changed_by TEXT,
+            timestamp INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS staff_audit_staff ON staff_audit (staff_id, seq);
+        CREATE TRIGGER IF NOT EXISTS staff_audit_no_update BEFORE UPDATE ON staff_audit
+        BEGIN SELECT RAISE(ABORT, 'staff_audit is append-only'); END;
+        CREATE TRIGGER IF NOT EXISTS staff_audit_no_delete BEFORE DELETE ON staff_audit
+        BEGIN SELECT RAISE(ABORT, 'staff_audit is append-only'); END;
+    """
+
+    def __init__(self, user_file):
+        super().__init__(user_file)
+        self.connection = sqlite3.connect(user_file, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(self.SCHEMA)
+        self.staff_data = SQLiteStaffDirectory(self)
+        self.pending = []
+
+    def query(self, sql, parameters=()):
+        """
+        Return the first column of the rows of a query
+
+        Args:
+            sql (str): the query
+            parameters (tuple): OPTIONAL, the parameters of the query
+
+        Returns:
+            A list of values
+        """
+        with self.lock:
+            return [row[0] for row in self.connection.execute(sql, parameters)]
+
+    def begin(self):
+        """
+        Start a write transaction
+        """
+        with self.lock:
+            if self.connection.in_transaction:
+                # A previous request failed before it could commit
+                self.connection.execute('ROLLBACK')
+            self.pending = []
+            self.connection.execute('BEGIN IMMEDIATE')
+
+    def load(self):
+        """
+        Return the staff data, whose rows are read when they are used
+
+        Returns:
+            A SQLiteStaffDirectory object
+        """
+        return self.staff_data
+
+    def save(self, staff_data=None, changed_by=None):
+        """
+        Replace all staff with the given staff data, then commit the changes
+
+        Args:
+            staff_data (dict): OPTIONAL, the staff data to save, the staff
+                missing from it are deleted
+            changed_by (str): OPTIONAL, the staff who made the changes
+        """
+        with self.lock:
+            if not self.connection.in_transaction:
+                self.begin()
+            if staff_data is not None:
+                current = dict(self.staff_data.items())
+                for staff_id in current:
+                    if staff_id not in staff_data:
+                        self.change(staff_id, None)
+                for staff_id, role in staff_data.items():
+                    if current.get(staff_id) != role:
+                        self.change(staff_id, role)
+            self.close(changed_by)
+
+    def close(self, changed_by=None):
+        """
+        Record the changes of the write transaction in staff_audit, then
+        commit them
+
+        Args:
+            changed_by (str): OPTIONAL, the staff who made the changes
+        """
+        with self.lock:
+            timestamp = int(time.time())
+            self.connection.executemany(
+                'INSERT INTO staff_audit (staff_id, old_role, new_role, changed_by, timestamp) VALUES (?, ?, ?, ?, ?)',
+                [(staff_id, old_role, new_role, changed_by, timestamp) for staff_id, old_role, new_role in self.pending])
+            if self.connection.in_transaction:
+                self.connection.execute('COMMIT')
+            self.pending = []
+
+    def change(self, staff_id, role, changed_by=None):
+        """
+        Write the row of a staff, in the current write transaction if there is
+        one, or in a transaction of its own committed at once
+
+        Args:
+            staff_id (str): the id of the staff
+            role (str): "ADMIN" or "REGULAR", or None to delete the staff
+            changed_by (str): OPTIONAL, the staff who made the change, only
+                used if the change is committed at once
+
+        Returns:
+            The role of the staff before the change, None if it did not exist
+        """
+        with self.lock:
+            in_transaction = self.connection.in_transaction
+            if not in_transaction:
+                self.begin()
+            old_role = self.get_role(staff_id)
+            if old_role != role:
+                if role is None:
+                    self.connection.execute('DELETE FROM staff WHERE staff_id = ?', (staff_id,))
+                else:
+                    self.connection.execute(
+                        'INSERT INTO staff (staff_id, staff_role) VALUES (?, ?) '
+                        'ON CONFLICT (staff_id) DO UPDATE SET staff_role = excluded.staff_role',
+                        (staff_id, role))
+                self.pending.append((staff_id, old_role, role))
+            if not in_transaction:
+                self.close(changed_by)
+        return old_role
+
+    def get_role(self, staff_id):
+        """
+        Return the role of a staff, read from its row
+
+        Args:
+            staff_id (str): the id of the staff
+
+        Returns:
+            "ADMIN" or "REGULAR", or None if the staff is not in the system
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT staff_role FROM staff WHERE staff_id = ?', (staff_id,)).fetchone()
+        return row and row[0]
+
+    def upsert(self, staff_id, role, changed_by=None):
+        """
+        Create a staff, or update the role of an existing staff
+
+        Args:
+            staff_id (str): the id of the staff
+            role (str): "ADMIN" or "REGULAR"
+            changed_by (str): OPTIONAL, the staff who made the change, see change
+
+        Returns:
+            The role of the staff before the change, None if it did not exist
+        """
+        return self.change(staff_id, role, changed_by)
+
+    def delete(self, staff_id, changed_by=None):
+        """
+        Delete a staff, if it exists
+
+        Args:
+            staff_id (str): the id of the staff
+            changed_by (str): OPTIONAL, the staff who made the change, see change
+
+        Returns:
+            The role of the deleted staff, None if it did not exist
+        """
+        return self.change(staff_id, None, changed_by)
+
+    def audit(self, staff_id=None):
+        """
+        Return the recorded role changes, oldest first
+
+        Args:
+            staff_id (str): OPTIONAL, only return the changes of this staff
+
+        Returns:
+            A list of (staff_id, old role, new role, changed_by, timestamp),
+            the old role being None for a new staff and the new role None for
+            a deleted staff
+        """
+        query = 'SELECT staff_id, old_role, new_role, changed_by, timestamp FROM staff_audit'
+        parameters = []
+        if staff_id is not None:
+            query += ' WHERE staff_id = ?'
+            parameters.append(staff_id)
+        with self.lock:
+            return self.connection.execute(query + ' ORDER BY seq', parameters).fetchall()
+
+
+# The process-resident UserDataManager of each staff file
+USER_DATA_MANAGERS = {}
+USER_DATA_MANAGERS_LOCK = threading.Lock()
+
+# The extensions of the staff files stored in a SQLite database
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+def open_user_data_manager(user_file):
+    """
+    Return the process-resident UserDataManager of a staff file, creating it
+    the first time the file is used: a SQLiteUserDataManager if the file has
+    one of the SQLITE_EXTENSIONS, a UserDataManager of a JSON file otherwise
+
+    Args:
+        user_file (str): path of the staff file
 
-    def save(self, staff_data):
-        with open(self.user_file, "w") as uf:
-            json.dump(staff_data, uf)
\ No newline at end of file
+    Returns:
+        A UserDataManager object
+    """
+    key = os.path.abspath(user_file)
+    with USER_DATA_MANAGERS_LOCK:
+        if key not in USER_DATA_MANAGERS:
+            if os.path.splitext(user_file)[1].lower() in SQLITE_EXTENSIONS:
+                USER_DATA_MANAGERS[key] = SQLiteUserDataManager(user_file)
+            else:
+                USER_DATA_MANAGERS[key] = UserDataManager(user_file)
+        return USER_DATA_MANAGERS[key]
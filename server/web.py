@@ -2,12 +2,15 @@
 #
 # Date: May 7, 2022
 
-from typing import Optional
-from fastapi import Depends, FastAPI, HTTPException
+from typing import List, Optional
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from fastapi_versioning import VersionedFastAPI, version
 from pydantic import BaseModel
 from datetime import datetime, timedelta
-import reserve
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import hashlib, json, reserve, settings, threading
 from user_management import *
 
 #-------------------- Input Structures -------------------#
@@ -33,6 +36,16 @@ class ReservationRequest(BaseModel):
     staff_id: str
 
 
+class BatchReservationRequest(BaseModel):
+    """
+    A class used to parse submitted data for the "create reservations in batch" API
+
+    Attributes:
+        reservations (List[ReservationRequest]): The reservations to create, in order
+    """
+    reservations: List[ReservationRequest]
+
+
 class CancellationRequest(BaseModel):
     """
     A class used to parse submitted data for the "cancel reservation" API
@@ -53,9 +66,74 @@ class GetTransactionRequest(BaseModel):
     Attributes:
         start_date (str): The starting date of the reservation 
         end_date (str): The ending date of the reservation
+        limit (int): The maximum number of transactions in a page
+        cursor (str): The next_cursor of the previous page
+    """
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+
+
+class ExportTransactionsRequest(BaseModel):
+    """
+    A class GET request to the Transactions Export API endpoint
+
+    All Attributes are Optional, all dates are in mm-dd-yyyy format
+    Attributes:
+        start_date (str): The starting date of the export
+        end_date (str): The ending date of the export
+        format (str): ndjson or csv
+    """
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    format: Optional[str] = None
+
+
+class GetTransactionsSummaryRequest(BaseModel):
+    """
+    A class GET request to the Transactions Summary API endpoint
+
+    All Attributes are Optional, all dates are in mm-dd-yyyy format
+    Attributes:
+        start_date (str): The starting date of the summary
+        end_date (str): The ending date of the summary
+        group_by (str): One of day, resource or staff, to sum up each of them
     """
     start_date: Optional[str] = None
     end_date: Optional[str] = None
+    group_by: Optional[str] = None
+
+
+class GetAvailabilityRequest(BaseModel):
+    """
+    A class GET request to the Availability API endpoint
+
+    All dates are in mm-dd-yyyy format
+    Attributes:
+        resource (str): The resource to check the availability of
+        start_date (str): Optional, the first day to check
+        end_date (str): Optional, the last day to check
+    """
+    resource: str
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+
+
+class SuggestReservationsRequest(BaseModel):
+    """
+    A class GET request to the Suggest Reservations API endpoint
+
+    Attributes:
+        customer_id (str): Id of the customer who wants to make a reservation
+        resource (str): Resource the customer wants to reserve
+        duration (int): Optional, the duration of the reservation in minutes
+        count (int): Optional, the maximum number of start times to suggest
+    """
+    customer_id: str
+    resource: str
+    duration: int = 30
+    count: int = 5
 
 
 class GetReservationsRequest(BaseModel):
@@ -67,10 +145,122 @@ class GetReservationsRequest(BaseModel):
         start_date (str): The starting date of the report 
         end_date (str): The ending date of the report
         customer_id (str): A unique string representing the customer
+        limit (int): The maximum number of reservations in a page
+        cursor (str): The next_cursor of the previous page
     """
     start_date: Optional[str] = None
     end_date: Optional[str] = None
     customer_id: Optional[str] = None
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+
+
+#-------------------- Dependencies -------------------#
+
+def session_staff(authorization: Optional[str] = Header(None)):
+    """
+    Check the session token sent in the Authorization header as
+    "Bearer <token>", see GET /login. Only its signature and expiry time are
+    checked, the staff data is not read
+
+    Args:
+        authorization (str): the Authorization header of the request
+
+    Raises:
+        HTTPException Error: if the token is not valid or has expired
+        HTTPException Error: if no token is sent but sessions are required
+
+    Returns:
+        A dict with the staff_id and role of the session, or None if no token
+        is sent
+    """
+    session = parse_session_config(get_settings())
+    if authorization is None:
+        if session["required"]:
+            handle_error(401, "Session", "a session token is required")
+        return None
+    scheme, _, token = authorization.partition(" ")
+    claims = read_session_token(token, session) if scheme == "Bearer" else None
+    if claims is None:
+        handle_error(401, "Session", "invalid or expired session token")
+    return claims
+
+
+def check_session_staff(session, staff_id, operation):
+    """
+    Check that the staff_id of a request is the staff of its session token,
+    and, whether a token is sent or not, that it is still a staff of the system.
+    The role is read from the cached staff data on every request, so that a
+    change of role takes effect while a token is still valid
+
+    Args:
+        session (dict): the session of session_staff, or None if no token is sent
+        staff_id (str): the staff_id of the request
+        operation (str): the name of the operation, used in output
+
+    Raises:
+        HTTPException Error: if the staff_id is not the staff of the session
+        HTTPException Error: if the staff_id is not in the system
+
+    Returns:
+        The current role of the staff if a token is sent, or None otherwise
+    """
+    if session is not None and staff_id != session["staff_id"]:
+        handle_error(403, operation, f"{staff_id} is not the staff of the session")
+    role = staff_role(staff_id, config=get_settings())
+    if role is None:
+        handle_error(403, operation, f"{staff_id} is not in the system")
+    return role if session is not None else None
+
+
+#-------------------- Report Cache -------------------#
+
+class LRUCache:
+    """
+    A class holding a bounded number of values, dropping the least recently
+    used one when it is full
+
+    Attributes:
+        size (int): the maximum number of values
+        values (OrderedDict): A dict mapping keys to their value, from the
+            least to the most recently used
+        guard (Lock): lock to be held while using values
+    """
+    def __init__(self, size):
+        self.size = size
+        self.values = OrderedDict()
+        self.guard = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the value of a key, and mark it as the most recently used
+
+        Args:
+            key (tuple): the key of the value
+
+        Returns:
+            The value, or None if the key is not in the cache
+        """
+        with self.guard:
+            value = self.values.get(key)
+            if value is not None:
+                self.values.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """
+        Add the value of a key, dropping the least recently used value if
+        the cache is full
+
+        Args:
+            key (tuple): the key of the value
+            value: the value, not None
+        """
+        with self.guard:
+            self.values[key] = value
+            self.values.move_to_end(key)
+            if len(self.values) > self.size:
+                self.values.popitem(last=False)
 
 
 #-------------------- API -------------------#
@@ -79,9 +269,18 @@ app = FastAPI()
 
 VERSION = (2, 0)
 
+# The number of report bodies kept by the report cache
+REPORT_CACHE_SIZE = 256
+
+# The lock held while opening the DataManager of the app
+DATA_MANAGER_LOCK = threading.Lock()
+
+# The media type of each format of the transactions export
+EXPORT_MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
 @app.post("/reservations", status_code = 201)
 @version(VERSION[0], VERSION[1])
-def create_reservation(request: ReservationRequest):
+def create_reservation(request: ReservationRequest, session: Optional[dict] = Depends(session_staff)):
     """
     Create a (recurring) reservation. A recurring resrvation will
     be created if start_date is prior to end_date
@@ -116,12 +315,64 @@ def create_reservation(request: ReservationRequest):
             'detail': 'error message'
         }
     """
+    check_session_staff(session, request.staff_id, "Reservation")
     return handle_request(reserve_args(request), 201)
 
 
+@app.post("/reservations/batch", status_code = 200)
+@version(VERSION[0], VERSION[1])
+def create_reservations(request: BatchReservationRequest, session: Optional[dict] = Depends(session_staff)):
+    """
+    Create several (recurring) reservations at once, e.g. the schedule of a class.
+    The reservations are made in order, each one being checked against the
+    reservations made before it in the same batch. A reservation that fails
+    does not prevent the other ones from being made
+
+    - **reservations**: A list of reservations, in the format of POST /reservations
+
+    Returns:
+    
+        dict object
+
+    Example returns:
+
+        {   'status_code': '200', 
+		    'detail': [
+                {   'status_code': '201', 
+		            'detail': {
+        		        'reservation_id': '12',
+        		        'discount': '0',
+        		        'total_cost': '99.0', 
+        		        'down_payment': '0.0'
+    		        }
+	            },
+                {   'status_code': '400', 
+		            'detail': 'Reservation failed: Not enough available workshop, 15 already reserved'
+	            }
+            ]
+	    }
+    """
+    results = [None] * len(request.reservations)
+    requests, positions = [], []
+    for i, reservation in enumerate(request.reservations):
+        try:
+            check_session_staff(session, reservation.staff_id, "Reservation")
+            requests.append(reserve_args(reservation))
+            positions.append(i)
+        except HTTPException as e:
+            results[i] = {"status_code": e.status_code, "detail": e.detail}
+    for i, (success, result) in zip(positions, reserve.handle_batch(requests, get_data_manager())):
+        if success:
+            results[i] = success_response(201, result)
+        else:
+            results[i] = {"status_code": result["status_code"],
+                          "detail": f'{result["operation_name"]} failed: {result["detail"]}'}
+    return success_response(200, results)
+
+
 @app.delete("/reservations", status_code = 200)
 @version(VERSION[0], VERSION[1])
-def cancel_resrevation(request: CancellationRequest):
+def cancel_resrevation(request: CancellationRequest, session: Optional[dict] = Depends(session_staff)):
     """
     Cancel a reservation
 
@@ -147,12 +398,95 @@ def cancel_resrevation(request: CancellationRequest):
             'detail': 'error message'
         }
     """
+    check_session_staff(session, request.staff_id, "Cancellation")
     return handle_request(cancel_args(request))
 
 
-@app.get("/transactions", status_code = 200)
+@app.get("/transactions/summary", status_code = 200, dependencies = [Depends(session_staff)])
+@version(VERSION[0], VERSION[1])
+def get_transactions_summary(request: GetTransactionsSummaryRequest = Depends()):
+    """
+    Get the totals of the transactions recorded by the system between the
+    start date and end date: the number of reservations and cancellations,
+    the revenue (total cost of the reservations), the down payments and the
+    refunds, for the whole period or for each day, resource or staff<br>
+    Note: The start date must be given for the end date argument to be valid
+
+    - **start_date**: optional, the start date of the summary (default: today)
+    - **end_date**: optional, the end date of the summary (default: 7 days from start_date)
+    - **group_by**: optional, day, resource or staff (default: totals of the whole period only)
+
+    Returns:
+    
+        dict object
+
+    Example returns:
+    
+        On success:
+        {   'status_code': '200', 
+		    'detail': {
+                'start_date': '04-30-2022',
+                'end_date': '05-07-2022',
+                'total': {'reservations': 2, 'cancellations': 1, 'revenue': 10300.0,
+                          'down_payments': 5150.0, 'refunds': 0.0},
+                'group_by': 'resource',
+                'groups': [
+                    {'resource': 'extruder', 'reservations': 1, 'cancellations': 1,
+                     'revenue': 300.0, 'down_payments': 150.0, 'refunds': 0.0},
+                    {'resource': 'hvc', 'reservations': 1, 'cancellations': 0,
+                     'revenue': 10000.0, 'down_payments': 5000.0, 'refunds': 0.0}
+                ]
+    		}
+	    }
+
+        On error:
+        {   
+            'detail': 'error message'
+        }
+    """
+    return handle_request(summary_args(request))
+
+
+@app.get("/transactions/export", status_code = 200, dependencies = [Depends(session_staff)])
 @version(VERSION[0], VERSION[1])
-def get_transactions(request: GetTransactionRequest = Depends()):
+def export_transactions(request: ExportTransactionsRequest = Depends()):
+    """
+    Export all transactions recorded by the system between the start date and
+    end date, with the same fields as the transactions report. The export is
+    streamed as transactions are read, so it can cover any number of days<br>
+    Note: The start date must be given for the end date argument to be valid
+
+    - **start_date**: optional, the start date of the export (default: today)
+    - **end_date**: optional, the end date of the export (default: 7 days from start_date)
+    - **format**: optional, ndjson for one JSON object per line, or csv (default: ndjson)
+
+    Returns:
+
+        A stream of lines
+
+    Example returns:
+
+        On success, with format=ndjson:
+        {"transaction_id": 1, "transaction_type": "RESERVATION", "transaction_date": "4-30-2022", ...}
+        {"transaction_id": 2, "transaction_type": "RESERVATION", "transaction_date": "4-30-2022", ...}
+
+        On success, with format=csv:
+        transaction_id,transaction_type,transaction_date,reservation_id,customer_id,resource,total_cost,transaction_amount
+        1,RESERVATION,4-30-2022,1,hayder,extruder,300.0,150.0
+
+        On error:
+        {   
+            'detail': 'error message'
+        }
+    """
+    start_date, end_date, export_format = export_args(request)
+    lines = reserve.export_transactions(start_date, end_date, export_format, get_data_manager())
+    return StreamingResponse(lines, media_type=EXPORT_MEDIA_TYPES[export_format])
+
+
+@app.get("/transactions", status_code = 200, dependencies = [Depends(session_staff)])
+@version(VERSION[0], VERSION[1])
+def get_transactions(request: GetTransactionRequest = Depends(), if_none_match: Optional[str] = Header(None)):
     """
     Get a report of all transactions recorded by the system between the
     start date and end date<br>
@@ -160,6 +494,12 @@ def get_transactions(request: GetTransactionRequest = Depends()):
 
     - **start_date**: optional, the start date of the report to generate (default: today)
     - **end_date**: optional, the end date of the report to generate (default: 7 days from start_date)
+    - **limit**: optional, the maximum number of transactions to return, the report then
+        has a next_cursor, which is null on the last page (default: all transactions)
+    - **cursor**: optional, the next_cursor of the previous page (default: first page)
+
+    The response has an ETag header; if it is sent back in an If-None-Match header
+    and no data has changed since, the response is a 304 with no body
 
     Returns:
 
@@ -192,12 +532,92 @@ def get_transactions(request: GetTransactionRequest = Depends()):
             'detail': 'error message'
         }
     """
-    return handle_request(transaction_args(request))
+    return handle_report_request(transaction_args(request), if_none_match)
+
+
+@app.get("/availability", status_code = 200, dependencies = [Depends(session_staff)])
+@version(VERSION[0], VERSION[1])
+def get_availability(request: GetAvailabilityRequest = Depends()):
+    """
+    Get the number of a resource still available in every half hour slot of
+    every day between the start date and end date, for a reservation of 30
+    minutes, after applying the opening hours, capacity, harvester and cooldown
+    rules. The rules depending on the customer are not applied<br>
+    Note: The start date must be given for the end date argument to be valid
+
+    - **resource**: the resource to check the availability of
+    - **start_date**: optional, the first day to check (default: today)
+    - **end_date**: optional, the last day to check at most 30 days from start_date (default: 7 days from start_date)
+
+    Returns:
+    
+        dict object
+
+    Example returns:
+    
+        On success:
+        {   'status_code': '200', 
+		    'detail': {
+                'resource': 'microvac',
+                'availability': [
+                    {   'date': '05-10-2022',
+                        'slots': {'09:00': 2, '09:30': 1, ..., '17:30': 2}
+                    }
+                ]
+    		}
+	    }
+
+        On error:
+        {   
+            'detail': 'error message'
+        }
+    """
+    return handle_request(availability_args(request))
+
+
+@app.get("/reservations/suggest", status_code = 200, dependencies = [Depends(session_staff)])
+@version(VERSION[0], VERSION[1])
+def suggest_reservations(request: SuggestReservationsRequest = Depends()):
+    """
+    Get the earliest times at which a customer can reserve a resource within
+    the next 30 days, following all the reservation rules
+
+    - **customer_id**: Id of the customer who wants to make a reservation
+    - **resource**: Resource the customer wants to reserve
+    - **duration**: optional, the duration of the reservation in minutes (default: 30)
+    - **count**: optional, the maximum number of start times to suggest (default: 5)
+
+    Returns:
+    
+        dict object
+
+    Example returns:
+    
+        On success:
+        {   'status_code': '200', 
+		    'detail': {
+                'customer_id': 'hayder',
+                'resource': 'microvac',
+                'suggestions': [
+                    {   'start_date': '05-10-2022',
+                        'start_time': '09:00',
+                        'end_time': '10:00'
+                    }
+                ]
+    		}
+	    }
+
+        On error:
+        {   
+            'detail': 'error message'
+        }
+    """
+    return handle_request(suggest_args(request))
 
 
-@app.get("/reservations", status_code = 200)
+@app.get("/reservations", status_code = 200, dependencies = [Depends(session_staff)])
 @version(VERSION[0], VERSION[1])
-def get_reservation(request: GetReservationsRequest = Depends()):
+def get_reservation(request: GetReservationsRequest = Depends(), if_none_match: Optional[str] = Header(None)):
     """
     Get a report of all reservations currently in the system between the
     start date and end date, can specify a unique user to generate report for<br>
@@ -206,6 +626,12 @@ def get_reservation(request: GetReservationsRequest = Depends()):
     - **start_date**: optional, the start date of the report to generate (default: today)
     - **end_date**: optional, the end date of the report to generate (default: 7 days from start_date)
     - **customer_id**: optional, the customer to generate report on (default: '' to generate report on all customers)
+    - **limit**: optional, the maximum number of reservations to return, the report then
+        has a next_cursor, which is null on the last page (default: all reservations)
+    - **cursor**: optional, the next_cursor of the previous page (default: first page)
+
+    The response has an ETag header; if it is sent back in an If-None-Match header
+    and no data has changed since, the response is a 304 with no body
 
     Returns:
     
@@ -236,7 +662,7 @@ def get_reservation(request: GetReservationsRequest = Depends()):
             'detail': 'error message'
         }
     """
-    return handle_request(reservations_args(request))
+    return handle_report_request(reservations_args(request), if_none_match)
 
 
 @app.get("/login", status_code = 200)
@@ -244,7 +670,9 @@ def get_reservation(request: GetReservationsRequest = Depends()):
 def staff_login(request: StaffRequest):
     """
     Allow users to check if they are eligible for login (allowed if the user
-    exists in the staff database without forms of authentication)
+    exists in the staff database without forms of authentication), and start
+    a session. The token returned can be sent in an "Authorization: Bearer <token>"
+    header with the following requests, until it expires
 
     - **staff_id**: The ID of the staff trying to login
 
@@ -256,15 +684,22 @@ def staff_login(request: StaffRequest):
     
         {
 	    	"status_code": "200",
-	    	"detail": ""
+	    	"detail": {
+                "token": "eyJzdGFmZl9pZCI6...",
+                "expires_at": 1652000000
+            }
 	    }
     """
-    return handle_user_management_web("LOGIN", request, 200, "LOGIN")
+    result = handle_user_management_web("LOGIN", request, 200, "LOGIN")
+    token, expires_at = issue_session_token(request.staff_id, parse_session_config(get_settings()),
+                                            staff_role(request.staff_id, config=get_settings()))
+    result["detail"] = {"token": token, "expires_at": expires_at}
+    return result
 
 
 @app.post("/staffs", status_code = 201)
 @version(VERSION[0], VERSION[1])
-def post_staffs(request: PostStaffsRequest):
+def post_staffs(request: PostStaffsRequest, session: Optional[dict] = Depends(session_staff)):
     """
     Create a new staff user, with default permission role of REGULAR staff.
     
@@ -283,11 +718,12 @@ def post_staffs(request: PostStaffsRequest):
 	    	"detail": "New Staff with ID <staff_id> has been created"
 	    }
     """
-    return handle_user_management_web("POST", request, 201, "CREATE STAFF")
+    session_role = check_session_staff(session, request.staff_id, "CREATE STAFF")
+    return handle_user_management_web("POST", request, 201, "CREATE STAFF", session_role)
 
 @app.put("/staffs", status_code = 200)
 @version(VERSION[0], VERSION[1])
-def put_staffs(request: PutStaffsRequest):
+def put_staffs(request: PutStaffsRequest, session: Optional[dict] = Depends(session_staff)):
     """
     Create a new staff user, with default permission role of REGULAR staff.
     
@@ -307,11 +743,42 @@ def put_staffs(request: PutStaffsRequest):
 	    }
 
     """
-    return handle_user_management_web("PUT", request, 200, "UPDATE_STAFF")
+    session_role = check_session_staff(session, request.staff_id, "UPDATE_STAFF")
+    return handle_user_management_web("PUT", request, 200, "UPDATE_STAFF", session_role)
+
+@app.put("/staffs/bulk", status_code = 200)
+@version(VERSION[0], VERSION[1])
+def put_staffs_bulk(request: BulkStaffsRequest, session: Optional[dict] = Depends(session_staff)):
+    """
+    Sync the staff users with a roster, e.g. exported from HR. The staff of the
+    roster are created or updated, and if the roster is full the staff missing
+    from it are deleted. Nothing is changed if no Admin would remain.
+    
+    - **roster**: The role of each staff, e.g. {"hanzeh": "ADMIN", "yusen": "REGULAR"}
+    - **full**: optional, true to delete the staff missing from the roster (default: false)
+    - **staff_id**: The ID of the staff making the request
+
+    Returns:
+    
+        dict object
+
+    Example returns:
+    
+        {
+	    	"status_code": "200",
+	    	"detail": {
+                "created": 1, "updated": 0, "deleted": 0, "unchanged": 1, "invalid": 0,
+                "results": {"hanzeh": {"outcome": "unchanged"}, "yusen": {"outcome": "created"}}
+            }
+	    }
+
+    """
+    session_role = check_session_staff(session, request.staff_id, "SYNC_STAFFS")
+    return handle_user_management_web("BULK", request, 200, "SYNC_STAFFS", session_role)
 
 @app.delete("/staffs", status_code = 200)
 @version(VERSION[0], VERSION[1])
-def delete_staffs(request: DeleteStaffsRequest):
+def delete_staffs(request: DeleteStaffsRequest, session: Optional[dict] = Depends(session_staff)):
     """
     Create a new staff user, with default permission role of REGULAR staff.
     
@@ -330,13 +797,87 @@ def delete_staffs(request: DeleteStaffsRequest):
 	    }
 
     """
-    return handle_user_management_web("DELETE", request, 200, "DELETE_STAFF")
+    session_role = check_session_staff(session, request.staff_id, "DELETE_STAFF")
+    return handle_user_management_web("DELETE", request, 200, "DELETE_STAFF", session_role)
 
+@app.get("/staffs", status_code = 200)
+@version(VERSION[0], VERSION[1])
+def get_staffs(request: GetStaffsRequest = Depends(), session: Optional[dict] = Depends(session_staff)):
+    """
+    List the staff users, or only the ones having a role.
+    
+    - **staff_role**: optional, ADMIN or REGULAR (default: all staff)
+    - **staff_id**: The ID of the staff making the request
 
-app = VersionedFastAPI(app)
+    Returns:
+    
+        dict object
+
+    Example returns:
+    
+        {
+	    	"status_code": "200",
+	    	"detail": {
+                "staffs": [
+                    {"staff_id": "hanzeh", "staff_role": "ADMIN"}
+                ]
+            }
+	    }
+
+    """
+    session_role = check_session_staff(session, request.staff_id, "GET_STAFFS")
+    return handle_user_management_web("GET", request, 200, "GET_STAFFS", session_role)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Load the settings and the reservation data once when the server starts,
+    they are then kept in memory and shared by all requests. The settings are
+    reloaded when config.json changes or the server receives a SIGHUP
+    """
+    settings.install_reload_signal(get_settings())
+    get_data_manager()
+    yield
+
+
+app = VersionedFastAPI(app, lifespan=lifespan)
 
 ## --------------------- HANDLER FUNCTIONS --------------------- ##
 
+def get_settings():
+    """
+    Return the settings of the app, the process-wide settings if they have
+    not been set
+
+    Returns:
+        A Settings object
+    """
+    if getattr(app.state, "settings", None) is None:
+        app.state.settings = settings.get_settings()
+    return app.state.settings
+
+
+def get_data_manager():
+    """
+    Return the process-resident DataManager of the app, loading it from the
+    data file if it has not been loaded yet, or if the data file, backend or
+    journal options have changed since the settings were last reloaded.
+    Requests already running keep using the DataManager they started with
+
+    Returns:
+        A DataManager object
+    """
+    options = reserve.data_manager_options(get_settings())
+    with DATA_MANAGER_LOCK:
+        if getattr(app.state, "data_manager", None) is None or app.state.data_manager_options != options:
+            app.state.data_manager = reserve.open_data_manager(get_settings())
+            app.state.data_manager_options = options
+            # The versions of the reports cached are those of the previous DataManager
+            app.state.report_cache = None
+        return app.state.data_manager
+
+
 def handle_request(request, success_code=200):
     """
     Handle a request by invoking the reservation system
@@ -352,13 +893,76 @@ def handle_request(request, success_code=200):
     Returns:
         A dict object containing status code and detail information
     """
-    success, result = reserve.handle_request(request)
+    success, result = reserve.handle_request(request, get_data_manager())
     if not success:
         handle_error(result["status_code"], result["operation_name"], result["detail"])
     return success_response(success_code, result)
 
 
-def handle_user_management_web(command, request, success_code, operation):
+def get_report_cache():
+    """
+    Return the cache of report bodies of the app, creating it if it has not
+    been created yet
+
+    Returns:
+        An LRUCache object
+    """
+    if getattr(app.state, "report_cache", None) is None:
+        app.state.report_cache = LRUCache(REPORT_CACHE_SIZE)
+    return app.state.report_cache
+
+
+def handle_report_request(request, if_none_match=None):
+    """
+    Handle a report request by invoking the reservation system, unless the
+    same report has already been generated from the current version of the data.
+    Reports are cached as serialized bodies, with an ETag computed from the body
+
+    Args:
+        request (List[str]): the request to be handled
+        if_none_match (str): OPTIONAL, the If-None-Match header of the request
+
+    Raises:
+        HTTPException Error: if the request violates any constraints specified
+        in A-01
+
+    Returns:
+        A Response with the JSON body and ETag of the report, or a 304
+        Response if the report still has the ETag given in if_none_match
+    """
+    # The version is read before the report is generated, so that a report
+    # is never cached under an older version than the data it was made from
+    # The cache is read after the DataManager, as it is emptied when a new
+    # DataManager is opened
+    key = (tuple(request), get_data_manager().data_version())
+    report_cache = get_report_cache()
+    report = report_cache.get(key)
+    if report is None:
+        body = json.dumps(handle_request(request), separators=(",", ":")).encode()
+        report = (f'"{hashlib.sha1(body).hexdigest()}"', body)
+        report_cache.put(key, report)
+    etag, body = report
+    if if_none_match is not None and etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
+def etag_matches(etag, if_none_match):
+    """
+    Check if an ETag is one of the ETags of an If-None-Match header
+
+    Args:
+        etag (str): the ETag of the current response
+        if_none_match (str): the If-None-Match header of the request
+
+    Returns:
+        True if the ETag matches, False otherwise
+    """
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.replace("W/", "", 1) == etag for tag in tags)
+
+
+def handle_user_management_web(command, request, success_code, operation, session_role=None):
     """
     Handle a request by invoking the reservation system
     
@@ -367,6 +971,8 @@ def handle_user_management_web(command, request, success_code, operation):
         request (StaffRequest): The model that contains all request data
         success_code (int): the status code to return when handling succeeds
         operation (str): The type of operation being performed, used in output
+        session_role (str): OPTIONAL, the role of the staff held by its
+            session token, see check_session_staff
     
     Raises:
         HTTPException Error: if the request violates any constraints
@@ -374,7 +980,7 @@ def handle_user_management_web(command, request, success_code, operation):
     Returns:
         A dict object containing status code and detail information
     """
-    result = handle_user_management_request(command, request)
+    result = handle_user_management_request(command, request, config=get_settings(), session_role=session_role)
     if result["status_code"] != success_code:
         handle_error(result["status_code"], operation, result["detail"])
     return result
@@ -551,14 +1157,133 @@ def transaction_args(request: GetTransactionRequest):
         not date_format_is_correct(request.end_date):
             handle_error(400, "Get Transactions", "date format incorrect")
             
+    if request.limit is not None and request.limit <= 0:
+        handle_error(400, "Get Transactions", "limit must be positive")
+            
     if request.start_date == None:
         request.start_date = get_today_date()
         request.end_date = date_after_7days(request.start_date)
     elif request.end_date == None:
         request.end_date = date_after_7days(request.start_date)
+    if request.limit is not None or request.cursor is not None:
+        return ["financial", request.start_date, request.end_date, request.limit, request.cursor]
     return ["financial", request.start_date, request.end_date]
 
 
+def export_args(request: ExportTransactionsRequest):
+    """
+    Check the format of arguments in the transactions export request, if
+    formatting is correct, return the arguments of reserve.export_transactions
+    
+    Args:
+        request (ExportTransactionsRequest): inputs received from API endpoint
+
+    Raises:
+        HTTPException Error: Dates in wrong format
+        HTTPException Error: Unknown format
+
+    Returns:
+        (start_date, end_date, format) of the export
+    """
+    if  not date_format_is_correct(request.start_date) or \
+        not date_format_is_correct(request.end_date):
+            handle_error(400, "Export Transactions", "date format incorrect")
+    if request.format not in (None, 'ndjson', 'csv'):
+        handle_error(400, "Export Transactions", "format must be ndjson or csv")
+
+    if request.start_date == None:
+        request.start_date = get_today_date()
+        request.end_date = date_after_7days(request.start_date)
+    elif request.end_date == None:
+        request.end_date = date_after_7days(request.start_date)
+    return request.start_date, request.end_date, request.format or 'ndjson'
+
+
+def availability_args(request: GetAvailabilityRequest):
+    """
+    Check the format of arguments in the availability request, if formatting
+    is correct, return a list of arguments to be sent to the reservation system
+    
+    Args:
+        request (GetAvailabilityRequest): inputs received from API endpoint
+
+    Raises:
+        HTTPException Error: Dates in wrong format
+
+    Returns:
+        List of command and arguments to sent to reservation system to generate
+        an availability report
+    """
+    if  not date_format_is_correct(request.start_date) or \
+        not date_format_is_correct(request.end_date):
+            handle_error(400, "Get Availability", "date format incorrect")
+
+    if request.start_date == None:
+        request.start_date = get_today_date()
+        request.end_date = date_after_7days(request.start_date)
+    elif request.end_date == None:
+        request.end_date = date_after_7days(request.start_date)
+    return ["availability", request.resource, request.start_date, request.end_date]
+
+
+def suggest_args(request: SuggestReservationsRequest):
+    """
+    Check the arguments of the suggest reservations request, if they are
+    correct, return a list of arguments to be sent to the reservation system
+    
+    Args:
+        request (SuggestReservationsRequest): inputs received from API endpoint
+
+    Raises:
+        HTTPException Error: Empty customer_id
+        HTTPException Error: Duration not a positive multiple of 30 minutes
+        HTTPException Error: Count not positive
+
+    Returns:
+        List of command and arguments to sent to reservation system to
+        suggest reservations
+    """
+    if request.customer_id == "":
+        handle_error(400, "Suggest Reservations", "Empty customer_id")
+    if request.duration <= 0 or request.duration % 30 != 0:
+        handle_error(400, "Suggest Reservations", "duration must be a positive multiple of 30 minutes")
+    if request.count <= 0:
+        handle_error(400, "Suggest Reservations", "count must be positive")
+    return ["suggest", request.customer_id, request.resource, request.duration,
+            get_today_date(), request.count]
+
+
+def summary_args(request: GetTransactionsSummaryRequest):
+    """
+    Check the format of arguments in the transactions summary request, if
+    formatting is correct, return a list of arguments to be sent to the
+    reservation system
+    
+    Args:
+        request (GetTransactionsSummaryRequest): inputs received from API endpoint
+
+    Raises:
+        HTTPException Error: Dates in wrong format
+        HTTPException Error: Unknown group_by
+
+    Returns:
+        List of command and arguments to sent to reservation system to generate
+        a transactions summary
+    """
+    if  not date_format_is_correct(request.start_date) or \
+        not date_format_is_correct(request.end_date):
+            handle_error(400, "Get Transactions Summary", "date format incorrect")
+    if request.group_by not in (None, 'day', 'resource', 'staff'):
+        handle_error(400, "Get Transactions Summary", "group_by must be day, resource or staff")
+
+    if request.start_date == None:
+        request.start_date = get_today_date()
+        request.end_date = date_after_7days(request.start_date)
+    elif request.end_date == None:
+        request.end_date = date_after_7days(request.start_date)
+    return ["summary", request.start_date, request.end_date, request.group_by or '']
+
+
 def reservations_args(request: GetReservationsRequest):
     """
     Check the format of arguments in the get reservations request, if formatting
@@ -577,6 +1302,8 @@ def reservations_args(request: GetReservationsRequest):
     if  not date_format_is_correct(request.start_date) or \
         not date_format_is_correct(request.end_date):
             handle_error(400, "Get Reservations", "date format incorrect")
+    if request.limit is not None and request.limit <= 0:
+        handle_error(400, "Get Reservations", "limit must be positive")
 
     if request.start_date == None:
         request.start_date = get_today_date()
@@ -584,6 +1311,9 @@ def reservations_args(request: GetReservationsRequest):
     elif request.end_date == None:
         request.end_date = date_after_7days(request.start_date)
     
+    if request.limit is not None or request.cursor is not None:
+        return ["reservations", request.start_date, request.end_date, request.customer_id or "",
+                request.limit, request.cursor]
     if request.customer_id == None:
         return ["reservations", request.start_date, request.end_date]
     else: